@@ -138,6 +138,15 @@ class DebugCommandsClass(BaseEditCommandsClass):
     def pdb(self, event=None):
         '''Fall into pdb.'''
         g.pdb()
+    #@+node:ekr.20180906083012.2: *3* debug.printDirectiveStats
+    @cmd('show-directive-stats')
+    def printDirectiveStats(self, event=None):
+        '''Print statistics about scanning directives.'''
+        c = self.c
+        hits, misses = c.directiveCacheHits, c.directiveCacheMisses
+        g.es_print('directive cache: %s hits, %s misses, %2.1f%% hit rate' % (
+            hits, misses, 100.0 * hits / max(1, hits + misses)))
+        g.es_print('c.scanAtPathDirectives: %s calls' % c.scanAtPathDirectivesCount)
     #@+node:ekr.20150514063305.110: *3* debug.printFocus
     @cmd('show-focus')
     def printFocus(self, event=None):
@@ -11,6 +11,7 @@ try:
 except ImportError:
     import __builtin__ as builtins # Python 2.
 # import glob
+import hashlib
 import importlib
 import io
 import os
@@ -18,10 +19,11 @@ import optparse
 import subprocess
 import string
 import sys
-# import time
+import time
 import traceback
 import zipfile
 import platform
+import re
 if g.isPython3:
     StringIO = io.StringIO
 else:
@@ -262,12 +264,12 @@ class LeoApp(object):
         #@+<< LeoApp: global reader/writer data >>
         #@+node:ekr.20170302075110.1: *5* << LeoApp: global reader/writer data >>
         # From leoAtFile.py.
-        self.atAutoWritersDict = {}
-        self.writersDispatchDict = {}
+        self.atAutoWritersDict = PluginClassDict()
+        self.writersDispatchDict = PluginClassDict()
         # From leoImport.py
-        self.atAutoDict = {}
+        self.atAutoDict = PluginClassDict()
             # Keys are @auto names, values are scanner classes.
-        self.classDispatchDict = {}
+        self.classDispatchDict = PluginClassDict()
         #@-<< LeoApp: global reader/writer data >>
         #@+<< LeoApp: global status vars >>
         #@+node:ekr.20161028040054.1: *5* << LeoApp: global status vars >>
@@ -288,6 +290,9 @@ class LeoApp(object):
             # True: late bindings are not allowed.
         self.killed = False
             # True: we are about to destroy the root window.
+        self.lazySubCommanders = False
+            # True: commanders using the null gui create most subcommanders
+            # when first used. Set by leoBridge.controller.
         self.openingSettingsFile = False
             # True, opening a settings file.
         self.preReadFlag = False
@@ -1475,8 +1480,9 @@ class LeoApp(object):
         d = g.app.atAutoDict
         for key in d.keys():
             # pylint: disable=cell-var-from-loop
-            aClass = d.get(key)
-            if aClass and g.match_word(p.h, 0, key):
+            # Match the key first: getting a class may import its module.
+            aClass = g.match_word(p.h, 0, key) and d.get(key)
+            if aClass:
 
                 def scanner_for_at_auto_cb(c, parent, s, **kwargs):
                     try:
@@ -1815,7 +1821,7 @@ class LoadManager(object):
         # Step 2: look for the @string theme-name setting in the first loaded file.
         # This is a hack, but especially useful for test*.leo files in leo/themes.
         path = lm.files and lm.files[0]
-        if path and g.os_path_exists(path):
+        if path and g.os_path_exists(path) and lm.hasSettingsTree(path):
             # Tricky: we must call lm.computeLocalSettings *here*.
             theme_c = lm.openSettingsFile(path)
             if theme_c:
@@ -1974,7 +1980,9 @@ class LoadManager(object):
         # the global settings, that is, settings in myLeoSettings.leo.
         isLeoSettings = g.shortFileName(fn).lower() == 'leosettings.leo'
         exists = g.os_path_exists(fn)
-        if fn and exists and lm.isLeoFile(fn) and not isLeoSettings:
+        if (fn and exists and lm.isLeoFile(fn) and not isLeoSettings and
+            lm.hasSettingsTree(fn)
+        ):
             # Open the file usinging a null gui.
             try:
                 g.app.preReadFlag = True
@@ -1991,11 +1999,28 @@ class LoadManager(object):
             d2.setName(shortcutsName)
             return PreviousSettings(d1, d2)
         #
-        # The file does not exist, or is not valid.
+        # The file does not exist, is not valid, or has no @settings tree.
         # Get the settings from the globals settings dicts.
         d1 = lm.globalSettingsDict.copy(settingsName)
         d2 = lm.globalBindingsDict.copy(shortcutsName)
         return PreviousSettings(d1, d2)
+    #@+node:ekr.20180907050312.1: *4* LM.hasSettingsTree
+    def hasSettingsTree(self, fn):
+        '''
+        Return False if fn is a .leo file that can not contain an @settings
+        tree. This scans the file's xml, which is much faster than reading
+        the outline. Return True if fn might contain an @settings tree.
+        '''
+        lm = self
+        if not fn or not fn.endswith('.leo') or lm.isZippedFile(fn):
+            return True
+        try:
+            with open(fn, 'rb') as f:
+                s = f.read()
+        except Exception:
+            return True
+        # c.config.settingsRoot requires p.h.rstrip() == '@settings'.
+        return b'<vh>@settings' in s
     #@+node:ekr.20120214132927.10723: *4* LM.mergeShortcutsDicts & helpers
     def mergeShortcutsDicts(self, c, old_d, new_d, localFlag):
         '''
@@ -2156,14 +2181,28 @@ class LoadManager(object):
         c.openDirectory = frame.openDirectory = g.os_path_dirname(fn)
         g.app.gui = oldGui
         return c if ok else None
-    #@+node:ekr.20120213081706.10382: *4* LM.readGlobalSettingsFiles
+    #@+node:ekr.20120213081706.10382: *4* LM.readGlobalSettingsFiles & helpers
     def readGlobalSettingsFiles(self):
-        '''Read leoSettings.leo and myLeoSettings.leo using a null gui.'''
+        '''
+        Read leoSettings.leo and myLeoSettings.leo using a null gui.
+
+        Use the settings snapshot instead if none of the files that
+        determine the global settings have changed.
+        '''
         trace = 'themes' in g.app.debug
+        trace_startup = 'startup' in g.app.debug
+        t1 = time.time()
         lm = self
+        paths = [lm.computeLeoSettingsPath(), lm.computeMyLeoSettingsPath()]
+        key = lm.computeSettingsSnapshotKey(paths)
+        if key and lm.loadSettingsSnapshot(key):
+            if trace_startup:
+                g.trace('loaded settings snapshot: %5.3f sec.' % (time.time() - t1))
+            return
+        config = g.app.config
+        n_buttons = len(config.atCommonButtonsList) + len(config.atCommonCommandsList)
         # Open the standard settings files with a nullGui.
         # Important: their commanders do not exist outside this method!
-        paths = [lm.computeLeoSettingsPath(), lm.computeMyLeoSettingsPath()]
         old_commanders = g.app.commanders()
         commanders = [lm.openSettingsFile(path) for path in paths]
         commanders = [z for z in commanders if z]
@@ -2207,6 +2246,121 @@ class LoadManager(object):
         for c in commanders:
             if c not in old_commanders:
                 g.app.forgetOpenFile(c.fileName())
+        # @button and @command nodes in @settings trees become positions,
+        # which can not be pickled.
+        if key and n_buttons == (
+            len(config.atCommonButtonsList) + len(config.atCommonCommandsList)
+        ):
+            lm.saveSettingsSnapshot(key, theme_path)
+        if trace_startup:
+            g.trace('read settings files: %5.3f sec.' % (time.time() - t1))
+    #@+node:ekr.20180907050312.2: *5* LM.computeSettingsSnapshotKey
+    def computeSettingsSnapshotKey(self, paths):
+        '''
+        Return a key describing everything that determines the global
+        settings, or None if lm.readGlobalSettingsFiles must read the
+        settings files.
+
+        paths is the list of settings files to be read.
+        '''
+        lm = self
+        if g.app.db is None or g.app.trace_setting:
+            return None
+        # lm.computeThemeFilePath reads the @settings tree in lm.files[0].
+        fn = lm.files and lm.files[0]
+        if fn and g.os_path_exists(fn) and lm.hasSettingsTree(fn):
+            paths = paths + [fn]
+        files, env = [], []
+        for path in paths:
+            if not path:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    s = f.read()
+            except Exception:
+                return None
+            files.append((path, hashlib.md5(s).hexdigest()))
+            # The settings in @ifenv trees depend on environment variables.
+            for m in re.finditer(br'<vh>@ifenv\s+([^,<\s]+)', s):
+                name = g.toUnicode(m.group(1))
+                env.append((name, os.getenv(name)))
+        import leo.core.leoVersion as leoVersion
+        return (
+            leoVersion.version,
+            sys.platform, # For @ifplatform.
+            lm.computeMachineName(), # For @ifhostname.
+            lm.options.get('theme_path'),
+            tuple(files),
+            tuple(env),
+        )
+    #@+node:ekr.20180907050312.3: *5* LM.fileDigest
+    def fileDigest(self, path):
+        '''Return the md5 digest of the file's contents, or None.'''
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except Exception:
+            return None
+    #@+node:ekr.20180907050312.4: *5* LM.loadSettingsSnapshot
+    def loadSettingsSnapshot(self, key):
+        '''
+        Set lm.globalSettingsDict, lm.globalBindingsDict and the other
+        global settings from the settings snapshot in g.app.db.
+
+        Return False if the snapshot does not exist or is out of date.
+        '''
+        lm = self
+        try:
+            d = g.app.db.get('global-settings-snapshot')
+            if not d or d.get('key') != key:
+                return False
+            theme_path, theme_digest = d.get('theme')
+            if theme_path and lm.fileDigest(theme_path) != theme_digest:
+                return False
+            settings_d, bindings_d, config_d = (
+                d.get('settings'), d.get('bindings'), d.get('config'))
+            if not g.isTypedDict(settings_d) or not bindings_d or not config_d:
+                return False
+        except Exception:
+            # The snapshot is corrupt, or Leo's classes have changed.
+            return False
+        for name, val in config_d.items():
+            setattr(g.app.config, name, val)
+        lm.globalSettingsDict = settings_d
+        lm.globalBindingsDict = bindings_d
+        if theme_path:
+            g.app.theme_directory = g.os_path_dirname(theme_path)
+                # Used by the StyleSheetManager.
+        return True
+    #@+node:ekr.20180907050312.5: *5* LM.saveSettingsSnapshot
+    def saveSettingsSnapshot(self, key, theme_path):
+        '''Save the global settings in g.app.db.'''
+        lm = self
+        tag = 'global-settings-snapshot'
+        # The ivars of g.app.config set by the settings parser.
+        ivars = (
+            'buttonsFileName', 'context_menus',
+            'enabledPluginsFileName', 'enabledPluginsString',
+            'menusFileName', 'menusList',
+            'modeCommandsDict', 'unitTestDict',
+        )
+        try:
+            if not g.app.config.getBool('use-settings-snapshot', default=True):
+                if tag in g.app.db:
+                    del g.app.db[tag]
+                return
+            theme = (theme_path, lm.fileDigest(theme_path) if theme_path else None)
+            config_d = dict([(name, getattr(g.app.config, name, None))
+                for name in ivars])
+            g.app.db[tag] = {
+                'bindings': lm.globalBindingsDict,
+                'config': config_d,
+                'key': key,
+                'settings': lm.globalSettingsDict,
+                'theme': theme,
+            }
+        except Exception:
+            g.es_exception()
     #@+node:ekr.20120214165710.10838: *4* LM.traceSettingsDict
     def traceSettingsDict(self, d, verbose=False):
         if verbose:
@@ -2439,23 +2593,24 @@ class LoadManager(object):
             for fn in g.glob_glob(pattern):
                 sfn = g.shortFileName(fn)
                 if sfn != '__init__.py':
-                    try:
-                        module_name = sfn[: -3]
-                        # Important: use importlib to give imported modules
-                        # their fully qualified names.
-                        m = importlib.import_module(
-                            'leo.plugins.importers.%s' % module_name)
-                        self.parse_importer_dict(sfn, m)
-                    except Exception:
-                        g.warning('can not import leo.plugins.importers.%s' % (
-                            module_name))
+                    module_name = 'leo.plugins.importers.%s' % sfn[: -3]
+                    importer_d = self.scanPluginDict(fn, module_name, 'importer_dict')
+                    if importer_d is None:
+                        try:
+                            # Important: use importlib to give imported modules
+                            # their fully qualified names.
+                            m = importlib.import_module(module_name)
+                            importer_d = getattr(m, 'importer_dict', None)
+                        except Exception:
+                            g.warning('can not import %s' % module_name)
+                            continue
+                    self.parse_importer_dict(sfn, importer_d)
     #@+node:ekr.20140723140445.18076: *7* LM.parse_importer_dict
-    def parse_importer_dict(self, sfn, m):
+    def parse_importer_dict(self, sfn, importer_d):
         '''
         Set entries in g.app.classDispatchDict, g.app.atAutoDict and
-        g.app.atAutoNames using entries in m.importer_dict.
+        g.app.atAutoNames using entries in importer_d, an importer_dict.
         '''
-        importer_d = getattr(m, 'importer_dict', None)
         if importer_d:
             at_auto = importer_d.get('@auto', [])
             scanner_class = importer_d.get('class', None)
@@ -2487,8 +2642,8 @@ class LoadManager(object):
         if trace:
             # Suppress multiple traces.
             g.app.debug_dict['createWritersData'] = True
-        g.app.writersDispatchDict = {}
-        g.app.atAutoWritersDict = {}
+        g.app.writersDispatchDict = PluginClassDict()
+        g.app.atAutoWritersDict = PluginClassDict()
         plugins1 = g.os_path_finalize_join(g.app.homeDir, '.leo', 'plugins')
         plugins2 = g.os_path_finalize_join(g.app.loadDir, '..', 'plugins')
         for kind, plugins in (('home', plugins1), ('leo', plugins2)):
@@ -2497,13 +2652,18 @@ class LoadManager(object):
             for fn in g.glob_glob(pattern):
                 sfn = g.shortFileName(fn)
                 if sfn != '__init__.py':
-                    try:
-                        # Important: use importlib to give imported modules their fully qualified names.
-                        m = importlib.import_module('leo.plugins.writers.%s' % sfn[: -3])
-                        self.parse_writer_dict(sfn, m)
-                    except Exception:
-                        g.es_exception()
-                        g.warning('can not import leo.plugins.writers.%s' % sfn)
+                    module_name = 'leo.plugins.writers.%s' % sfn[: -3]
+                    writer_d = self.scanPluginDict(fn, module_name, 'writer_dict')
+                    if writer_d is None:
+                        try:
+                            # Important: use importlib to give imported modules their fully qualified names.
+                            m = importlib.import_module(module_name)
+                            writer_d = getattr(m, 'writer_dict', None)
+                        except Exception:
+                            g.es_exception()
+                            g.warning('can not import %s' % module_name)
+                            continue
+                    self.parse_writer_dict(sfn, writer_d)
         if trace:
             g.trace('LM.writersDispatchDict')
             g.printDict(g.app.writersDispatchDict)
@@ -2511,12 +2671,11 @@ class LoadManager(object):
             g.printDict(g.app.atAutoWritersDict)
         # Creates problems: https://github.com/leo-editor/leo-editor/issues/40
     #@+node:ekr.20140728040812.17991: *7* LM.parse_writer_dict
-    def parse_writer_dict(self, sfn, m):
+    def parse_writer_dict(self, sfn, writer_d):
         '''
         Set entries in g.app.writersDispatchDict and g.app.atAutoWritersDict
-        using entries in m.writers_dict.
+        using entries in writer_d, a writer_dict.
         '''
-        writer_d = getattr(m, 'writer_dict', None)
         if writer_d:
             at_auto = writer_d.get('@auto', [])
             scanner_class = writer_d.get('class', None)
@@ -2525,10 +2684,10 @@ class LoadManager(object):
                 # Make entries for each @auto type.
                 d = g.app.atAutoWritersDict
                 for s in at_auto:
-                    aClass = d.get(s)
+                    aClass = d.get_raw(s)
                     if aClass and aClass != scanner_class:
-                        g.trace('%s: duplicate %s class %s in %s:' % (
-                            sfn, s, aClass.__name__, m.__file__))
+                        g.trace('%s: duplicate %s class %s' % (
+                            sfn, s, d.className(s)))
                     else:
                         d[s] = scanner_class
                         g.app.atAutoNames.add(s)
@@ -2536,14 +2695,51 @@ class LoadManager(object):
                 # Make entries for each extension.
                 d = g.app.writersDispatchDict
                 for ext in extensions:
-                    aClass = d.get(ext)
+                    aClass = d.get_raw(ext)
                     if aClass and aClass != scanner_class:
                         g.trace('%s: duplicate %s class' % (sfn, ext),
-                            aClass, scanner_class)
+                            d.className(ext), scanner_class)
                     else:
                         d[ext] = scanner_class
         elif sfn not in ('basewriter.py',):
             g.warning('leo/plugins/writers/%s has no writer_dict' % sfn)
+    #@+node:ekr.20180907062214.1: *6* LM.scanPluginDict
+    def scanPluginDict(self, fn, module_name, dict_name):
+        '''
+        Return the importer_dict or writer_dict of the given plugin file
+        without importing the plugin. The 'class' entry becomes a
+        (module_name, class_name) tuple, which PluginClassDict imports
+        only when some code first gets the class.
+
+        Return {} if the file defines no such dict, or None if the dict is
+        not a literal that this method understands.
+        '''
+        import ast
+        try:
+            with open(fn, 'rb') as f:
+                s = g.toUnicode(f.read())
+        except Exception:
+            return None
+        m = re.search(r'^%s\s*=\s*\{' % dict_name, s, re.MULTILINE)
+        if not m:
+            return {}
+        i = s.find('\n}', m.end())
+        if i == -1:
+            return None
+        try:
+            node = ast.parse(s[m.start(): i + 2]).body[0].value
+            d = {}
+            for key_node, val_node in zip(node.keys, node.values):
+                key = ast.literal_eval(key_node)
+                if key == 'class':
+                    if not isinstance(val_node, ast.Name):
+                        return None
+                    d[key] = (module_name, val_node.id)
+                else:
+                    d[key] = ast.literal_eval(val_node)
+            return d
+        except Exception:
+            return None
     #@+node:ekr.20120219154958.10478: *5* LM.createGui
     def createGui(self, pymacs):
         lm = self
@@ -3304,6 +3500,59 @@ class LoadManager(object):
             c.fileCommands.getLeoFile(theFile, fn, checkOpenFiles=False)
                 # Closes the file.
     #@-others
+#@+node:ekr.20180907062214.2: ** class PluginClassDict
+class PluginClassDict(dict):
+    '''
+    A dict whose values are importer or writer classes.
+
+    A value may also be a (module_name, class_name) tuple, created by
+    LM.scanPluginDict. Getting such a value imports the module and replaces
+    the tuple by the class.
+    '''
+    #@+others
+    #@+node:ekr.20180907062214.3: *3* pcd.__getitem__ & get
+    def __getitem__(self, key):
+        val = dict.__getitem__(self, key)
+        if isinstance(val, tuple):
+            val = self.importClass(val)
+        return val
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    #@+node:ekr.20180907062214.4: *3* pcd.get_raw & className
+    def get_raw(self, key):
+        '''Return the class or tuple for key, without importing anything.'''
+        return dict.get(self, key)
+
+    def className(self, key):
+        '''Return the name of key's class, without importing anything.'''
+        val = dict.get(self, key)
+        if isinstance(val, tuple):
+            return val[1]
+        return val.__name__ if val else None
+    #@+node:ekr.20180907062214.5: *3* pcd.importClass
+    def importClass(self, val):
+        '''Import the class described by val, a (module_name, class_name) tuple.'''
+        module_name, class_name = val
+        try:
+            m = importlib.import_module(module_name)
+            aClass = getattr(m, class_name)
+        except Exception:
+            g.es_exception()
+            g.warning('can not import %s.%s' % (module_name, class_name))
+            aClass = None
+        # Update all keys, so the module is imported only once.
+        for key2 in self.keys():
+            if dict.__getitem__(self, key2) == val:
+                dict.__setitem__(self, key2, aClass)
+        return aClass
+    #@+node:ekr.20180907062214.6: *3* pcd.items & values
+    def items(self):
+        return [(key, self[key]) for key in list(self.keys())]
+
+    def values(self):
+        return [self[key] for key in list(self.keys())]
+    #@-others
 #@+node:ekr.20120223062418.10420: ** class PreviousSettings
 class PreviousSettings(object):
     '''A class holding the settings and shortcuts dictionaries
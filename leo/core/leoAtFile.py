@@ -9,10 +9,14 @@
 import leo.core.leoGlobals as g
 import leo.core.leoBeautify as leoBeautify
 import leo.core.leoNodes as leoNodes
+import hashlib
 import os
 import re
+import stat
 import sys
+import threading
 import time
+import traceback
 #@-<< imports >>
 #@+others
 #@+node:ekr.20160514120655.1: ** class AtFile
@@ -57,6 +61,30 @@ class AtFile(object):
         self.checkPythonCodeOnWrite = False
         self.runPyFlakesOnWrite = False
         self.underindentEscapeString = '\\-'
+        self.useReadCache = True
+        self.readCacheHits = 0 # Statistics for at.readWithCache.
+        self.readCacheMisses = 0
+        self.pendingReads = None
+            # Set by at.readAll when scanning files in worker processes.
+        self.readWorkers = 0
+        self.pythonChecks = []
+            # g.Bunches describing checks running in worker processes.
+        self.pythonCheckIdle = False
+            # True: at.onPythonCheckIdle is an idle-time callback.
+        self.pythonCheckPool = None
+        self.pythonCheckWorkers = 0
+        self.fileDigests = {}
+            # Keys are full paths. Values are (digest, size, mtime) of the
+            # contents Leo last read from or wrote to the file.
+        self.digestHits = 0 # Statistics for at.sameFileDigest.
+        self.digestMisses = 0
+        self.pendingWrites = []
+            # g.Bunches describing files being written in threads.
+        self.writeBehind = False
+            # True: at.replaceTargetFileIfDifferent may write files in threads.
+            # **Only** at.writeAll sets this flag.
+        self.writePool = None
+        self.writeThreads = 0
         self.reloadSettings()
     #@+node:ekr.20171113152939.1: *5* at.reloadSettings
     def reloadSettings(self):
@@ -68,6 +96,11 @@ class AtFile(object):
             'run-pyflakes-on-write', default=False)
         self.underindentEscapeString = c.config.getString(
             'underindent-escape-string') or '\\-'
+        self.useReadCache = c.config.getBool(
+            'cache-at-file-trees', default=True)
+        self.readWorkers = c.config.getInt('at-file-read-workers') or 0
+        self.pythonCheckWorkers = c.config.getInt('python-check-workers') or 0
+        self.writeThreads = c.config.getInt('at-file-write-threads') or 0
     #@+node:ekr.20150509194251.1: *4* at.cmd (decorator)
     def cmd(name):
         '''Command decorator for the AtFileCommands class.'''
@@ -358,7 +391,7 @@ class AtFile(object):
         #
         # Set the time stamp.
         if fileName and at.inputFile:
-            c.setFileTimeStamp(fileName)
+            c.setFileTimeStamp(fileName, root)
         elif not fileName and not fromString and not file_s:
             return False
         root.clearVisitedInTree()
@@ -373,9 +406,56 @@ class AtFile(object):
                 # at.tab_width
         gnx2vnode = c.fileCommands.gnxDict
         contents = fromString or file_s
-        FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        if fromString or importFileName or atShadow:
+            FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        else:
+            at.readWithCache(contents, fileName, root)
         root.clearDirty()
         return True
+    #@+node:ekr.20180904055203.1: *6* at.readWithCache & helper
+    def readWithCache(self, contents, fileName, root):
+        '''
+        Read root's external file into root's tree.
+        
+        Rebuild the tree from g.app.commander_db instead of scanning
+        sentinels if the file is unchanged since Leo last read it.
+        '''
+        at, c = self, self.c
+        fast = FastAtRead(c, c.fileCommands.gnxDict)
+        db = g.app.commander_db
+        signature = None
+        if at.useReadCache and db is not None:
+            signature = at.readCacheSignature(fileName, contents, root)
+            data = signature and db.get(at.readCacheKey(fileName))
+            if data and data[0] == signature:
+                at.readCacheHits += 1
+                fast.read_from_cache(data[1], root)
+                return
+            at.readCacheMisses += 1
+        if at.pendingReads is not None:
+            # at.readPendingFiles will scan the file in a worker process.
+            at.pendingReads.append((contents, fileName, root.copy(), signature),)
+        elif fast.read_into_root(contents, fileName, root) and signature:
+            db [at.readCacheKey(fileName)] = signature, fast.cache_data(root.v)
+    #@+node:ekr.20180905041730.1: *7* at.readCacheKey
+    def readCacheKey(self, fileName):
+        '''Return the key of fileName's entry in g.app.commander_db.'''
+        return '%s:::at_read_cache' % fileName
+    #@+node:ekr.20180904055203.2: *7* at.readCacheSignature
+    def readCacheSignature(self, fileName, contents, root):
+        '''
+        Return (size, mtime, digest, gnx) for the external file, or None.
+        
+        The digest is the md5 hash of the file's decoded contents. gnx is
+        the gnx of root, the @<file> node: the cached tree contains it, so
+        the cache must not be used for another node with the same path.
+        '''
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        digest = hashlib.md5(g.toEncodedString(contents)).hexdigest()
+        return st.st_size, st.st_mtime, digest, root.gnx
     #@+node:ekr.20100122130101.6174: *6* at.deleteTnodeList
     def deleteTnodeList(self, p): # AtFile method.
         '''Remove p's tnodeList.'''
@@ -491,6 +571,8 @@ class AtFile(object):
         scanned_tnodes = set()
         c.init_error_dialogs()
         after = p.nodeAfterTree() if force else None
+        at.pendingReads = [] if at.readWorkers > 1 else None
+            # at.read appends to this list instead of scanning files.
         while p and p != after:
             data = (p.gnx, g.fullPath(c, p))
             #skip clones referring to exactly the same paths.
@@ -536,14 +618,62 @@ class AtFile(object):
                 p.moveToNodeAfterTree()
             else:
                 p.moveToThreadNext()
+        at.readPendingFiles()
         if not g.unitTesting:
             if nRead:
                 t2 = time.time()
                 g.es('read %s files in %2.2f seconds' % (nRead, t2 - t1))
+                if 'cache' in g.app.debug:
+                    g.trace('read cache: %s hits, %s misses' % (
+                        at.readCacheHits, at.readCacheMisses))
             elif force:
                 g.es("no @<file> nodes in the selected tree")
         if use_tracer: tt.stop()
         c.raise_error_dialogs()
+    #@+node:ekr.20180905041730.2: *6* at.readPendingFiles
+    def readPendingFiles(self):
+        '''
+        Scan all files in at.pendingReads in a pool of worker processes,
+        then link the resulting trees into the outline, in outline order.
+        '''
+        at, c = self, self.c
+        pending, at.pendingReads = at.pendingReads, None
+        if not pending:
+            return
+        results = None
+        if len(pending) > 1:
+            aList = [(contents, fileName, root.gnx)
+                for contents, fileName, root, signature in pending]
+            try:
+                import multiprocessing
+                pool = multiprocessing.Pool(min(at.readWorkers, len(pending)))
+                try:
+                    results = pool.map(fast_at_read_worker, aList)
+                finally:
+                    pool.close()
+                    pool.join()
+            except Exception:
+                g.es_exception()
+                g.es_print('reading files in this process')
+        if not results:
+            results = [(None, None)] * len(pending)
+        db = g.app.commander_db
+        for (data, error), aTuple in zip(results, pending):
+            contents, fileName, root, signature = aTuple
+            if error:
+                # Report the worker's error, then scan the file here.
+                g.es_print(error, color='red')
+                g.error('unexpected exception in read worker:', fileName)
+            fast = FastAtRead(c, c.fileCommands.gnxDict)
+            if data:
+                fast.read_from_cache(data, root)
+            else:
+                # Scan the file here. This reports all errors.
+                if fast.read_into_root(contents, fileName, root):
+                    data = fast.cache_data(root.v)
+            if data and signature:
+                db [at.readCacheKey(fileName)] = signature, data
+            root.clearDirty()
     #@+node:ekr.20080801071227.7: *5* at.readAtShadowNodes
     def readAtShadowNodes(self, p):
         '''Read all @shadow nodes in the p's tree.'''
@@ -601,6 +731,7 @@ class AtFile(object):
             p.clearDirty()
             c.setChanged(oldChanged)
         else:
+            c.setFileTimeStamp(fileName, old_p)
             g.doHook('after-auto', c=c, p=p)
         return p
     #@+node:ekr.20090225080846.3: *5* at.readOneAtEditNode
@@ -634,6 +765,7 @@ class AtFile(object):
                 head = '@nocolor\n'
         p.b = g.u(head) + g.toUnicode(s, encoding=encoding, reportErrors='True')
         if not changed: c.setChanged(False)
+        c.setFileTimeStamp(fn, p)
         g.doHook('after-edit', p=p)
     #@+node:ekr.20150204165040.5: *5* at.readOneAtCleanNode & helpers
     def readOneAtCleanNode(self, root):
@@ -650,6 +782,7 @@ class AtFile(object):
         at.scanAllDirectives(root)
             # Sets at.startSentinelComment/endSentinelComment.
         new_public_lines = at.read_at_clean_lines(fileName)
+        c.setFileTimeStamp(fileName, root)
         old_private_lines = self.write_at_clean_sentinels(root)
         marker = x.markerFromFileLines(old_private_lines, fileName)
         old_public_lines, junk = x.separate_sentinels(old_private_lines, marker)
@@ -726,6 +859,7 @@ class AtFile(object):
             if ok:
                 # Create the private file automatically.
                 at.writeOneAtShadowNode(p, toString=False, force=True)
+        c.setFileTimeStamp(fn, p)
     #@+node:ekr.20080712080505.1: *6* at.importAtShadowNode
     def importAtShadowNode(self, fn, p):
         at = self; c = at.c; ic = c.importCommands
@@ -862,10 +996,12 @@ class AtFile(object):
         at = self
         s = None
         try:
+            st = os.stat(fn)
             f = open(fn, 'rb')
             s = f.read()
             f.close()
-        except IOError:
+            at.rememberFileDigest(fn, s, st)
+        except (IOError, OSError):
             at.error('can not open %s' % (fn))
         except Exception:
             at.error('Exception reading %s' % (fn))
@@ -1224,32 +1360,39 @@ class AtFile(object):
             p = c.rootPosition()
             after = None
         at.clearAllOrphanBits(p)
+        # Write files in threads while computing the next file.
+        at.writeBehind = at.writeThreads > 0 and not toString and not g.unitTesting
         # Leo 5.6: write files only once.
         seen = set()
-        while p and p != after:
-            if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
-                if p.isAnyAtFileNode():
-                    c.ignored_at_file_nodes.append(p.h)
-                # Note: @ignore not honored in @asis nodes.
-                p.moveToNodeAfterTree() # 2011/10/08: Honor @ignore!
-            elif p.isAnyAtFileNode():
-                data = p.v, g.fullPath(c, p)
-                if data not in seen:
-                    seen.add(data)
-                    try:
-                        self.writeAllHelper(p, root, force, toString, writeAtFileNodesFlag, writtenFiles)
-                    except Exception:
-                        # Fix bug 1260415: https://bugs.launchpad.net/leo-editor/+bug/1260415
-                        # Give a more urgent, more specific, more helpful message.
-                        g.es_exception()
-                        g.es('Internal error writing: %s' % (p.h), color='red')
-                        g.es('Please report this error to:', color='blue')
-                        g.es('https://groups.google.com/forum/#!forum/leo-editor', color='blue')
-                        g.es('Warning: changes to this file will be lost', color='red')
-                        g.es('unless you can save the file successfully.', color='red')
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        try:
+            while p and p != after:
+                if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
+                    if p.isAnyAtFileNode():
+                        c.ignored_at_file_nodes.append(p.h)
+                    # Note: @ignore not honored in @asis nodes.
+                    p.moveToNodeAfterTree() # 2011/10/08: Honor @ignore!
+                elif p.isAnyAtFileNode():
+                    data = p.v, g.fullPath(c, p)
+                    if data not in seen:
+                        seen.add(data)
+                        try:
+                            self.writeAllHelper(p, root, force, toString, writeAtFileNodesFlag, writtenFiles)
+                        except Exception:
+                            # Fix bug 1260415: https://bugs.launchpad.net/leo-editor/+bug/1260415
+                            # Give a more urgent, more specific, more helpful message.
+                            g.es_exception()
+                            g.es('Internal error writing: %s' % (p.h), color='red')
+                            g.es('Please report this error to:', color='blue')
+                            g.es('https://groups.google.com/forum/#!forum/leo-editor', color='blue')
+                            g.es('Warning: changes to this file will be lost', color='red')
+                            g.es('unless you can save the file successfully.', color='red')
+                    p.moveToNodeAfterTree()
+                else:
+                    p.moveToThreadNext()
+        finally:
+            # Report all writes before reporting that the command is finished.
+            # Never leave writes pending, even after an unexpected exception.
+            at.finishWrites()
         # Make *sure* these flags are cleared for other commands.
         at.canCancelFlag = False
         at.cancelFlag = False
@@ -1509,8 +1652,9 @@ class AtFile(object):
         at = self
         d = g.app.atAutoWritersDict
         for key in d.keys():
-            aClass = d.get(key)
-            if aClass and g.match_word(root.h, 0, key):
+            # Match the key first: getting a class may import its module.
+            aClass = g.match_word(root.h, 0, key) and d.get(key)
+            if aClass:
 
                 def writer_for_at_auto_cb(root):
                     # pylint: disable=cell-var-from-loop
@@ -2394,7 +2538,13 @@ class AtFile(object):
     #@+node:ekr.20041005105605.196: *4* Writing 4.x utils...
     #@+node:ekr.20090514111518.5661: *5* at.checkPythonCode & helpers
     def checkPythonCode(self, root, s=None, targetFn=None, pyflakes_errors_only=False):
-        '''Perform python-related checks on root.'''
+        '''
+        Perform python-related checks on root.
+
+        g.app.commander_db remembers the results for each file, so Leo
+        never checks an unchanged file twice. If possible, worker processes
+        check files and at.onPythonCheckIdle reports the results.
+        '''
         at = self
         if not targetFn:
             targetFn = at.targetFileName
@@ -2402,19 +2552,22 @@ class AtFile(object):
             if not s:
                 s = at.outputContents
                 if not s: return
+            pyflakes = at.runPyFlakesOnWrite and not g.unitTesting
+            if pyflakes_errors_only and not pyflakes:
+                return
             # It's too slow to check each node separately.
-            if pyflakes_errors_only:
-                ok = True
-            else:
-                ok = at.checkPythonSyntax(root, s)
-            # Syntax checking catches most indentation problems.
-                # if ok: at.tabNannyNode(root,s)
-            if ok and at.runPyFlakesOnWrite and not g.unitTesting:
-                ok2 = self.runPyflakes(root, pyflakes_errors_only=pyflakes_errors_only)
-            else:
-                ok2 = True
-            if not ok or not ok2:
-                g.app.syntax_error_files.append(g.shortFileName(targetFn))
+            db = g.app.commander_db
+            digest = hashlib.md5(g.toEncodedString(s)).hexdigest()
+            data = db.get(at.pythonCheckKey(targetFn)) if db is not None else None
+            if data and data[0] == digest and (data[1][1] is not None or not pyflakes):
+                at.reportPythonCheck(root, s, targetFn, pyflakes_errors_only, pyflakes, data[1])
+                return
+            check = g.Bunch(root=root and root.copy(), s=s, fileName=targetFn,
+                pyflakes_errors_only=pyflakes_errors_only, pyflakes=pyflakes,
+                digest=digest)
+            if not at.startPythonCheck(check):
+                result = check_python_worker((s, targetFn, root and root.h, pyflakes))
+                at.finishPythonCheck(check, result)
     #@+node:ekr.20090514111518.5663: *6* at.checkPythonSyntax
     def checkPythonSyntax(self, p, body, supress=False):
         at = self
@@ -2435,10 +2588,14 @@ class AtFile(object):
             ok = False
         return ok
     #@+node:ekr.20090514111518.5666: *7* at.syntaxError (leoAtFile)
-    def syntaxError(self, p, body):
-        '''Report a syntax error.'''
+    def syntaxError(self, p, body, val=None):
+        '''
+        Report a syntax error.
+        val is a SyntaxError, or None for the exception being handled.
+        '''
         g.error("Syntax error in: %s" % (p.h))
-        typ, val, tb = sys.exc_info()
+        if val is None:
+            typ, val, tb = sys.exc_info()
         message = hasattr(val, 'message') and val.message
         if message: g.es_print(message)
         if val is None: return
@@ -2459,19 +2616,107 @@ class AtFile(object):
             g.es_print(text, nodeLink=node_link)
             if j == i:
                 g.es_print(' ' * (7 + offset) + '^')
-    #@+node:ekr.20161021084954.1: *6* at.runPyflakes
-    def runPyflakes(self, root, pyflakes_errors_only):
-        '''Run pyflakes on the selected node.'''
-        try:
-            import leo.commands.checkerCommands as checkerCommands
-            if checkerCommands.pyflakes:
-                x = checkerCommands.PyflakesCommand(self.c)
-                ok = x.run(p=root,pyflakes_errors_only=pyflakes_errors_only)
-                return ok
+    #@+node:ekr.20180907121501.1: *6* at.finishPythonCheck
+    def finishPythonCheck(self, check, result):
+        '''Remember and report the result of check_python_worker.'''
+        at = self
+        db = g.app.commander_db
+        if db is not None:
+            db [at.pythonCheckKey(check.fileName)] = check.digest, result
+        at.reportPythonCheck(check.root, check.s, check.fileName,
+            check.pyflakes_errors_only, check.pyflakes, result)
+    #@+node:ekr.20180907121501.2: *6* at.onPythonCheckIdle
+    def onPythonCheckIdle(self):
+        '''
+        Report the results of finished checks, in the order Leo started
+        them. Called at idle time.
+        '''
+        at, c = self, self.c
+        if not at.pythonChecks:
+            return
+        if not c.exists:
+            at.pythonChecks = []
+            at.pythonCheckPool.terminate()
+            at.pythonCheckPool = None
+            return
+        while at.pythonChecks and at.pythonChecks[0].result.ready():
+            check = at.pythonChecks.pop(0)
+            try:
+                result = check.result.get()
+            except Exception:
+                g.es_exception()
+                continue
+            if check.root and not c.positionExists(check.root):
+                check.root = None
+            at.finishPythonCheck(check, result)
+        if not at.pythonChecks:
+            # Don't keep idle worker processes.
+            at.pythonCheckPool.close()
+            at.pythonCheckPool.join()
+            at.pythonCheckPool = None
+            c.syntaxErrorDialog()
+    #@+node:ekr.20180907121501.3: *6* at.pythonCheckKey
+    def pythonCheckKey(self, fileName):
+        '''Return the key of fileName's entry in g.app.commander_db.'''
+        return '%s:::python_check' % fileName
+    #@+node:ekr.20180907121501.4: *6* at.reportPythonCheck
+    def reportPythonCheck(self, root, s, fileName, pyflakes_errors_only, pyflakes, result):
+        '''Report the result of check_python_worker to the log.'''
+        at = self
+        syntax_error, messages, errors = result
+        ok = True
+        if syntax_error and not pyflakes_errors_only:
+            ok = False
+            msg, lineno, offset = syntax_error
+            if root:
+                body = s.replace('\r', '')
+                val = SyntaxError(msg, ('<node: %s>' % root.h, lineno, offset, None))
+                at.syntaxError(root, body, val)
             else:
-                return True # Suppress error if pyflakes can not be imported.
+                g.error("Syntax error in: %s" % fileName)
+                g.es_print(msg)
+        elif pyflakes and messages is not None:
+            # Like PyflakesCommand.run.
+            import leo.commands.checkerCommands as checkerCommands
+            if not pyflakes_errors_only:
+                g.es('Pyflakes: %s' % g.shortFileName(fileName))
+            stream = checkerCommands.PyflakesCommand.LogStream(0, [root] if root else None)
+            for message in messages:
+                stream.write(message)
+            if errors > 0:
+                ok = False
+                g.es('ERROR: pyflakes: %s error%s' % (errors, g.plural(errors)))
+            elif not pyflakes_errors_only:
+                g.es('OK: pyflakes')
+        if not ok:
+            g.app.syntax_error_files.append(g.shortFileName(fileName))
+    #@+node:ekr.20180907121501.5: *6* at.startPythonCheck
+    def startPythonCheck(self, check):
+        '''
+        Start check_python_worker in a worker process, if possible.
+        Return True if at.onPythonCheckIdle will report the result.
+        '''
+        at = self
+        itm = g.app.idleTimeManager
+        if at.pythonCheckWorkers < 1 or g.unitTesting or not (itm and itm.timer):
+            return False
+        root = check.root
+        aTuple = (check.s, check.fileName, root and root.h, check.pyflakes)
+        try:
+            if not at.pythonCheckPool:
+                import multiprocessing
+                at.pythonCheckPool = multiprocessing.Pool(at.pythonCheckWorkers)
+            check.result = at.pythonCheckPool.apply_async(check_python_worker, (aTuple,))
         except Exception:
             g.es_exception()
+            g.es_print('checking files in this process')
+            at.pythonCheckWorkers = 0
+            return False
+        at.pythonChecks.append(check)
+        if not at.pythonCheckIdle:
+            at.pythonCheckIdle = True
+            itm.add_callback(at.onPythonCheckIdle)
+        return True
     #@+node:ekr.20090514111518.5665: *6* at.tabNannyNode
     def tabNannyNode(self, p, body, suppress=False):
         import parser
@@ -2557,31 +2802,70 @@ class AtFile(object):
         if s1 is None:
             g.internalError('empty compare file: %s' % path1)
             return False
+        if at.sameFileDigest(path2, s1):
+            return True
+        try:
+            st = os.stat(path2)
+        except OSError:
+            st = None
         s2 = g.readFileIntoEncodedString(path2)
         e2 = None
         if s2 is None:
             g.internalError('empty compare file: %s' % path2)
             return False
-        # 2013/10/28: fix bug #1243855: @auto-rst doesn't save text
-        # Make sure both strings are unicode.
-        # This is requred to handle binary files in Python 3.x.
-        if not g.isUnicode(s1):
-            s1 = g.toUnicode(s1, encoding=e1)
-        if not g.isUnicode(s2):
-            s2 = g.toUnicode(s2, encoding=e2)
-        equal = s1 == s2
-        if ignoreBlankLines and not equal:
-            s1 = g.removeBlankLines(s1)
-            s2 = g.removeBlankLines(s2)
-            equal = s1 == s2
-        if ignoreLineEndings and not equal:
-            # Wrong: equivalent to ignoreBlankLines!
-                # s1 = s1.replace('\n','').replace('\r','')
-                # s2 = s2.replace('\n','').replace('\r','')
-            s1 = s1.replace('\r', '')
-            s2 = s2.replace('\r', '')
-            equal = s1 == s2
-        return equal
+        if st:
+            at.rememberFileDigest(path2, s2, st)
+        return compare_contents(s1, e1, s2, e2, ignoreLineEndings, ignoreBlankLines)
+    #@+node:ekr.20180907165220.1: *5* at.outputBytes
+    def outputBytes(self, s):
+        '''Return the encoded string that at.create writes for s.'''
+        at = self
+        # 2015/07/15: do this before converting to encoded string.
+        if at.output_newline != '\n':
+            s = s.replace('\r', '').replace('\n', at.output_newline)
+        # 2013/10/28: fix bug 1243847: unicode error when saving @shadow nodes
+        if g.isUnicode(s):
+            s = g.toEncodedString(s, encoding=at.encoding)
+        return s
+    #@+node:ekr.20180907165220.2: *5* at.rememberFileDigest
+    def rememberFileDigest(self, fn, s, st=None):
+        '''
+        Remember the digest of s, the encoded contents of file fn, and the
+        size and modification time of fn. st is the result of os.stat(fn)
+        *before* fn was read, if available.
+        '''
+        try:
+            st = st or os.stat(fn)
+        except OSError:
+            self.fileDigests.pop(fn, None)
+            return
+        digest = hashlib.md5(s).hexdigest()
+        self.fileDigests[fn] = digest, st.st_size, st.st_mtime
+    #@+node:ekr.20180907165220.3: *5* at.sameFileDigest
+    def sameFileDigest(self, fn, s):
+        '''
+        Return True if fn contains exactly what at.create would write for s,
+        without reading fn: Leo last read or wrote s to fn, and fn's size
+        and modification time have not changed since then.
+        '''
+        at = self
+        data = at.fileDigests.get(fn)
+        if not data:
+            return False
+        digest, size, mtime = data
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return False
+        if st.st_size != size or st.st_mtime != mtime:
+            at.digestMisses += 1
+            return False
+        s = at.outputBytes(s)
+        if len(s) != size or hashlib.md5(s).hexdigest() != digest:
+            at.digestMisses += 1
+            return False
+        at.digestHits += 1
+        return True
     #@+node:ekr.20041005105605.198: *5* at.directiveKind4 (write logic)
     # These patterns exclude constructs such as @encoding.setter or @encoding(whatever)
     # However, they must allow @language python, @nocolor-node, etc.
@@ -2885,6 +3169,9 @@ class AtFile(object):
            remove target file, then rename output file to be target file.
 
         Return True if the original file was changed.
+
+        When at.writeAll allows, a thread does all this and at.finishWrite
+        reports the result later. This method then returns False.
         '''
         at = self; c = at.c
         if at.toString:
@@ -2906,6 +3193,10 @@ class AtFile(object):
             timestamp = time.strftime(format) + ' '
         else:
             timestamp = ''
+        if at.writeBehind and at.startWrite(root, timestamp, ignoreBlankLines):
+            # at.finishWrite reports the result and sets the dirty and orphan bits.
+            at.fileChangedFlag = False
+            return False
         if g.os_path_exists(at.targetFileName):
             if at.compareFiles(
                 at.outputFileName,
@@ -2935,7 +3226,7 @@ class AtFile(object):
                 s = at.outputContents
                 ok = at.create(at.targetFileName, s)
                 if ok:
-                    c.setFileTimeStamp(at.targetFileName)
+                    c.setFileTimeStamp(at.targetFileName, root)
                     if not g.unitTesting:
                         g.es('%swrote: %s' % (timestamp, at.shortFileName))
                 else:
@@ -2952,7 +3243,7 @@ class AtFile(object):
             s = at.outputContents
             ok = self.create(at.targetFileName, s)
             if ok:
-                c.setFileTimeStamp(at.targetFileName)
+                c.setFileTimeStamp(at.targetFileName, root)
                 if not g.unitTesting:
                     g.es('%screated: %s' % (timestamp, at.targetFileName))
                 if root:
@@ -2967,6 +3258,101 @@ class AtFile(object):
             at.fileChangedFlag = False
             at.checkPythonCode(root)
             return False
+    #@+node:ekr.20180907172000.1: *5* at.startWrite
+    def startWrite(self, root, timestamp, ignoreBlankLines):
+        '''
+        Start comparing and writing at.targetFileName in a thread of
+        at.writePool, if possible. Return True if at.finishWrite will report
+        the result.
+        '''
+        at = self
+        fn, s = at.targetFileName, at.outputContents
+        if s is None:
+            return False # at.compareFiles reports the error.
+        write = g.Bunch(root=root and root.copy(), fileName=fn,
+            shortFileName=at.shortFileName, s=s, timestamp=timestamp)
+        aTuple = (fn, s, at.outputBytes(s), at.encoding,
+            at.fileDigests.get(fn), at.explicitLineEnding, ignoreBlankLines)
+        try:
+            if not at.writePool:
+                from multiprocessing.pool import ThreadPool
+                at.writePool = ThreadPool(at.writeThreads)
+            write.result = at.writePool.apply_async(write_file_worker, (aTuple,))
+        except Exception:
+            g.es_exception()
+            g.es_print('writing files in this thread')
+            at.writeBehind = False
+            at.writeThreads = 0
+            return False
+        at.pendingWrites.append(write)
+        # Report finished writes. Limit the memory used by unfinished writes.
+        while at.pendingWrites and (
+            at.pendingWrites[0].result.ready() or
+            len(at.pendingWrites) > 2 * at.writeThreads
+        ):
+            at.finishWrite(at.pendingWrites.pop(0))
+        return True
+    #@+node:ekr.20180907172000.2: *5* at.finishWrite
+    def finishWrite(self, write):
+        '''
+        Wait for one write started by at.startWrite. Report the result and
+        set the dirty and orphan bits as at.replaceTargetFileIfDifferent does.
+        '''
+        at, c = self, self.c
+        root, fn = write.root, write.fileName
+        result = write.result.get()
+        if result.digest:
+            at.fileDigests[fn] = result.digest
+        else:
+            at.fileDigests.pop(fn, None)
+        if result.hit:
+            at.digestHits += 1
+        elif result.hit is not None:
+            at.digestMisses += 1
+        if result.kind == 'unchanged':
+            report = c.config.getBool('report_unchanged_files', default=True)
+            at.sameFiles += 1
+            if report and not g.unitTesting:
+                g.es('%sunchanged: %s' % (write.timestamp, write.shortFileName))
+            if write.s:
+                at.checkPythonCode(root, s=write.s, targetFn=fn, pyflakes_errors_only=True)
+            return
+        if result.lineEndings:
+            g.warning("correcting line endings in:", fn)
+        if result.kind == 'error':
+            g.es(result.error, color='red')
+            g.error('error writing', write.shortFileName)
+            g.es('not written:', write.shortFileName)
+            if root:
+                root.setDirty()
+                root.setOrphan()
+                # As in the synchronous case, at.writeAllHelper clears the
+                # dirty bits of root's tree after writing root.
+                for p in root.self_and_subtree(copy=False):
+                    p.v.clearDirty()
+        else:
+            c.setFileTimeStamp(fn, root)
+            if result.kind == 'created':
+                if not g.unitTesting:
+                    g.es('%screated: %s' % (write.timestamp, fn))
+                if root:
+                    at.rememberReadPath(fn, root)
+            elif not g.unitTesting:
+                g.es('%swrote: %s' % (write.timestamp, write.shortFileName))
+        if write.s:
+            at.checkPythonCode(root, s=write.s, targetFn=fn)
+    #@+node:ekr.20180907172000.3: *5* at.finishWrites
+    def finishWrites(self):
+        '''Report the results of all writes started by at.startWrite, in order.'''
+        at = self
+        at.writeBehind = False
+        while at.pendingWrites:
+            at.finishWrite(at.pendingWrites.pop(0))
+        if at.writePool:
+            # Don't keep idle threads.
+            at.writePool.close()
+            at.writePool.join()
+            at.writePool = None
     #@+node:ekr.20041005105605.216: *5* at.warnAboutOrpanAndIgnoredNodes
     # Called from writeOpenFile.
 
@@ -3043,18 +3429,14 @@ class AtFile(object):
     def create(self, fn, s):
         '''Create a file whose contents are s.'''
         at = self
-        # 2015/07/15: do this before converting to encoded string.
-        if at.output_newline != '\n':
-            s = s.replace('\r', '').replace('\n', at.output_newline)
-        # This is part of the new_write logic.
-        # This is the only call to g.toEncodedString in the new_write logic.
-        # 2013/10/28: fix bug 1243847: unicode error when saving @shadow nodes
-        if g.isUnicode(s):
-            s = g.toEncodedString(s, encoding=at.encoding)
+        s = at.outputBytes(s)
+            # This is part of the new_write logic.
+            # This is the only call to g.toEncodedString in the new_write logic.
         try:
             f = open(fn, 'wb') # Must be 'wb' to preserve line endings.
             f.write(s)
             f.close()
+            at.rememberFileDigest(fn, s)
         except Exception:
             f = None
             g.es_exception()
@@ -3339,6 +3721,198 @@ class AtFile(object):
     #@-others
 
 atFile = AtFile # compatibility
+#@+node:ekr.20180905041730.3: ** class FastAtReadVNode
+class FastAtReadVNode(object):
+    '''
+    A minimal vnode, used by fast_at_read_worker.
+    
+    Worker processes have no commander, so they can't create real vnodes.
+    '''
+
+    def __init__(self, context, gnx):
+        self.context = context
+        self.fileIndex = gnx
+        self._headString = ''
+        self._bodyString = ''
+        self.children = []
+        self.parents = []
+
+    @property
+    def gnx(self):
+        return self.fileIndex
+
+    @property
+    def v(self):
+        # The root vnode stands in for the root position.
+        return self
+
+    def _deleteAllChildren(self):
+        self.children = []
+
+    def setHeadString(self, s):
+        # Worker vnodes have no headline index.
+        self._headString = s
+#@+node:ekr.20180907172000.4: ** function: compare_contents
+def compare_contents(s1, e1, s2, e2, ignoreLineEndings, ignoreBlankLines=False):
+    '''
+    Compare the contents of two files, encoded in e1 and e2 if they are
+    not unicode. Called by at.compareFiles and write_file_worker.
+    '''
+    # 2013/10/28: fix bug #1243855: @auto-rst doesn't save text
+    # Make sure both strings are unicode.
+    # This is requred to handle binary files in Python 3.x.
+    if not g.isUnicode(s1):
+        s1 = g.toUnicode(s1, encoding=e1)
+    if not g.isUnicode(s2):
+        s2 = g.toUnicode(s2, encoding=e2)
+    equal = s1 == s2
+    if ignoreBlankLines and not equal:
+        s1 = g.removeBlankLines(s1)
+        s2 = g.removeBlankLines(s2)
+        equal = s1 == s2
+    if ignoreLineEndings and not equal:
+        # Wrong: equivalent to ignoreBlankLines!
+            # s1 = s1.replace('\n','').replace('\r','')
+            # s2 = s2.replace('\n','').replace('\r','')
+        s1 = s1.replace('\r', '')
+        s2 = s2.replace('\r', '')
+        equal = s1 == s2
+    return equal
+#@+node:ekr.20180905041730.4: ** function: fast_at_read_worker
+def fast_at_read_worker(aTuple):
+    '''
+    Scan one external file in a worker process.
+
+    aTuple is (contents, fileName, root_gnx). Return (data, error), where
+    data is the compact tree created by fast_at.cache_data, or None if the
+    file isn't valid, and error is the traceback of an unexpected
+    exception, or None. at.readPendingFiles links the tree into the
+    outline, or scans the file again and reports errors.
+    '''
+    contents, fileName, root_gnx = aTuple
+    try:
+        root_v = FastAtReadVNode(None, root_gnx)
+        fast = FastAtRead(None, {root_gnx: root_v})
+        fast.VNode = FastAtReadVNode
+        if fast.read_into_root(contents, fileName, root_v):
+            return fast.cache_data(root_v), None
+        return None, None
+    except Exception:
+        return None, traceback.format_exc()
+#@+node:ekr.20180907121501.6: ** function: check_python_worker
+def check_python_worker(aTuple):
+    '''
+    Check the contents of one Python file, in a worker process or in
+    Leo's own process.
+
+    aTuple is (s, fileName, headline, pyflakes). Return (syntax_error,
+    messages, errors), where syntax_error is None or (msg, lineno, offset),
+    messages is a list of pyflakes messages, or None if pyflakes did not
+    run, and errors is the number of pyflakes errors.
+    at.reportPythonCheck reports the results.
+    '''
+    s, fileName, headline, pyflakes = aTuple
+    syntax_error, messages, errors = None, None, 0
+    body = s if g.isPython3 else g.toEncodedString(s)
+    body = body.replace('\r', '')
+    try:
+        compile(body + '\n', '<node: %s>' % headline, 'exec')
+    except Exception as e:
+        syntax_error = (
+            getattr(e, 'msg', None) or str(e),
+            getattr(e, 'lineno', None),
+            getattr(e, 'offset', None))
+    if pyflakes:
+        messages = []
+        try:
+            from pyflakes import api, reporter
+        except Exception: # ModuleNotFoundError
+            api = None # Pretend all is fine.
+        if api and s.strip():
+            stream = g.FileLikeObject()
+            r = reporter.Reporter(warningStream=stream, errorStream=stream)
+            errors = api.check(s, g.shortFileName(fileName), r)
+            messages = [z.rstrip() for z in g.splitLines(stream.get()) if z.strip()]
+    return syntax_error, messages, errors
+#@+node:ekr.20180907172000.5: ** function: write_file_worker
+def write_file_worker(aTuple):
+    '''
+    Compare and write one external file in a thread of at.writePool.
+    Don't use the outline, the log or the AtFile class here.
+
+    aTuple is (fileName, s, b, encoding, digest, explicitLineEnding,
+    ignoreBlankLines), where s is the unicode contents of the file, b is
+    what at.create would write for s and digest is the file's entry in
+    at.fileDigests, or None.
+
+    The file changes only if its contents differ from s, and then
+    atomically: the new contents are written and synced to a temporary
+    file that replaces the file.
+
+    Return a g.Bunch with these ivars, for at.finishWrite:
+    kind:        'unchanged', 'wrote', 'created' or 'error'.
+    digest:      The file's new entry in at.fileDigests, or None.
+    hit:         None if digest didn't apply, else True if it showed the
+                 file to be unchanged without reading it.
+    lineEndings: True if the old file differed only in line endings.
+    error:       The traceback of the error that prevented the write.
+    '''
+    fn, s, b, encoding, digest, explicitLineEnding, ignoreBlankLines = aTuple
+    result = g.Bunch(kind='error', digest=None, hit=None, lineEndings=False, error=None)
+    tmp = None
+    try:
+        try:
+            st = os.stat(fn)
+        except OSError:
+            st = None
+        if st:
+            if digest and digest[1:] == (st.st_size, st.st_mtime):
+                result.hit = (len(b) == st.st_size and
+                    hashlib.md5(b).hexdigest() == digest[0])
+                if result.hit:
+                    result.kind, result.digest = 'unchanged', digest
+                    return result
+            with open(fn, 'rb') as f:
+                s2 = f.read()
+            result.digest = hashlib.md5(s2).hexdigest(), st.st_size, st.st_mtime
+            if compare_contents(s, encoding, s2, None,
+                ignoreLineEndings=not explicitLineEnding,
+                ignoreBlankLines=ignoreBlankLines,
+            ):
+                result.kind = 'unchanged'
+                return result
+            result.lineEndings = explicitLineEnding and compare_contents(
+                s, encoding, s2, None, ignoreLineEndings=True)
+        name = '%s.%s-%s.tmp' % (fn, os.getpid(), threading.current_thread().ident)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        fd = os.open(name, flags, 0o666)
+        tmp = name
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b)
+            f.flush()
+            os.fsync(f.fileno())
+        if st:
+            os.chmod(tmp, stat.S_IMODE(st.st_mode))
+        if hasattr(os, 'replace'):
+            os.replace(tmp, fn)
+        else:
+            # Python 2: os.rename fails on Windows if fn exists.
+            if st and sys.platform.startswith('win'):
+                os.remove(fn)
+            os.rename(tmp, fn)
+        tmp = None
+        st2 = os.stat(fn)
+        result.digest = hashlib.md5(b).hexdigest(), st2.st_size, st2.st_mtime
+        result.kind = 'wrote' if st else 'created'
+    except Exception:
+        result.kind = 'error'
+        result.error = traceback.format_exc()
+        if tmp:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return result
 #@+node:ekr.20180602102448.1: ** class FastAtRead
 class FastAtRead (object):
     '''
@@ -3386,6 +3960,66 @@ class FastAtRead (object):
         )
         # Return the compiled patterns, in alphabetical order.
         return (re.compile(pattern) for pattern in patterns)
+    #@+node:ekr.20180904055203.3: *3* fast_at.cache_data
+    def cache_data(self, root_v):
+        '''
+        Return a compact description of the tree just read into root_v.
+        
+        The result is a tuple (nodes, gnx2body). nodes is a list of
+        (gnx, headline, level) tuples in outline order. gnx2body is a dict
+        whose keys are gnx's and whose values are body strings.
+        '''
+        nodes, gnx2body = [], {root_v.gnx: root_v._bodyString}
+
+        def visit(parent_v, level):
+            for v in parent_v.children:
+                nodes.append((v.gnx, v._headString, level),)
+                gnx2body[v.gnx] = v._bodyString
+                visit(v, level+1)
+
+        visit(root_v, 2)
+        return nodes, gnx2body
+    #@+node:ekr.20180904055203.4: *3* fast_at.read_from_cache
+    def read_from_cache(self, data, root):
+        '''
+        Rebuild root's tree from data, the result of fast_at.cache_data.
+        
+        This follows << handle node_start >> in fast_at.scan_lines exactly,
+        so clones and gnx conflicts are handled just as when reading.
+        '''
+        nodes, gnx2body = data
+        context = self.c
+        gnx2vnode = self.gnx2vnode
+        self.root = root
+        root_v = root.v
+        root_v._deleteAllChildren()
+        gnx2vnode[root_v.gnx] = root_v
+        level_stack = [(root_v, False)]
+        for gnx, head, level in nodes:
+            v = gnx2vnode.get(gnx)
+            parent_v, clone_v = level_stack[level-2]
+            if v and clone_v:
+                # A descendant of a clone.
+                v.setHeadString(head)
+                level_stack = level_stack[:level-1]
+                level_stack.append((v, clone_v),)
+                v.children = []
+                parent_v.children.append(v)
+                continue
+            if v:
+                # The *start* of a clone tree. Reset the children.
+                clone_v = v
+                v.children = []
+            else:
+                v = self.VNode(context=context, gnx=gnx)
+            gnx2vnode[gnx] = v
+            v.setHeadString(head)
+            level_stack = level_stack[:level-1]
+            level_stack.append((v, clone_v),)
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+        for gnx in gnx2body:
+            gnx2vnode.get(gnx)._bodyString = gnx2body.get(gnx)
     #@+node:ekr.20180603060721.1: *3* fast_at.post_pass
     def post_pass(self, gnx2body, gnx2vnode, root_v):
         '''Set all body text.'''
@@ -3645,7 +4279,7 @@ class FastAtRead (object):
                 if v and clone_v:
                     # The last version of the body and headline wins..
                     gnx2body[gnx] = body = []
-                    v._headString = head
+                    v.setHeadString(head)
                     # Update the level_stack.
                     level_stack = level_stack[:level-1]
                     level_stack.append((v, clone_v),)
@@ -3666,7 +4300,7 @@ class FastAtRead (object):
                 # The last version of the body and headline wins.
                 gnx2vnode[gnx] = v
                 gnx2body[gnx] = body = []
-                v._headString = head
+                v.setHeadString(head)
                 #
                 # Update the stack.
                 level_stack = level_stack[:level-1]
@@ -3886,7 +4520,7 @@ class FastAtRead (object):
     def read_into_root(self, contents, path, root):
         '''
         Parse the file's contents, creating a tree of vnodes
-        anchored in root.v.
+        anchored in root.v. Return True if the file was valid.
         '''
         trace = False
         t1 = time.clock()
@@ -3901,12 +4535,12 @@ class FastAtRead (object):
             ### Previously, this had been done in readOpenFile.
             root.v._deleteAllChildren()
             delims, first_lines, start_i = data
-            self.scan_lines(
+            root_v, last_lines = self.scan_lines(
                 delims, first_lines, lines, start_i)
             if trace:
                 t2 = time.clock()
                 g.trace('%5.3f sec. %s' % ((t2-t1), path))
-            return True
+            return root_v is not None
         g.trace('Invalid external file: %s' % sfn)
         return False
     #@-others
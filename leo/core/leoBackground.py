@@ -7,8 +7,15 @@
 import leo.core.leoGlobals as g
 import re
 import subprocess
+import tempfile
+import time
 
 #@+others
+#@+node:ekr.20180907131012.1: ** show-background-processes
+@g.command('show-background-processes')
+def show_background_processes(event):
+    '''Print statistics about the processes of the BackgroundProcessManager.'''
+    g.app.backgroundProcessManager.show_stats()
 #@+node:ekr.20161026193609.1: ** class BackgroundProcessManager
 class BackgroundProcessManager(object):
     #@+<< BPM docstring>>
@@ -18,18 +25,19 @@ class BackgroundProcessManager(object):
     #@@wrap
 
     The BackgroundProcessManager (BPM) class runs background processes,
-    *without blocking Leo*. The BPM manages a queue of processes, and runs them
-    *one at a time* so that their output remains separate.
+    *without blocking Leo*. The BPM manages a queue of processes, and runs
+    up to @int max-background-processes of them at once.
 
     g.app.backgroundProcessManager is the singleton BPM.
 
     The BPM registers a handler with the IdleTimeManager that checks whether
-    the presently running background process has completed. If so, the handler
-    writes the process's output to the log and starts another background
-    process in the queue.
+    the running background processes have completed. If so, the handler
+    starts other background processes in the queue and writes the output of
+    completed processes to the log.
 
-    BPM.start_process(c, command, kind, fn=None, shell=False) adds a process to
-    the queue that will run the given command.
+    BPM.start_process(c, command, kind, fn=None, shell=False, priority=0)
+    adds a process to the queue that will run the given command. Processes
+    with higher priority start first.
 
     BM.kill(kind=None) kills all process with the given kind. If kind is None
     or 'all', all processes are killed.
@@ -37,13 +45,19 @@ class BackgroundProcessManager(object):
     You can add processes to the queue at any time. For example, you can rerun
     the 'pylint' command while a background process is running.
 
+    The show-background-processes command shows the length of the queue, the
+    running processes and the wall time of recently finished processes.
+
     The BackgroundProcessManager is completely safe: all of its code runs in
     the main process.
 
     **Running multiple processes simultaneously**
 
-    Only one process at a time should be producing output. All processes that
-    *do* produce output should be managed by the singleton BPM instance.
+    The BPM captures the output of each process, including stderr, in a
+    separate temporary file. When a process ends, the BPM writes all its
+    output to the log at once. The BPM writes the output of processes in the
+    order in which they were added to the queue, so the output of different
+    processes never interleaves.
 
     To run processes that *don't* produce output, just call subprocess.Popen.
     You can run as many of these process as you like, without involving the BPM
@@ -55,25 +69,43 @@ class BackgroundProcessManager(object):
     def __init__(self):
         '''Ctor for the base BackgroundProcessManager class.'''
         self.data = None
-            # a ProcessData instance.
+            # The ProcessData instance whose output is being written.
+        self.jobs = []
+            # ProcessData instances whose output hasn't been written,
+            # in the order in which they were added to the queue.
+        self.max_processes = 1
+            # The maximum number of running processes. Set in start_process.
+        self.n_jobs = 0
+            # The number of processes ever added to the queue.
         self.process_queue = []
-            # List of g.Bunches.
-        self.pid = None
-            # The process id of the running process.
+            # ProcessData instances waiting to run, highest priority first.
+        self.running = []
+            # ProcessData instances of running processes.
+        self.stats = []
+            # (kind, fn, seconds) for recently finished processes.
+        self.max_stats = 100
         g.app.idleTimeManager.add_callback(self.on_idle)
     #@+node:ekr.20161028090624.1: *3* class ProcessData
     class ProcessData(object):
         '''A class to hold data about running or queued processes.'''
 
-        def __init__(self, c, kind, fn, link_pattern, link_root, shell):
+        def __init__(self, c, command, kind, fn, link_pattern, link_root, shell, priority, n):
             '''Ctor for the ProcessData class.'''
             self.c = c
-            self.callback = None
+            self.command = command
             self.fn = fn
             self.kind = kind
             self.link_pattern = None
             self.link_root = link_root
+            self.lines = None
+                # The output of the process, set when the process ends.
+            self.n = n
+            self.output = None
+                # The temporary file containing the output of the process.
+            self.pid = None
+            self.priority = priority
             self.shell = shell
+            self.t1 = self.t2 = None
             #
             # Check and compile the link pattern.
             if link_pattern and g.isString(link_pattern):
@@ -84,10 +116,11 @@ class BackgroundProcessManager(object):
                     self.link_pattern = None
 
         def __repr__(self):
-            return 'c: %s kind: %s callback: %s fn: %s shell: %s' % (
+            return 'c: %s kind: %s n: %s priority: %s fn: %s shell: %s' % (
                 self.c.shortFileName(),
                 self.kind,
-                id(self.callback) if self.callback else None,
+                self.n,
+                self.priority,
                 self.fn,
                 self.shell,
             )
@@ -95,58 +128,99 @@ class BackgroundProcessManager(object):
         __str__ = __repr__
     #@+node:ekr.20161026193609.2: *3* bpm.check_process & helpers
     def check_process(self):
-        '''Check the running process, and switch if necessary.'''
-        if self.pid:
-            if self.pid.poll() is None:
-                pass
-            else:
-                self.end() # End this process.
-                self.start_next() # Start the next process.
-        elif self.process_queue:
-            self.start_next() # Start the next process.
+        '''
+        End all completed processes, start queued processes and write the
+        output of completed processes.
+        '''
+        for data in self.running[:]:
+            if data.pid.poll() is not None:
+                self.end(data)
+        while self.process_queue and len(self.running) < self.max_processes:
+            self.start_next()
+        self.flush()
     #@+node:ekr.20161028063557.1: *4* bpm.end
-    def end(self):
-        '''End the present process.'''
-        # Send the output to the log.
-        for s in self.pid.stdout:
-            self.put_log(s)
+    def end(self, data):
+        '''End data's process, and remember its output.'''
+        data.t2 = time.time()
+        f = data.output
+        f.seek(0)
+        data.lines = f.readlines()
+        f.close()
+        data.output = None
         # Terminate the process properly.
         try:
-            self.pid.kill()
+            data.pid.kill()
         except OSError:
             pass
-        self.pid = None
+        data.pid = None
+        self.running.remove(data)
+        self.stats.append((data.kind, data.fn, data.t2 - data.t1),)
+        del self.stats[:-self.max_stats]
+    #@+node:ekr.20180907131012.2: *4* bpm.flush
+    def flush(self):
+        '''
+        Write the output of completed processes to the log, stopping at the
+        first process that is still queued or running.
+        '''
+        while self.jobs and self.jobs[0].lines is not None:
+            self.data = data = self.jobs.pop(0)
+            self.put_log('%s: %s\n' % (data.kind, g.shortFileName(data.fn)))
+            for s in data.lines:
+                self.put_log(s)
+            if not self.jobs:
+                self.put_log('%s finished' % data.kind)
     #@+node:ekr.20161028063800.1: *4* bpm.start_next
     def start_next(self):
-        '''The previous process has finished. Start the next one.'''
-        if self.process_queue:
-            self.data = self.process_queue.pop(0)
-            self.data.callback()
-        else:
-            self.put_log('%s finished' % self.data.kind)
-            self.data = None
-            self.pid = None
+        '''Start the queued process with the highest priority.'''
+        data = self.process_queue.pop(0)
+        data.output = tempfile.TemporaryFile(mode='w+')
+        data.t1 = time.time()
+        try:
+            data.pid = subprocess.Popen(
+                data.command,
+                shell=data.shell,
+                stderr=subprocess.STDOUT,
+                stdout=data.output,
+                universal_newlines=True,
+            )
+        except Exception:
+            data.output.close()
+            data.output = None
+            data.t2 = time.time()
+            data.lines = ['can not run %s: %s\n' % (data.kind, data.command)]
+            return
+        self.running.append(data)
     #@+node:ekr.20161026193609.3: *3* bpm.kill
     def kill(self, kind=None):
-        '''Kill the presently running process, if any.'''
+        '''
+        Kill all running processes of the given kind and remove all other
+        processes of that kind from the queue.
+        '''
         if kind is None:
             kind = 'all'
-        if kind == 'all':
-            self.process_queue = []
-        else:
-            self.process_queue = [z for z in self.process_queue if z.kind != kind]
-        if self.pid and kind in ('all', self.data.kind):
-            self.put_log('killing %s process' % kind)
+
+        def predicate(data):
+            return kind in ('all', data.kind)
+
+        self.process_queue = [z for z in self.process_queue if not predicate(z)]
+        self.jobs = [z for z in self.jobs if not predicate(z)]
+        for data in [z for z in self.running if predicate(z)]:
+            self.data = data
+            self.put_log('killing %s process' % data.kind)
             try:
-                self.pid.kill()
+                data.pid.kill()
             except OSError:
                 pass
-            self.pid = None
+            data.output.close()
+            data.output = data.pid = None
+            self.running.remove(data)
         self.put_log('%s finished' % kind)
+        # Write output that was waiting for the killed processes.
+        self.flush()
     #@+node:ekr.20161026193609.4: *3* bpm.on_idle
     def on_idle(self):
         '''The idle-time callback for leo.commands.checkerCommands.'''
-        if self.process_queue or self.pid:
+        if self.process_queue or self.running or self.jobs:
             self.check_process()
     #@+node:ekr.20161028095553.1: *3* bpm.put_log
     def put_log(self, s):
@@ -185,41 +259,52 @@ class BackgroundProcessManager(object):
             c.frame.log.put(s + '\n', nodeLink=nodeLink)
         else:
             c.frame.log.put(s + '\n')
+    #@+node:ekr.20180907131012.3: *3* bpm.show_stats
+    def show_stats(self):
+        '''Print the state of the queue and the wall time of each process.'''
+        t = time.time()
+        result = [
+            'queued: %s, running: %s, not written: %s, limit: %s' % (
+                len(self.process_queue), len(self.running),
+                len(self.jobs), self.max_processes),
+        ]
+        for data in self.running:
+            result.append('%7.2f sec. %s: %s (running)' % (
+                t - data.t1, data.kind, g.shortFileName(data.fn)))
+        if self.stats:
+            total = sum(z[2] for z in self.stats)
+            result.append('last %s processes: %4.2f sec. total, %4.2f sec. average' % (
+                len(self.stats), total, total / len(self.stats)))
+            for kind, fn, seconds in self.stats:
+                result.append('%7.2f sec. %s: %s' % (seconds, kind, g.shortFileName(fn)))
+        g.es_print('\n'.join(result))
     #@+node:ekr.20161026193609.5: *3* bpm.start_process
     def start_process(self, c, command, kind,
         fn=None,
         link_pattern=None,
         link_root=None,
         shell=False,
+        priority=0,
     ):
-        '''Start or queue a process described by command and fn.'''
-        self.data = data = self.ProcessData(c, kind, fn, link_pattern, link_root, shell)
-        if self.pid:
-            # A process is already active.  Add a new callback.
-
-            def callback(data=data, kind=kind):
-                fn = data.fn
-                self.put_log('%s: %s\n' % (kind, g.shortFileName(fn)))
-                self.pid = subprocess.Popen(
-                    command,
-                    shell=shell,
-                    stderr=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    universal_newlines=True,
-                )
-            data.callback = callback
-            self.process_queue.append(data)
-        else:
-            # Start the process immediately.
-            self.kind = kind
-            self.put_log('%s: %s\n' % (kind, g.shortFileName(fn)))
-            self.pid = subprocess.Popen(
-                command,
-                shell=shell,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                universal_newlines=True,
-            )
+        '''
+        Queue a process described by command and fn, and start it now if
+        fewer than @int max-background-processes processes are running.
+        '''
+        n = c.config.getInt('max-background-processes') or 0
+        if n < 1:
+            try:
+                import multiprocessing
+                n = multiprocessing.cpu_count()
+            except Exception: # NotImplementedError
+                n = 1
+        self.max_processes = n
+        self.n_jobs += 1
+        data = self.ProcessData(c, command, kind, fn,
+            link_pattern, link_root, shell, priority, self.n_jobs)
+        self.jobs.append(data)
+        self.process_queue.append(data)
+        self.process_queue.sort(key=lambda z: (-z.priority, z.n))
+        self.check_process()
     #@-others
 #@-others
 #@@language python
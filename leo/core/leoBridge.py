@@ -46,8 +46,16 @@
 # - bridge.openLeoFile(path) returns a completely standard Leo commander.
 #   Host programs can use these commanders as described in Leo's scripting
 #   chapter.
+# 
+# - leoBridge.batch(paths, job) opens many .leo files in parallel worker
+#   processes, each with its own bridge controller, and yields the results
+#   of job(c) for each commander::
+# 
+#     for path, result, error in leoBridge.batch(paths, job, loadPlugins=False):
+#         print(path, error or result)
 #@-<< about the leoBridge module >>
 gBridgeController = None # The singleton bridge controller.
+gBatchJob = None # The job run by batch_worker.
 # This module must import *no* modules at the outer level!
 #@+others
 #@+node:ekr.20070227092442: ** controller
@@ -57,9 +65,16 @@ def controller(
     readSettings=True,
     silent=False,
     tracePlugins=False,
-    verbose=False
+    verbose=False,
+    lazySubCommanders=False,
 ):
-    '''Create an singleton instance of a bridge controller.'''
+    '''
+    Create an singleton instance of a bridge controller.
+
+    lazySubCommanders=True makes commanders using the null gui create most
+    subcommanders, c.commandsDict and all key bindings only when first
+    used. This makes opening many outlines much faster.
+    '''
     global gBridgeController
     if not gBridgeController:
         gBridgeController = BridgeController(
@@ -68,18 +83,107 @@ def controller(
             readSettings,
             silent,
             tracePlugins,
-            verbose)
+            verbose,
+            lazySubCommanders)
     return gBridgeController
+#@+node:ekr.20180907150000.1: ** batch & helpers
+def batch(paths, job,
+    processes=None,
+    files_per_process=100,
+    ordered=False,
+    **keys
+):
+    '''
+    Open each .leo file in paths in one of several worker processes, call
+    job(c) with its commander and yield (path, result, error) tuples as each
+    outline is done.
+
+    job must be a module-level function, and its result must be picklable.
+    error is None, or the traceback of an exception raised while opening
+    the outline or running the job. Outlines are closed without saving
+    them: the job must save c if it changes the outline.
+
+    processes:          The number of worker processes. None: cpu_count.
+                        1: run all jobs in the calling process.
+    files_per_process:  Replace each worker process after it has handled
+                        this many outlines, limiting memory growth.
+                        0 or None: never replace worker processes.
+    ordered:            True: yield results in the order of paths.
+    keys:               Keyword args for controller in each worker process.
+    '''
+    import multiprocessing
+    paths = list(paths)
+    if processes is None:
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+    processes = max(1, min(processes, len(paths)))
+    if processes == 1:
+        batch_init(job, keys)
+        for path in paths:
+            yield batch_worker(path)
+        return
+    if gBridgeController and hasattr(multiprocessing, 'get_context'):
+        # Forked workers would share this process's caches and databases.
+        multiprocessing = multiprocessing.get_context('spawn')
+    pool = multiprocessing.Pool(processes,
+        initializer=batch_init,
+        initargs=(job, keys),
+        maxtasksperchild=files_per_process or None)
+    ok = False
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for data in imap(batch_worker, paths):
+            yield data
+        ok = True
+    finally:
+        if ok:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+#@+node:ekr.20180907150000.2: *3* batch_init
+def batch_init(job, keys):
+    '''Init a worker process of leoBridge.batch.'''
+    global gBatchJob
+    gBatchJob = job
+    controller(**keys)
+#@+node:ekr.20180907150000.3: *3* batch_worker
+def batch_worker(path):
+    '''
+    Open the outline at path, run the job and close the outline.
+    Return (path, result, error).
+    '''
+    import traceback
+    bridge = gBridgeController
+    g = bridge.globals()
+    c = None
+    try:
+        fileName = bridge.completeFileName(path)
+        if not g.os_path_exists(fileName):
+            return path, None, 'file not found: %s' % fileName
+        c = bridge.openLeoFile(fileName)
+        return path, gBatchJob(c), None
+    except Exception:
+        return path, None, traceback.format_exc()
+    finally:
+        if c and c.exists:
+            c.setChanged(False)
+            g.app.closeLeoWindow(c.frame, finish_quit=False)
 #@+node:ekr.20070227092442.2: ** class BridgeController
 class BridgeController(object):
     '''Creates a way for host programs to access Leo.'''
     #@+others
     #@+node:ekr.20070227092442.3: *3* bridge.ctor
-    def __init__(self, guiName, loadPlugins, readSettings, silent, tracePlugins, verbose):
+    def __init__(self, guiName, loadPlugins, readSettings, silent, tracePlugins, verbose,
+        lazySubCommanders=False,
+    ):
         '''Ctor for the BridgeController class.'''
         self.g = None
         self.gui = None
         self.guiName = guiName or 'nullGui'
+        self.lazySubCommanders = lazySubCommanders
         self.loadPlugins = loadPlugins
         self.readSettings = readSettings
         self.silentMode = silent
@@ -119,6 +223,7 @@ class BridgeController(object):
         self.g = g = leoGlobals
         assert(g.app)
         g.app.leoID = None
+        g.app.lazySubCommanders = self.lazySubCommanders
         if self.tracePlugins:
             g.app.debug.append('plugins')
         g.app.silentMode = self.silentMode
@@ -10,12 +10,14 @@ if isPython3:
     import pickle
 else:
     import cPickle as pickle
+import atexit
+import collections
 # import glob
 import fnmatch
 # import hashlib
 import os
 import stat
-# import time
+import time
 import zlib
 import sqlite3
 # try:
@@ -61,14 +63,17 @@ class CommanderCacher(object):
         # Careful: self.db may be a dict.
         if SQLITE and hasattr(self.db, 'conn'):
             # pylint: disable=no-member
-            self.db.conn.commit()
-            self.db.conn.close()
+            self.db.close()
     #@+node:ekr.20180627042809.1: *3* cacher.commit
     def commit(self):
         # Careful: self.db may be a dict.
         if SQLITE and hasattr(self.db, 'conn'):
             # pylint: disable=no-member
+            self.db.flush()
             self.db.conn.commit()
+        # Commander wrappers (c.db) keep their data in g.app.db.
+        if hasattr(g.app.db, 'flush'):
+            g.app.db.flush()
     #@+node:ekr.20180611054447.1: *3* cacher.dump
     def dump(self):
         '''Dump the indicated cache if --trace-cache is in effect.'''
@@ -127,6 +132,29 @@ class CommanderWrapper(object):
     def get(self, key, default=None):
         value = self.db.get('%s:::%s' % (self.key, key))
         return default if value is None else value
+
+    def get_many(self, keys, default=None):
+        '''Return the list of the values of the given keys.'''
+        keys = ['%s:::%s' % (self.key, key) for key in keys]
+        if hasattr(self.db, 'get_many'):
+            values = self.db.get_many(keys)
+        else:
+            values = [self.db.get(key) for key in keys]
+        return [default if value is None else value for value in values]
+
+    def set_many(self, items):
+        '''Set the keys and values in items, a dict or a list of pairs.'''
+        if hasattr(items, 'items'):
+            items = items.items()
+        items2 = []
+        for key, value in items:
+            self.user_keys.add(key)
+            items2.append(('%s:::%s' % (self.key, key), value))
+        if hasattr(self.db, 'set_many'):
+            self.db.set_many(items2)
+        else:
+            for key, value in items2:
+                self.db[key] = value
     
     def keys(self):
         return sorted(list(self.user_keys))
@@ -176,8 +204,7 @@ class GlobalCacher(object):
         # Careful: self.db may be a dict.
         if SQLITE and hasattr(self.db, 'conn'):
             # pylint: disable=no-member
-            self.db.conn.commit()
-            self.db.conn.close()
+            self.db.close()
     #@+node:ekr.20180627045953.1: *3* g_cacher.dump
     def dump(self):
         '''Dump the indicated cache if --trace-cache is in effect.'''
@@ -456,8 +483,20 @@ class PickleShareDB(object):
 #@+node:vitalije.20170716201700.1: ** class SqlitePickleShare
 _sentinel = object()
 
+# The types of values that SqlitePickleShare caches without pickling them.
+# Callers can't change these values. This works in Python 2 and 3.
+_immutable_types = tuple(set(type(z) for z in (None, True, 0, 1 << 64, 0.0, b'', u'')))
+
 class SqlitePickleShare(object):
-    """ The main 'connection' object for SqlitePickleShare database """
+    """
+    The main 'connection' object for SqlitePickleShare database
+
+    An in-memory write-back cache holds recently used values. Setting or
+    deleting keys changes only the cache. self.flush writes all changes in
+    one transaction. Leo calls it when saving an outline, at idle time and
+    when closing the db. Values that other processes change become
+    visible within self.version_check_interval seconds.
+    """
     #@+others
     #@+node:vitalije.20170716201700.2: *3*  Birth & special methods
     def init_dbtables(self, conn):
@@ -474,10 +513,31 @@ class SqlitePickleShare(object):
             self._makedirs(self.root)
         dbfile = ':memory:' if g.unitTesting else join(root, 'cache.sqlite')
         self.conn = sqlite3.connect(dbfile, isolation_level=None)
+        try:
+            # Readers don't block the writer, and commits don't sync the db.
+            self.conn.execute('pragma journal_mode=wal;')
+            self.conn.execute('pragma synchronous=normal;')
+        except sqlite3.Error:
+            pass
         self.init_dbtables(self.conn)
         self.cache = {}
             # Keys are normalized file names.
             # Values are tuples (obj, orig_mod_time)
+        self.lru = collections.OrderedDict()
+            # The write-back cache, least recently used keys first.
+            # Values are tuples (obj, data, size). obj is the value if its
+            # type is in _immutable_types, _sentinel if the key is not in
+            # the db, and None otherwise. data is the pickled value, or None.
+        self.lru_size = 0 # The total size of the cached values.
+        self.max_cache_size = 16 * 1024 * 1024
+        self.dirty = set() # Keys whose cached values must be written.
+        self.idle_flush = False # True: self.flush is an idle-time callback.
+        self.data_version = self._get_data_version()
+        self.version_check_interval = 0.5 # Seconds.
+        self.next_version_check = 0.0
+        self.hits = 0 # Statistics.
+        self.misses = 0
+        self.flushes = 0
 
         def loadz(data):
             if data:
@@ -490,19 +550,23 @@ class SqlitePickleShare(object):
             else:
                 return None
 
-        def dumpz(val):
+        def dumps(val):
             try:
                 # use Python 2's highest protocol, 2, if possible
-                data = pickle.dumps(val, protocol=2)
+                return pickle.dumps(val, protocol=2)
             except Exception:
                 # but use best available if that doesn't work (unlikely)
-                data = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
-            return sqlite3.Binary(zlib.compress(data))
+                return pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+
+        def dumpz(val):
+            return sqlite3.Binary(zlib.compress(dumps(val)))
 
         self.loader = loadz
         self.dumper = dumpz
+        self.pickler = dumps
         if g.isPython3:
             self.reset_protocol_in_values()
+        atexit.register(self.flush)
     #@+node:vitalije.20170716201700.4: *4* __contains__(SqlitePickleShare)
     def __contains__(self, key):
 
@@ -510,15 +574,19 @@ class SqlitePickleShare(object):
     #@+node:vitalije.20170716201700.5: *4* __delitem__
     def __delitem__(self, key):
         """ del db["key"] """
-        try:
-            self.conn.execute('''delete from cachevalues
-                where key=?''', (key,))
-        except sqlite3.OperationalError:
-            pass
-
+        self._cache(key, (_sentinel, None, 0))
+        self.dirty.add(key)
+        self._start_idle_flush()
     #@+node:vitalije.20170716201700.6: *4* __getitem__
     def __getitem__(self, key):
         """ db['key'] reading """
+        entry = self._lookup(key)
+        if entry:
+            self.hits += 1
+            if entry[0] is _sentinel:
+                raise KeyError(key)
+            return self._value(entry)
+        self.misses += 1
         try:
             obj = None
             for row in self.conn.execute('''select data from cachevalues
@@ -526,9 +594,11 @@ class SqlitePickleShare(object):
                 obj = self.loader(row[0])
                 break
             else:
+                self._cache(key, (_sentinel, None, 0))
                 raise KeyError(key)
         except sqlite3.Error:
             raise KeyError(key)
+        self._cache(key, self._entry(obj))
         return obj
     #@+node:vitalije.20170716201700.7: *4* __iter__
     def __iter__(self):
@@ -541,13 +611,170 @@ class SqlitePickleShare(object):
     #@+node:vitalije.20170716201700.9: *4* __setitem__
     def __setitem__(self, key, value):
         """ db['key'] = 5 """
+        entry = self._entry(value)
+        old = self.lru.get(key)
+        if (old and old[0] is not _sentinel and old[1] == entry[1] and
+            type(old[0]) is type(entry[0]) and old[0] == entry[0] and
+            # Another connection may have changed the key since it was cached.
+            (key in self.dirty or not self._check_data_version(force=True))
+        ):
+            return # Don't write an unchanged value.
+        self._cache(key, entry)
+        self.dirty.add(key)
+        self._start_idle_flush()
+    #@+node:ekr.20180907183000.1: *3* Write-back cache (SqlitePickleShare)
+    #@+node:ekr.20180907183000.2: *4* _cache
+    def _cache(self, key, entry):
+        '''Make entry the most recently used cache entry for key.'''
+        old = self.lru.pop(key, None)
+        if old:
+            self.lru_size -= old[2]
+        self.lru[key] = entry
+        self.lru_size += entry[2]
+        # Forget the least recently used values.
+        while self.lru_size > self.max_cache_size and len(self.lru) > 1:
+            if next(iter(self.lru)) in self.dirty:
+                self.flush()
+            key, entry = self.lru.popitem(last=False)
+            self.lru_size -= entry[2]
+    #@+node:ekr.20180907183000.3: *4* _entry
+    def _entry(self, value):
+        '''Return a cache entry for value.'''
+        if type(value) in _immutable_types:
+            size = len(value) if isinstance(value, (bytes, type(u''))) else 8
+            return value, None, size
+        data = self.pickler(value)
+        return None, data, len(data)
+    #@+node:ekr.20180907220000.3: *4* _check_data_version
+    def _check_data_version(self, force=False):
+        '''
+        Forget all unchanged values if another connection has changed the
+        db. Unless force is True, check at most once per
+        self.version_check_interval seconds.
+
+        Return True if the db may have been changed by another connection.
+        '''
+        if self.data_version is None:
+            return True
+        t = time.time()
+        if not force and t < self.next_version_check:
+            return False
+        self.next_version_check = t + self.version_check_interval
+        version = self._get_data_version()
+        if version == self.data_version:
+            return False
+        # Another process has changed the db. Forget unchanged values.
+        self.data_version = version
+        for key in list(self.lru):
+            if key not in self.dirty:
+                self.lru_size -= self.lru.pop(key)[2]
+        return True
+    #@+node:ekr.20180907183000.4: *4* _get_data_version
+    def _get_data_version(self):
+        '''
+        Return a number that changes whenever another connection changes the
+        db, or None if sqlite doesn't support "pragma data_version".
+        '''
+        try:
+            return self.conn.execute('pragma data_version;').fetchone()[0]
+        except (sqlite3.Error, TypeError):
+            return None
+    #@+node:ekr.20180907183000.5: *4* _lookup
+    def _lookup(self, key):
+        '''Return the cache entry for key, or None.'''
+        self._check_data_version()
+        entry = self.lru.pop(key, None)
+        if entry:
+            self.lru[key] = entry # Now the most recently used entry.
+        return entry
+    #@+node:ekr.20180907183000.6: *4* _start_idle_flush
+    def _start_idle_flush(self):
+        '''Make self.flush an idle-time callback, if possible.'''
+        if not self.idle_flush:
+            itm = g.app and g.app.idleTimeManager
+            if itm:
+                self.idle_flush = True
+                itm.add_callback(self.flush)
+    #@+node:ekr.20180907183000.7: *4* _value
+    def _value(self, entry):
+        '''Return the value of a cache entry, unpickling it if necessary.'''
+        obj, data, size = entry
+        return obj if data is None else pickle.loads(data)
+    #@+node:ekr.20180907183000.8: *4* close
+    def close(self):
+        '''Write all changes and close the connection.'''
+        self.flush()
+        self.conn.commit()
+        self.conn.close()
+        self.conn = None
+    #@+node:ekr.20180907183000.9: *4* flush
+    def flush(self):
+        '''Write all changed keys in one transaction.'''
+        if not self.dirty or not self.conn:
+            return
+        replaced, deleted = [], []
+        for key in self.dirty:
+            obj, data, size = self.lru[key]
+            if obj is _sentinel:
+                deleted.append((key,))
+            else:
+                if data is None:
+                    data = self.pickler(obj)
+                replaced.append((key, sqlite3.Binary(zlib.compress(data))))
         try:
-            data = self.dumper(value)
-            self.conn.execute('''replace into cachevalues(key, data)
-                values(?,?);''', (key, data))
-        except sqlite3.OperationalError as e:
+            self.conn.execute('begin;')
+            self.conn.executemany('''replace into cachevalues(key, data)
+                values(?,?);''', replaced)
+            self.conn.executemany('''delete from cachevalues
+                where key=?''', deleted)
+            self.conn.execute('commit;')
+            self.dirty = set()
+            self.flushes += 1
+        except sqlite3.Error as e:
             g.es_exception(e)
-
+            try:
+                self.conn.execute('rollback;')
+            except sqlite3.Error:
+                pass
+    #@+node:ekr.20180907183000.10: *4* get_many
+    def get_many(self, keys, default=None):
+        '''
+        Return the list of the values of the given keys, reading all
+        uncached keys with as few queries as possible.
+        '''
+        result, missing = {}, []
+        for key in keys:
+            if key in result:
+                continue
+            entry = self._lookup(key)
+            if entry:
+                self.hits += 1
+                result[key] = default if entry[0] is _sentinel else self._value(entry)
+            else:
+                self.misses += 1
+                result[key] = default
+                missing.append(key)
+        n = 500 # Less than sqlite's limit on the number of parameters.
+        for i in range(0, len(missing), n):
+            chunk = missing[i: i + n]
+            sql = 'select key, data from cachevalues where key in (%s);' % (
+                ','.join(['?'] * len(chunk)))
+            found = set()
+            for key, data in self.conn.execute(sql, chunk):
+                obj = result[key] = self.loader(data)
+                self._cache(key, self._entry(obj))
+                found.add(key)
+            for key in chunk:
+                if key not in found:
+                    self._cache(key, (_sentinel, None, 0))
+        return [result[key] for key in keys]
+    #@+node:ekr.20180907183000.11: *4* set_many
+    def set_many(self, items):
+        '''Set the keys and values in items, a dict or a list of pairs.'''
+        if hasattr(items, 'items'):
+            items = items.items()
+        for key, value in items:
+            self[key] = value
     #@+node:vitalije.20170716201700.10: *3* _makedirs
     def _makedirs(self, fn, mode=0o777):
 
@@ -601,12 +828,13 @@ class SqlitePickleShare(object):
         # Deletes all files in the fcache subdirectory.
         # It would be more thorough to delete everything
         # below the root directory, but it's not necessary.
+        self.lru.clear()
+        self.lru_size = 0
+        self.dirty = set()
         self.conn.execute('delete from cachevalues;')
     #@+node:vitalije.20170716201700.16: *3* get
     def get(self, key, default=None):
 
-        if not self.has_key(key):
-            return default
         try:
             val = self[key]
             return val
@@ -614,12 +842,17 @@ class SqlitePickleShare(object):
             return default
     #@+node:vitalije.20170716201700.17: *3* has_key (SqlightPickleShare)
     def has_key(self, key):
+        entry = self._lookup(key)
+        if entry:
+            return entry[0] is not _sentinel
         sql = 'select 1 from cachevalues where key=?;'
         for row in self.conn.execute(sql, (key,)):
             return True
+        self._cache(key, (_sentinel, None, 0))
         return False
     #@+node:vitalije.20170716201700.18: *3* items
     def items(self):
+        self.flush()
         sql = 'select key,data from cachevalues;'
         for key,data in self.conn.execute(sql):
             yield key, data
@@ -628,6 +861,7 @@ class SqlitePickleShare(object):
 
     def keys(self, globpat=None):
         """Return all keys in DB, or all keys matching a glob"""
+        self.flush()
         if globpat is None:
             sql = 'select key from cachevalues;'
             args = tuple()
@@ -647,6 +881,7 @@ class SqlitePickleShare(object):
         row = self.get('viewrendered_default_layouts') or (None, None)
         row = json.loads(json.dumps(row[0])), json.loads(json.dumps(row[1]))
         self['viewrendered_default_layouts'] = row
+        self.flush()
         #@+node:vitalije.20170818115617.1: *4* do_block
         def do_block(cur):
             itms = tuple((self.dumper(self.loader(v)), k) for k, v in cur)
@@ -667,14 +902,24 @@ class SqlitePickleShare(object):
         lk = do_block(block)
         while lk:
             lk = do_block(self.conn.execute(sql1, (lk,)))
-        self[PROTOCOLKEY] = 2
         self.conn.commit()
 
         self.conn.isolation_level = None
+        # do_block changed values without changing the cache.
+        self.uncache()
+        self[PROTOCOLKEY] = 2
+        self.flush()
     #@+node:vitalije.20170716201700.23: *3* uncache
     def uncache(self, *items):
-        """not used in SqlitePickleShare"""
-        pass
+        """
+        Remove all, or the given keys, from the cache, after writing all
+        changes. Later reads read the db.
+        """
+        self.flush()
+        for key in items or list(self.lru):
+            entry = self.lru.pop(key, None)
+            if entry:
+                self.lru_size -= entry[2]
     #@-others
 #@+node:ekr.20180627050237.1: ** function: dump_cache
 def dump_cache(db, tag):
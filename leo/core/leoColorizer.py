@@ -157,7 +157,7 @@ class JEditColorizer(BaseColorizer):
         self.language = 'python' # set by scanLanguageDirectives.
         self.showInvisibles = False
         # Step 2: create the highlighter.
-        if isinstance(widget, QtWidgets.QTextEdit):
+        if QtWidgets and isinstance(widget, QtWidgets.QTextEdit):
             self.highlighter = LeoHighlighter(c,
                 colorizer = self,
                 document = widget.document(),
@@ -180,6 +180,19 @@ class JEditColorizer(BaseColorizer):
         self.restartDict = {} # Keys are state numbers, values are restart functions.
         self.stateDict = {} # Keys are state numbers, values state names.
         self.stateNameDict = {} # Keys are state names, values are state numbers.
+        # Line caches...
+        self.line_cache = {}
+            # The line cache of self.old_v. Keys are (state, line),
+            # values are (final state, spans) for the colored line.
+        self.line_cache_d = {}
+            # Keys are vnodes, values are (key, line cache).
+        self.line_cache_vnodes = []
+            # The vnodes in line_cache_d, most recently colored last.
+        self.max_line_caches = 50
+        self.line_cache_hits = 0
+        self.line_cache_misses = 0
+        self.spans = None
+            # (i, length, format) for each setFormat in the present line.
         # Attributes dict ivars: defaults are as shown...
         self.default = 'null'
         self.digit_re = ''
@@ -369,6 +382,10 @@ class JEditColorizer(BaseColorizer):
             "body_text_font_slant", "body_text_font_weight",
             c.config.defaultBodyFontSize)
         self.color_tags_list = []
+        # Cached formats may be out of date.
+        self.line_cache_d = {}
+        self.line_cache_vnodes = []
+        self.old_v = None
     #@+node:ekr.20110605121601.18576: *4* jedit.addImportedRules
     def addImportedRules(self, mode, rulesDict, rulesetName):
         '''Append any imported rules at the end of the rulesets specified in mode.importDict'''
@@ -448,7 +465,7 @@ class JEditColorizer(BaseColorizer):
         '''
         c, widget, wrapper = self.c, self.widget, self.wrapper
         # For some reason, the size is not accurate.
-        if isinstance(widget, QtWidgets.QTextEdit):
+        if QtWidgets and isinstance(widget, QtWidgets.QTextEdit):
             font = wrapper.widget.currentFont()
             info = QtGui.QFontInfo(font)
             size = info.pointSizeF()
@@ -575,14 +592,39 @@ class JEditColorizer(BaseColorizer):
         self.configure_hard_tab_width() # 2011/10/04
     #@+node:ekr.20170201082248.1: *4* jedit.init_all_state
     def init_all_state(self, v):
-        '''Completely init all state data.'''
+        '''
+        Init all state data for v.
+
+        State numbers must not change: v's line cache contains them.
+        '''
         assert self.language, g.callers(8)
         self.old_v = v
-        self.n2languageDict = {-1: self.language}
-        self.nextState = 1 # Dont use 0.
-        self.restartDict = {}
-        self.stateDict = {}
-        self.stateNameDict = {}
+        self.n2languageDict[-1] = self.language
+    #@+node:ekr.20180907160411.1: *4* jedit.init_line_cache
+    def init_line_cache(self, p):
+        '''
+        Set self.line_cache to the line cache of p.v.
+
+        The cache remains valid unless the language, settings that affect
+        coloring, or (for bodies containing section references) the
+        headlines of p's subtree have changed.
+        '''
+        v = p.v
+        refs = '<<' in v.b and [z.h for z in p.self_and_subtree(copy=False)]
+        key = (self.language, self.enabled, self.showInvisibles, refs)
+        data = self.line_cache_d.get(v)
+        aList = self.line_cache_vnodes
+        if data and data[0] == key and len(data[1]) < 2 * v.b.count('\n') + 100:
+            self.line_cache = data[1]
+            aList.remove(v)
+        else:
+            self.line_cache = {}
+            self.line_cache_d[v] = key, self.line_cache
+            if data:
+                aList.remove(v)
+        aList.append(v)
+        while len(aList) > self.max_line_caches:
+            del self.line_cache_d[aList.pop(0)]
     #@+node:ekr.20110605121601.18581: *4* jedit.init_mode & helpers
     def init_mode(self, name):
         '''Name may be a language name or a delegate name.'''
@@ -1849,6 +1891,7 @@ class JEditColorizer(BaseColorizer):
             assert self.language
             self.init_all_state(p.v)
             self.init(p)
+            self.init_line_cache(p)
         else:
             new_language = self.n2languageDict.get(n)
             if new_language != self.language:
@@ -1857,9 +1900,26 @@ class JEditColorizer(BaseColorizer):
         if block_n == 0:
             n = self.initBlock0()
         n = self.setState(n) # Required.
+        #
+        # Reuse the spans and final state of previous colorings of the line.
+        key = n, s
+        data = self.line_cache.get(key)
+        if data:
+            self.line_cache_hits += 1
+            n, spans = data
+            for i, length, format in spans:
+                self.highlighter.setFormat(i, length, format)
+            self.setState(n)
+            return
+        self.line_cache_misses += 1
+        self.spans = spans = []
         # Always color the line, even if colorizing is disabled.
-        if s:
-            self.mainLoop(n, s)
+        try:
+            if s:
+                self.mainLoop(n, s)
+        finally:
+            self.spans = None
+        self.line_cache[key] = self.currentState(), spans
     #@+node:ekr.20170126100139.1: *4* jedit.initBlock0
     def initBlock0 (self):
         '''
@@ -1920,7 +1980,7 @@ class JEditColorizer(BaseColorizer):
                     aList.insert(0, wiki_rule)
                     d [ch] = aList
         self.rulesDict = d
-    #@+node:ekr.20110605121601.18641: *3* jedit.setTag
+    #@+node:ekr.20110605121601.18641: *3* jedit.setTag & helper
     def setTag(self, tag, s, i, j):
         '''Set the tag in the highlighter.'''
         self.n_setTag += 1
@@ -1967,7 +2027,13 @@ class JEditColorizer(BaseColorizer):
             format.setForeground(color)
             format.setUnderlineStyle(format.NoUnderline)
         self.tagCount += 1
-        self.highlighter.setFormat(i, j - i, format)
+        self.setFormat(i, j - i, format)
+    #@+node:ekr.20180907160411.2: *4* jedit.setFormat
+    def setFormat(self, i, length, format):
+        '''Set the format in the highlighter and remember it for the line cache.'''
+        if self.spans is not None:
+            self.spans.append((i, length, format))
+        self.highlighter.setFormat(i, length, format)
     #@-others
 #@+node:ekr.20110605121601.18565: ** class LeoHighlighter
 # This is c.frame.body.colorizer.highlighter
@@ -123,6 +123,9 @@ class Commands(object):
     def initDebugIvars(self):
         '''Init Commander debugging ivars.'''
         self.command_count = 0
+        self.directiveCacheHits = 0
+        self.directiveCacheMisses = 0
+            # Statistics for g.get_cached_directives_dict.
         self.scanAtPathDirectivesCount = 0
         self.trace_focus_count = 0
     #@+node:ekr.20120217070122.10471: *5* c.initDocumentIvars
@@ -134,6 +137,9 @@ class Commands(object):
             # The last node we expanded or contracted.
         self.nodeConflictList = []
             # List of nodes with conflicting read-time data.
+        self.scanAtPathDirectivesCache = {}
+            # Keys are tuples (base, path1, path2, ...). Values are absolute paths.
+            # Used only by c.scanAtPathDirectives.
         self.nodeConflictFileName = None
             # The fileName for c.nodeConflictList.
         self.user_dict = {}
@@ -228,6 +234,9 @@ class Commands(object):
         self.spellCommands = None
         self.leoTestManager = None
         self.vimCommands = None
+        self.lazySubCommanders = {}
+            # Keys are the names of subcommanders that c.__getattr__ will
+            # create when first used. Values are their classes.
     #@+node:ekr.20120217070122.10470: *5* c.initObjects
     #@@nobeautify
 
@@ -305,63 +314,55 @@ class Commands(object):
         import leo.core.leoTest as leoTest
         import leo.core.leoUndo as leoUndo
         import leo.core.leoVim as leoVim
-        # Define the subcommanders.
-        self.keyHandler = self.k    = leoKeys.KeyHandlerClass(c)
-        self.chapterController      = leoChapters.ChapterController(c)
-        self.shadowController       = leoShadow.ShadowController(c)
-        self.fileCommands           = leoFileCommands.FileCommands(c)
-        self.findCommands           = leoFind.LeoFind(c)
-        self.atFileCommands         = leoAtFile.AtFile(c)
-        self.importCommands         = leoImport.LeoImportCommands(c)
-        self.persistenceController  = leoPersistence.PersistenceDataController(c)
-        self.printingController     = leoPrinting.PrintingController(c)
-        self.rstCommands            = leoRst.RstCommands(c)
-        self.tangleCommands         = leoTangle.TangleCommands(c)
-        self.testManager            = leoTest.TestManager(c)
-        self.vimCommands            = leoVim.VimCommands(c)
-        # User commands
-        self.abbrevCommands     = abbrevCommands.AbbrevCommandsClass(c)
-        self.controlCommands    = controlCommands.ControlCommandsClass(c)
-        self.convertCommands    = convertCommands.ConvertCommandsClass(c)
-        self.debugCommands      = debugCommands.DebugCommandsClass(c)
-        self.editCommands       = editCommands.EditCommandsClass(c)
-        self.editFileCommands   = editFileCommands.EditFileCommandsClass(c)
-        self.gotoCommands       = gotoCommands.GoToCommands(c)
-        self.helpCommands       = helpCommands.HelpCommandsClass(c)
-        self.keyHandlerCommands = keyCommands.KeyHandlerCommandsClass(c)
-        self.killBufferCommands = killBufferCommands.KillBufferCommandsClass(c)
-        self.rectangleCommands  = rectangleCommands.RectangleCommandsClass(c)
-        self.spellCommands      = spellCommands.SpellCommandsClass(c)
-        self.undoer             = leoUndo.Undoer(c)
+        # Define the subcommanders, in the order of creation.
+        # True: create the subcommander when first used if c.lazySubCommanders.
+        table = (
+            ('keyHandler',              leoKeys.KeyHandlerClass,                    False),
+            ('chapterController',       leoChapters.ChapterController,              False),
+            ('shadowController',        leoShadow.ShadowController,                 False),
+            ('fileCommands',            leoFileCommands.FileCommands,               False),
+            ('findCommands',            leoFind.LeoFind,                            True),
+            ('atFileCommands',          leoAtFile.AtFile,                           False),
+            ('importCommands',          leoImport.LeoImportCommands,                True),
+            ('persistenceController',   leoPersistence.PersistenceDataController,   True),
+            ('printingController',      leoPrinting.PrintingController,             True),
+            ('rstCommands',             leoRst.RstCommands,                         True),
+            ('tangleCommands',          leoTangle.TangleCommands,                   True),
+            ('testManager',             leoTest.TestManager,                        True),
+            ('vimCommands',             leoVim.VimCommands,                         True),
+            # User commands
+            ('abbrevCommands',          abbrevCommands.AbbrevCommandsClass,         True),
+            ('controlCommands',         controlCommands.ControlCommandsClass,       True),
+            ('convertCommands',         convertCommands.ConvertCommandsClass,       True),
+            ('debugCommands',           debugCommands.DebugCommandsClass,           True),
+            ('editCommands',            editCommands.EditCommandsClass,             False),
+            ('editFileCommands',        editFileCommands.EditFileCommandsClass,     True),
+            ('gotoCommands',            gotoCommands.GoToCommands,                  True),
+            ('helpCommands',            helpCommands.HelpCommandsClass,             True),
+            ('keyHandlerCommands',      keyCommands.KeyHandlerCommandsClass,        True),
+            ('killBufferCommands',      killBufferCommands.KillBufferCommandsClass, True),
+            ('rectangleCommands',       rectangleCommands.RectangleCommandsClass,   True),
+            ('spellCommands',           spellCommands.SpellCommandsClass,           True),
+            ('undoer',                  leoUndo.Undoer,                             False),
+        )
+        # g.app.lazySubCommanders affects only headless commanders.
+        lazy = g.app.lazySubCommanders and gui.isNullGui
         # Create the list of subcommanders.
-        self.subCommanders = [
-            self.abbrevCommands,
-            self.atFileCommands,
-            self.chapterController,
-            self.controlCommands,
-            self.convertCommands,
-            self.debugCommands,
-            self.editCommands,
-            self.editFileCommands,
-            self.fileCommands,
-            self.findCommands,
-            self.gotoCommands,
-            self.helpCommands,
-            self.importCommands,
-            self.keyHandler,
-            self.keyHandlerCommands,
-            self.killBufferCommands,
-            self.persistenceController,
-            self.printingController,
-            self.rectangleCommands,
-            self.rstCommands,
-            self.shadowController,
-            self.spellCommands,
-            self.tangleCommands,
-            self.testManager,
-            self.vimCommands,
-            self.undoer,
-        ]
+        self.subCommanders = []
+        for ivar, cls, may_be_lazy in table:
+            if lazy and may_be_lazy:
+                # Remove the ivar so that c.__getattr__ creates the subcommander.
+                self.__dict__.pop(ivar, None)
+                self.lazySubCommanders[ivar] = cls
+            else:
+                obj = cls(c)
+                setattr(self, ivar, obj)
+                self.subCommanders.append(obj)
+        self.k = self.keyHandler
+        if lazy:
+            # c.createLazySubCommander creates all commands and key bindings.
+            del self.commandsDict
+            self.lazySubCommanders['commandsDict'] = dict
         # Other objects
         c.configurables = c.subCommanders[:]
             # A list of other classes that have a reloadSettings method
@@ -380,6 +381,39 @@ class Commands(object):
         import leo.core.leoConfig as leoConfig
         c.config = leoConfig.LocalConfigManager(c, previousSettings)
         g.app.config.setIvarsFromSettings(c)
+    #@+node:ekr.20180907140216.1: *4* c.__getattr__ & createLazySubCommander
+    def __getattr__(self, name):
+        '''
+        Create a lazy subcommander when first used.
+        Python calls this method only if the usual lookup fails.
+        '''
+        lazy = self.__dict__.get('lazySubCommanders')
+        if lazy and name in lazy:
+            return self.createLazySubCommander(name)
+        raise AttributeError('%s object has no attribute %r' % (
+            self.__class__.__name__, name))
+
+    def createLazySubCommander(self, name):
+        '''
+        Create and return the lazy subcommander with the given name.
+        See c.initObjects.
+        '''
+        c, k = self, self.k
+        cls = c.lazySubCommanders.pop(name)
+        if name == 'commandsDict':
+            c.commandsDict = {}
+            c.createCommandNames()
+            if k.inited:
+                k.makeAllBindings()
+            return c.commandsDict
+        obj = cls(c)
+        setattr(c, name, obj)
+        c.subCommanders.append(obj)
+        c.registerReloadSettings(obj)
+        if k.inited and name in ('abbrevCommands', 'findCommands', 'vimCommands'):
+            # Like c.finishCreate.
+            obj.finishCreate()
+        return obj
     #@+node:ekr.20031218072017.2814: *4* c.__repr__ & __str__
     def __repr__(self):
         return "Commander %d: %s" % (id(self), repr(self.mFileName))
@@ -397,23 +431,30 @@ class Commands(object):
         c.frame.finishCreate()
         c.miniBufferWidget = c.frame.miniBufferWidget
             # Will be None for nullGui.
+        # c.createLazySubCommander finishes lazy subcommanders.
+        lazy = c.lazySubCommanders
         # Only c.abbrevCommands needs a finishCreate method.
-        c.abbrevCommands.finishCreate()
+        if 'abbrevCommands' not in lazy:
+            c.abbrevCommands.finishCreate()
         # Finish other objects...
-        c.createCommandNames()
+        if 'commandsDict' not in lazy:
+            c.createCommandNames()
         k.finishCreate()
-        c.findCommands.finishCreate()
+        if 'findCommands' not in lazy:
+            c.findCommands.finishCreate()
         if not c.gui.isNullGui:
             g.registerHandler('idle', c.idle_focus_helper)
         c.frame.menu.finishCreate()
         c.frame.log.finishCreate()
         c.undoer.clearUndoState()
-        if c.vimCommands and c.vim_mode:
+        if 'vimCommands' not in lazy and c.vimCommands and c.vim_mode:
             c.vimCommands.finishCreate()
             # Menus must exist at this point.
         # Do not call chapterController.finishCreate here:
         # It must be called after the first real redraw.
-        g.check_cmd_instance_dict(c, g)
+        if not lazy:
+            # This would create all lazy subcommanders.
+            g.check_cmd_instance_dict(c, g)
         c.bodyWantsFocus()
     #@+node:ekr.20140815160132.18835: *5* c.createCommandNames
     def createCommandNames(self):
@@ -728,14 +769,12 @@ class Commands(object):
     def all_nodes(self):
         '''A generator returning all vnodes in the outline, in outline order.'''
         c = self
-        for p in c.all_positions():
-            yield p.v
+        return leoNodes.position_generator(c.hiddenRootNode, vnodes=True)
 
     def all_unique_nodes(self):
         '''A generator returning each vnode of the outline.'''
         c = self
-        for p in c.all_unique_positions(copy=False):
-            yield p.v
+        return leoNodes.position_generator(c.hiddenRootNode, unique=True, vnodes=True)
 
     # Compatibility with old code...
     all_tnodes_iter = all_nodes
@@ -746,10 +785,7 @@ class Commands(object):
     def all_positions(self, copy=True):
         '''A generator return all positions of the outline, in outline order.'''
         c = self
-        p = c.rootPosition()
-        while p:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        return leoNodes.position_generator(c.hiddenRootNode, copy=copy)
 
     # Compatibility with old code...
     all_positions_iter = all_positions
@@ -812,15 +848,7 @@ class Commands(object):
         Returns only the first position for each vnode.
         '''
         c = self
-        p = c.rootPosition()
-        seen = set()
-        while p:
-            if p.v in seen:
-                p.moveToNodeAfterTree()
-            else:
-                seen.add(p.v)
-                yield p.copy() if copy else p
-                p.moveToThreadNext()
+        return leoNodes.position_generator(c.hiddenRootNode, copy=copy, unique=True)
 
     # Compatibility with old code...
     all_positions_with_unique_tnodes_iter = all_unique_positions
@@ -1702,11 +1730,17 @@ class Commands(object):
         c = self
         c.gotoCommands.find_script_line(n, p)
     #@+node:ekr.20090103070824.9: *4* c.setFileTimeStamp
-    def setFileTimeStamp(self, fn):
-        '''Update the timestamp for fn..'''
-        # c = self
-        if g.app.externalFilesController:
-            g.app.externalFilesController.set_time(fn)
+    def setFileTimeStamp(self, fn, root=None):
+        '''
+        Update the timestamp for fn.
+        root is the @<file> node, if any, whose external file is fn.
+        '''
+        c = self
+        efc = g.app.externalFilesController
+        if efc:
+            efc.set_time(fn)
+            if root:
+                efc.track(c, root)
     #@+node:ekr.20031218072017.3000: *4* c.updateSyntaxColorer
     def updateSyntaxColorer(self, v):
         self.frame.body.updateSyntaxColorer(v)
@@ -1945,7 +1979,6 @@ class Commands(object):
             base = g.app.config.relative_path_base_directory
             if base and base == "!": base = g.app.loadDir
             elif base and base == ".": base = c.openDirectory
-        absbase = c.os_path_finalize_join(g.app.loadDir, base)
         # Step 2: look for @path directives.
         paths = []
         for d in aList:
@@ -1958,11 +1991,18 @@ class Commands(object):
                 if path and not warning:
                     paths.append(path)
                 # We will silently ignore empty @path directives.
-        # Add absbase and reverse the list.
-        paths.append(absbase)
-        paths.reverse()
         # Step 3: Compute the full, effective, absolute path.
-        path = c.os_path_finalize_join(*paths)
+        key = tuple([base] + paths)
+        path = c.scanAtPathDirectivesCache.get(key)
+        if path is None:
+            # Add absbase and reverse the list.
+            absbase = c.os_path_finalize_join(g.app.loadDir, base)
+            paths.append(absbase)
+            paths.reverse()
+            path = c.os_path_finalize_join(*paths)
+            # {{expressions}} may have different values each time.
+            if not any(z and '{{' in z for z in key):
+                c.scanAtPathDirectivesCache[key] = path
         return path or g.getBaseDirectory(c)
             # 2010/10/22: A useful default.
     #@+node:ekr.20080828103146.12: *4* c.scanAtRootDirectives (no longer used)
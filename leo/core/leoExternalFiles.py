@@ -5,10 +5,18 @@
 import leo.core.leoGlobals as g
 import getpass
 import os
+import stat
 import subprocess
 import tempfile
 import time
 #@+others
+#@+node:ekr.20180907153012.1: ** show-external-files-stats
+@g.command('show-external-files-stats')
+def show_external_files_stats(event):
+    '''Print statistics about idle-time checks of external files.'''
+    efc = g.app.externalFilesController
+    if efc:
+        efc.show_stats()
 #@+node:ekr.20160306110233.1: ** class ExternalFile
 class ExternalFile(object):
     '''A class holding all data about an external file.'''
@@ -45,6 +53,13 @@ class ExternalFilesController(object):
 
     This class raises a dialog when a file changes outside of Leo.
 
+    Each commander has a registry of the paths of its @<file> nodes, created
+    by walking the outline once and updated whenever Leo reads or writes an
+    external file. At idle time, efc.idle_check_commander stats the
+    registered files for at most self.tick_budget seconds, resuming where
+    the previous tick stopped. Files are checksummed only when their size
+    or modification time changes.
+
     **Convention**:
 
     - d is always a dict created by the @open-with logic.
@@ -57,6 +72,9 @@ class ExternalFilesController(object):
         '''Ctor for ExternalFiles class.'''
         self.checksum_d = {}
             # Keys are full paths, values are file checksums.
+        self.cursor_d = {}
+            # Keys are commanders.
+            # Values are lists of the paths not yet checked in this pass.
         self.enabled_d = {}
             # Keys are commanders.
             # Values are cached check_for_changed_external_file settings.
@@ -65,10 +83,29 @@ class ExternalFilesController(object):
         self.has_changed_d = {}
             # Keys are commanders. Values are bools.
             # Used only to limit traces.
+        self.n_checked = 0
+            # The number of external files checked at idle time.
+        self.check_time = 0.0
+            # The total time spent checking external files at idle time.
+        self.max_tick_time = 0.0
+            # The longest time spent checking files in one idle tick.
+        self.rebuild_interval = 30.0
+            # The time in seconds after which a registry is rebuilt.
+        self.tick_budget = 0.02
+            # The time in seconds that one idle tick may spend checking files.
+        self.tracked_d = {}
+            # Keys are commanders. Values are dicts whose keys are full paths
+            # and whose values are (v, headline) for the @<file> node v.
+        self.tracked_generation_d = {}
+            # Keys are commanders. Values are (generation, time): the
+            # generation of c.frame.tree and the time when the registry
+            # was built.
         self.unchecked_commanders = []
             # Copy of g.app.commanders()
         self.unchecked_files = []
             # Copy of self file. Only one files is checked at idle time.
+        self._size_d = {}
+            # Keys are full paths, values are file sizes.
         self._time_d = {}
             # Keys are full paths, values are modification times.
             # DO NOT alter directly, use set_time(path) and
@@ -105,6 +142,12 @@ class ExternalFilesController(object):
         for ef in files:
             self.destroy_external_file(ef)
         self.files = [z for z in self.files if z.path not in paths]
+        # Forget the commander.
+        c = frame.c
+        for d in (self.cursor_d, self.enabled_d, self.tracked_d, self.tracked_generation_d):
+            d.pop(c, None)
+        if c in self.unchecked_commanders:
+            self.unchecked_commanders.remove(c)
     #@+node:ekr.20031218072017.2614: *5* efc.destroy_external_file
     def destroy_external_file(self, ef):
         '''Destroy the file corresponding to the given ExternalFile instance.'''
@@ -153,8 +196,9 @@ class ExternalFilesController(object):
             elif self.unchecked_commanders:
                 # Check the next commander for which
                 # @bool check_for_changed_external_file is True.
-                c = self.unchecked_commanders.pop()
-                self.idle_check_commander(c)
+                c = self.unchecked_commanders[-1]
+                if self.idle_check_commander(c):
+                    self.unchecked_commanders.pop()
             else:
                 # Add all commanders for which
                 # @bool check_for_changed_external_file is True.
@@ -175,25 +219,57 @@ class ExternalFilesController(object):
     #@+node:ekr.20150404045115.1: *5* efc.idle_check_commander
     def idle_check_commander(self, c):
         '''
-        Check all external files corresponding to @<file> nodes in c for
-        changes.
+        Check the external files corresponding to @<file> nodes in c for
+        changes, for at most self.tick_budget seconds.
+
+        Return True if all files of c have been checked.
         '''
-        p = c.rootPosition()
-        seen = set()
-        while p:
-            if p.v in seen:
-                p.moveToNodeAfterTree()
-            elif p.isAnyAtFileNode():
-                seen.add(p.v)
-                self.idle_check_at_file_node(c, p)
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        t1 = time.time()
+        paths = self.cursor_d.get(c)
+        if paths is None:
+            paths = self.cursor_d[c] = list(self.get_tracked(c))
+        n = 0
+        while paths:
+            self.idle_check_at_file_node(c, paths.pop())
+            n += 1
+            if time.time() - t1 > self.tick_budget:
+                break
+        t = time.time() - t1
+        self.n_checked += n
+        self.check_time += t
+        self.max_tick_time = max(self.max_tick_time, t)
+        if paths:
+            return False
+        del self.cursor_d[c]
+        return True
     #@+node:ekr.20150403044823.1: *5* efc.idle_check_at_file_node
-    def idle_check_at_file_node(self, c, p):
-        '''Check the @<file> node at p for external changes.'''
-        path = g.fullPath(c, p)
+    def idle_check_at_file_node(self, c, path):
+        '''Check the registered @<file> node for path for external changes.'''
+        d = self.tracked_d.get(c, {})
+        v, h = d.get(path, (None, None))
+        if not v:
+            return
+        if v.h != h or not v.isAnyAtFileNode():
+            # The node has been renamed or is no longer an @<file> node.
+            d.pop(path, None)
+            p = c.vnode2position(v)
+            if p and p.isAnyAtFileNode():
+                # Register the renamed node and check it in this pass.
+                path2 = self.track(c, p)
+                if path2 and path2 != path and c in self.cursor_d:
+                    self.cursor_d[c].append(path2)
+            return
         if self.has_changed(c, path):
+            p = c.vnode2position(v)
+            if not p:
+                # The node has been deleted.
+                d.pop(path, None)
+                return
+            if g.fullPath(c, p) != path:
+                # The node has been moved, or an @path directive has changed.
+                d.pop(path, None)
+                self.track(c, p)
+                return
             if self.ask(c, path, p=p):
                 c.redraw(p=p)
                 c.refreshFromDisk(p)
@@ -339,7 +415,14 @@ class ExternalFilesController(object):
     def checksum(self, path):
         '''Return the checksum of the file at the given path.'''
         import hashlib
-        return hashlib.md5(open(path, 'rb').read()).hexdigest()
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            while True:
+                s = f.read(0x10000)
+                if not s:
+                    break
+                h.update(s)
+        return h.hexdigest()
     #@+node:ekr.20100203050306.5937: *4* efc.create_temp_file
     def create_temp_file(self, c, ext, p):
         '''
@@ -414,6 +497,36 @@ class ExternalFilesController(object):
         if ext[0] != '.':
             ext = '.' + ext
         return ext
+    #@+node:ekr.20180907153012.2: *4* efc.get_tracked
+    def get_tracked(self, c):
+        '''
+        Return the dict of c's registered @<file> nodes.
+
+        Walk the outline to (re)build the registry the first time, after
+        nodes have been inserted, moved or deleted, and every
+        self.rebuild_interval seconds, so that new @<file> nodes and changed
+        @path directives are found.
+        '''
+        d = self.tracked_d.get(c)
+        generation = c.frame.tree.generation
+        old_generation, t = self.tracked_generation_d.get(c, (None, 0))
+        if (d is None or generation != old_generation or
+            time.time() - t > self.rebuild_interval
+        ):
+            d = self.tracked_d[c] = {}
+            self.tracked_generation_d[c] = generation, time.time()
+            p = c.rootPosition()
+            seen = set()
+            while p:
+                if p.v in seen:
+                    p.moveToNodeAfterTree()
+                elif p.isAnyAtFileNode():
+                    seen.add(p.v)
+                    d[g.fullPath(c, p)] = (p.v, p.h)
+                    p.moveToNodeAfterTree()
+                else:
+                    p.moveToThreadNext()
+        return d
     #@+node:ekr.20150407204201.1: *4* efc.get_mtime
     def get_mtime(self, path):
         '''Return the modification time for the path.'''
@@ -429,22 +542,28 @@ class ExternalFilesController(object):
     #@+node:ekr.20150403045207.1: *4* efc.has_changed
     def has_changed(self, c, path):
         '''Return True if p's external file has changed outside of Leo.'''
-        if not g.os_path_exists(path):
-            return False
-        if g.os_path_isdir(path):
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return False # The file does not exist.
+        if stat.S_ISDIR(st.st_mode):
             return False
         #
-        # First, check the modification times.
+        # First, check the modification times and sizes.
         old_time = self.get_time(path)
-        new_time = self.get_mtime(path)
+        new_time = st.st_mtime
         if not old_time:
             # Initialize.
-            self.set_time(path, new_time)
+            self.set_time(path, new_time, st.st_size)
             self.checksum_d[path] = self.checksum(path)
             return False
-        if old_time == new_time:
+        old_size = self._size_d.get(g.os_path_realpath(path))
+        if old_time == new_time and old_size in (None, st.st_size):
             # print('%s:times match %s %s' % (tag,c.shortFileName(),path))
             return False
+        if old_size is not None and old_size != st.st_size:
+            # The file has really changed: no need for checksums.
+            return True
         #
         # Check the checksums *only* if the mod times don't match.
         old_sum = self.checksum_d.get(path)
@@ -453,7 +572,7 @@ class ExternalFilesController(object):
             # The modtime changed, but it's contents didn't.
             # Update the time, so we don't keep checking the checksums.
             # Return False so we don't prompt the user for an update.
-            self.set_time(path, new_time)
+            self.set_time(path, new_time, st.st_size)
             return False
         else:
             # The file has really changed.
@@ -553,19 +672,52 @@ class ExternalFilesController(object):
             g.es_exception()
             return 'oops: %s' % command
     #@+node:tbrown.20150904102518.1: *4* efc.set_time
-    def set_time(self, path, new_time=None):
+    def set_time(self, path, new_time=None, size=None):
         '''
         Implements c.setTimeStamp.
 
-        Update the timestamp for path.
+        Update the timestamp and size for path.
 
         NOTE: file paths with symbolic links occur with and without those links
         resolved depending on the code call path.  This inconsistency is
         probably not Leo's fault but an underlying Python issue.
         Hence the need to call realpath() here.
         '''
-        t = new_time or self.get_mtime(path)
-        self._time_d[g.os_path_realpath(path)] = t
+        if new_time is None or size is None:
+            try:
+                st = os.stat(path)
+                new_time, size = new_time or st.st_mtime, st.st_size
+            except (OSError, TypeError, ValueError):
+                new_time = new_time or self.get_mtime(path)
+        path = g.os_path_realpath(path)
+        self._time_d[path] = new_time
+        self._size_d[path] = size
+    #@+node:ekr.20180907153012.3: *4* efc.show_stats
+    def show_stats(self):
+        '''Print statistics about idle-time checks of external files.'''
+        n_files = sum(len(d) for d in self.tracked_d.values())
+        rate = self.n_checked / self.check_time if self.check_time else 0
+        g.es_print('\n'.join([
+            'registered files: %s in %s outlines' % (n_files, len(self.tracked_d)),
+            'files checked: %s, %0.1f files/sec.' % (self.n_checked, rate),
+            'longest tick: %0.2f msec., budget: %0.2f msec.' % (
+                1000 * self.max_tick_time, 1000 * self.tick_budget),
+        ]))
+    #@+node:ekr.20180907153012.4: *4* efc.track
+    def track(self, c, p):
+        '''
+        Register the @<file> node p under its full path and return the path.
+        Called when Leo reads or writes an external file.
+
+        Does nothing until efc.get_tracked has created c's registry.
+        '''
+        d = self.tracked_d.get(c)
+        if d is None or not p or not p.isAnyAtFileNode():
+            return None
+        path = g.fullPath(c, p)
+        if path:
+            d[path] = (p.v, p.h)
+        return path
     #@+node:ekr.20031218072017.2832: *4* efc.temp_file_path & helpers
     def temp_file_path(self, c, p, ext):
         '''Return the path to the temp file for p and ext.'''
@@ -23,6 +23,7 @@ if g.isPython3:
 else:
     import cStringIO # Python 2.x
     StringIO = cStringIO.StringIO
+    BytesIO = cStringIO.StringIO
 import os
 import pickle
 # import string
@@ -64,11 +65,167 @@ class FastRead (object):
 
         if not s:
             with open(path, 'rb') as f:
-                s = f.read()
-        return self.readWithElementTree(path, s)
+                return self.readWithIterParse(path, f)
+        if not g.isBytes(s):
+            s = g.toEncodedString(s)
+        return self.readWithIterParse(path, BytesIO(s))
+    #@+node:ekr.20180903061225.1: *4* fast.readWithIterParse & helpers
+    def readWithIterParse(self, path, f):
+        '''
+        Read a .leo file incrementally from the file-like object f.
+
+        Vnodes are created as <v> elements stream past. Bodies and tnode uA's
+        are attached as the following <t> elements stream past. Each element
+        is discarded as soon as it has been handled, so peak memory does not
+        grow with the size of the document.
+
+        The result is the same hidden vnode that fast.readWithElementTree
+        would return.
+        '''
+        gnx2vnode = self.gnx2vnode
+        self.clones = []
+            # List of (v, parent_v) for vnodes that already existed.
+        self.new_gnxs = set()
+            # Gnx's of all vnodes created by this read.
+        self.v_gnxs = set()
+            # Gnx's of all <v> elements, including clones.
+        self.t_gnxs = set()
+            # Gnx's of all <t> elements seen so far.
+        self.scanGlobals(None)
+        hidden_v = self.createHiddenVnode()
+        elements = [] # Stack of open elements.
+        vnodes = [hidden_v] # Stack of open vnodes. None: within a clone.
+        try:
+            for event, e in ElementTree.iterparse(f, events=('start', 'end')):
+                tag = e.tag
+                if event == 'start':
+                    elements.append(e)
+                    if tag == 'v':
+                        vnodes.append(self.startVnode(e, vnodes[-1]))
+                    continue
+                elements.pop()
+                if tag == 'v':
+                    vnodes.pop()
+                elif tag == 'vh':
+                    v = vnodes[-1]
+                    if v:
+                        v._headString = g.toUnicode(e.text or '')
+                elif tag == 't':
+                    self.endTnode(e)
+                # Free the element: its parent is the only other reference.
+                if elements:
+                    elements[-1].remove(e)
+        except Exception as e:
+            # Remove all traces of the partial outline.
+            for v, parent_v in self.clones:
+                v.parents.remove(parent_v)
+            for gnx in self.new_gnxs:
+                gnx2vnode.pop(gnx, None)
+            if path:
+                message = 'bad .leo file: %s' % g.shortFileName(path)
+            else:
+                message = 'The clipboard is not a vaild .leo file'
+            print('')
+            g.es_print(message, color='red')
+            g.es_print(g.toUnicode(e))
+            print('')
+            # #970: Just report failure here.
+            return None
+        # Like fast.scanVnodes: a <v> without a <t> has an empty body.
+        for gnx in self.v_gnxs - self.t_gnxs:
+            gnx2vnode[gnx]._bodyString = g.u('')
+        self.handleBits()
+        return hidden_v
+    #@+node:ekr.20180903061225.2: *5* fast.createHiddenVnode
+    def createHiddenVnode(self):
+        '''Create the hidden root vnode.'''
+        gnx = 'hidden-root-vnode-gnx'
+        hidden_v = leoNodes.VNode(context=self.c, gnx=gnx)
+        hidden_v._headString = g.u('<hidden root vnode>')
+        self.gnx2vnode [gnx] = hidden_v
+        self.new_gnxs.add(gnx)
+        return hidden_v
+    #@+node:ekr.20180903061225.3: *5* fast.startVnode
+    def startVnode(self, e, parent_v):
+        '''
+        Handle the start of a <v> element, whose attributes are complete.
+        Return the new vnode, or None if its children should be ignored.
+        '''
+        if not parent_v:
+            # Within a clone: the first copy defines the tree.
+            return None
+        c, fc = self.c, self.c.fileCommands
+        gnx = e.attrib['t']
+        self.v_gnxs.add(gnx)
+        v = self.gnx2vnode.get(gnx)
+        if v:
+            # A clone. Like fast.scanVnodes, ignore all inner elements.
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+            self.clones.append((v, parent_v),)
+            return None
+        v = leoNodes.VNode(context=c, gnx=gnx)
+        self.gnx2vnode [gnx] = v
+        self.new_gnxs.add(gnx)
+        parent_v.children.append(v)
+        v.parents.append(parent_v)
+        v._headString = 'PLACE HOLDER'
+        # Like << handle all other v attributes >> in fast.scanVnodes.
+        d = e.attrib
+        s = d.get('tnodeList', '')
+        tnodeList = s and s.split(',')
+        if tnodeList:
+            # This tnodeList will be resolved later.
+            v.tempTnodeList = tnodeList
+        s = d.get('descendentTnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentTnodeUaDictList.append(aDict)
+        s = d.get('descendentVnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentVnodeUaDictList.append((v, aDict),)
+        uaDict = {}
+        for key, val in d.items():
+            if key not in self.nativeVnodeAttributes:
+                uaDict[key] = self.resolveUa(key, val)
+        if uaDict:
+            v.unknownAttributes = uaDict
+        return v
+    #@+node:ekr.20180903061225.4: *5* fast.endTnode
+    def endTnode(self, e):
+        '''
+        Handle a complete <t> element.
+
+        All <v> elements precede all <t> elements, so the vnode already exists.
+        '''
+        gnx = e.attrib['tx']
+        self.t_gnxs.add(gnx)
+        # Resolve uA's even for orphan tnodes, as fast.scanTnodes does.
+        tnodeUa = {}
+        for key, val in e.attrib.items():
+            if key != 'tx':
+                tnodeUa [key] = self.resolveUa(key, val)
+        if gnx not in self.v_gnxs:
+            return
+        v = self.gnx2vnode.get(gnx)
+        body = g.toUnicode(e.text or '')
+        assert g.isUnicode(body), body.__class__.__name__
+        v._bodyString = body
+        if tnodeUa and gnx in self.new_gnxs:
+            # Vnode uA's take precedence over tnode uA's.
+            tnodeUa.update(getattr(v, 'unknownAttributes', None) or {})
+            v.unknownAttributes = tnodeUa
     #@+node:ekr.20180602062323.7: *4* fast.readWithElementTree & helpers
     def readWithElementTree(self, path, s):
-
+        '''
+        Read a .leo file by parsing the entire document at once.
+        
+        fast.readFile now uses fast.readWithIterParse. This method remains
+        as a reference implementation for benchmarks and unit tests.
+        '''
         contents = g.toUnicode(s) if g.isPython3 else s
         try:
             xroot = ElementTree.fromstring(contents)
@@ -95,8 +252,7 @@ class FastRead (object):
     def handleBits(self):
 
         c, fc = self.c, self.c.fileCommands
-        expanded = c.db.get('expanded')
-        marked = c.db.get('marked')
+        expanded, marked = c.db.get_many(['expanded', 'marked'])
         expanded = expanded.split(',') if expanded else []
         marked = marked.split(',') if marked else []
         fc.descendentExpandedList = expanded
@@ -241,7 +397,7 @@ class FastRead (object):
             for e in parent_e:
                 assert e.tag in ('v','vh'), e.tag
                 if e.tag == 'vh':
-                    parent_v._headString = g.toUnicode(e.text or '')
+                    parent_v.setHeadString(g.toUnicode(e.text or ''))
                     continue
                 gnx = e.attrib['t']
                 v = gnx2vnode.get(gnx)
@@ -373,6 +529,12 @@ class FileCommands(object):
             # 2011/12/10: This dict is never re-inited.
         self.vnodesDict = {}
             # keys are gnx strings; values are ignored
+        self.useFragmentCache = True
+            # True: cache the parts of <v> and <t> elements between saves.
+        self.tnodeCache = {}
+            # Keys are gnx strings; values are tuples (v._bodyString, fragment).
+        self.vnodeCache = {}
+            # Keys are gnx strings; values are tuples (v._headString, v._bodyString, data).
     #@+node:ekr.20031218072017.3020: *3* fc.Reading
     #@+node:ekr.20060919104836: *4*  fc.Reading Top-level
     #@+node:ekr.20031218072017.1559: *5* fc.Paste
@@ -1255,11 +1417,27 @@ class FileCommands(object):
     def putTnode(self, v):
         # Call put just once.
         gnx = v.fileIndex
-        # pylint: disable=consider-using-ternary
-        ua = hasattr(v, 'unknownAttributes') and self.putUnknownAttributes(v) or ''
-        b = v.b
-        body = xml.sax.saxutils.escape(b) if b else ''
-        self.put('<t tx="%s"%s>%s</t>\n' % (gnx, ua, body))
+        if hasattr(v, 'unknownAttributes'):
+            # uA's are mutable, so never cache the fragment.
+            ua = self.putUnknownAttributes(v)
+            b = v.b
+            body = xml.sax.saxutils.escape(b) if b else ''
+            self.put('<t tx="%s"%s>%s</t>\n' % (gnx, ua, body))
+            return
+        #
+        # The cached fragment is valid only if v._bodyString is the *same*
+        # string that was escaped, which catches all changes, including
+        # changes that bypass v.setBodyString.
+        b = v._bodyString
+        data = self.tnodeCache.get(gnx)
+        if data and data[0] is b:
+            s = data[1]
+        else:
+            body = xml.sax.saxutils.escape(v.b) if b else ''
+            s = '<t tx="%s">%s</t>\n' % (gnx, body)
+            if self.useFragmentCache:
+                self.tnodeCache[gnx] = b, s
+        self.put(s)
     #@+node:ekr.20031218072017.1575: *5* fc.putTnodes
     def putTnodes(self):
         """Puts all tnodes as required for copy or save commands"""
@@ -1271,17 +1449,19 @@ class FileCommands(object):
         '''Put all referenced tnodes.'''
         c = self.c
         if self.usingClipboard: # write the current tree.
-            theIter = self.currentPosition.self_and_subtree(copy=False)
+            roots = [self.currentPosition.v]
         else: # write everything
-            theIter = c.all_unique_positions(copy=False)
-        # Populate tnodes
+            roots = c.hiddenRootNode.children[:]
+        # Populate tnodes. Walking vnodes is much faster than walking positions.
         tnodes = {}
-        for p in theIter:
-            # Make *sure* the file index has the proper form.
-            # pylint: disable=unbalanced-tuple-unpacking
-            index = p.v.fileIndex
-            tnodes[index] = p.v
+        while roots:
+            v = roots.pop()
+            index = v.fileIndex
+            if index not in tnodes:
+                tnodes[index] = v
+                roots.extend(v.children)
         # Put all tnodes in index order.
+        written = set()
         for index in sorted(tnodes):
             v = tnodes.get(index)
             if v:
@@ -1289,25 +1469,25 @@ class FileCommands(object):
                 # **Note**: @<file> trees are not written unless they contain clones.
                 if v.isWriteBit():
                     self.putTnode(v)
+                    written.add(index)
             else:
                 g.trace('can not happen: no VNode for', repr(index))
                 # This prevents the file from being written.
                 raise BadLeoFile('no VNode for %s' % repr(index))
-    #@+node:ekr.20031218072017.1863: *5* fc.putVnode & helper
+        if not self.usingClipboard:
+            self.pruneFragmentCache(self.tnodeCache, written)
+    #@+node:ekr.20031218072017.1863: *5* fc.putVnode & helpers
     def putVnode(self, p, isIgnore=False):
         """Write a <v> element corresponding to a VNode."""
         fc = self
         v = p.v
-        isAuto = p.isAtAutoNode() and p.atAutoNodeName().strip()
-        isEdit = p.isAtEditNode() and p.atEditNodeName().strip() and not p.hasChildren()
+        isAuto, isEdit, isFile, isShadow, isThin, isIgnoreNode, vh = fc.getVnodeData(v)
+        isEdit = isEdit and not p.hasChildren()
             # 2010/09/02: @edit nodes must not have children.
             # If they do, the entire tree is written to the outline.
-        isFile = p.isAtFileNode()
-        isShadow = p.isAtShadowFileNode()
-        isThin = p.isAtThinFileNode()
         isOrphan = p.isOrphan()
         if not isIgnore:
-            isIgnore = p.isAtIgnoreNode()
+            isIgnore = isIgnoreNode
         # 2010/10/22: force writes of orphan @edit, @auto and @shadow trees.
         if isIgnore: forceWrite = True # Always write full @ignore trees.
         elif isAuto: forceWrite = isOrphan # Force write of orphan @auto trees.
@@ -1326,7 +1506,7 @@ class FileCommands(object):
             fc.put(v_head + '</v>\n')
         else:
             fc.vnodesDict[gnx] = True
-            v_head += '<vh>%s</vh>' % (xml.sax.saxutils.escape(p.v.headString() or ''))
+            v_head += vh
             # New in 4.2: don't write child nodes of @file-thin trees
             # (except when writing to clipboard)
             if p.hasChildren() and (forceWrite or self.usingClipboard):
@@ -1362,6 +1542,33 @@ class FileCommands(object):
             attrs.append(self.putDescendentVnodeUas(p))
             attrs.append(self.putDescendentAttributes(p))
         return ''.join(attrs)
+    #@+node:ekr.20180906051204.1: *6* fc.getVnodeData (helper for fc.putVnode)
+    def getVnodeData(self, v):
+        '''
+        Return a tuple describing the parts of v's <v> element that depend
+        only on v.h and v.b:
+
+            (isAuto, isEdit, isFile, isShadow, isThin, isIgnore, vh)
+
+        where vh is the escaped <vh> element. Return the cached tuple if
+        v._headString and v._bodyString are the *same* strings as before.
+        '''
+        gnx, h, b = v.fileIndex, v._headString, v._bodyString
+        data = self.vnodeCache.get(gnx)
+        if data and data[0] is h and data[1] is b:
+            return data[2]
+        aTuple = (
+            bool(v.isAtAutoNode() and v.atAutoNodeName().strip()),
+            bool(v.isAtEditNode() and v.atEditNodeName().strip()),
+            v.isAtFileNode(),
+            v.isAtShadowFileNode(),
+            v.isAtThinFileNode(),
+            v.isAtIgnoreNode(),
+            '<vh>%s</vh>' % (xml.sax.saxutils.escape(v.headString() or '')),
+        )
+        if self.useFragmentCache:
+            self.vnodeCache[gnx] = h, b, aTuple
+        return aTuple
     #@+node:ekr.20031218072017.1579: *5* fc.putVnodes
     def putVnodes(self, p=None):
         """Puts all <v> elements in the order in which they appear in the outline."""
@@ -1381,9 +1588,20 @@ class FileCommands(object):
             self.expanded_gnxs, self.marked_gnxs = set(), set()
             for p in c.rootPosition().self_and_siblings():
                 self.putVnode(p, isIgnore=p.isAtIgnoreNode())
-            c.db ['expanded'] = ','.join(list(self.expanded_gnxs))
-            c.db ['marked'] = ','.join(list(self.marked_gnxs))
+            c.db.set_many([
+                ('expanded', ','.join(list(self.expanded_gnxs))),
+                ('marked', ','.join(list(self.marked_gnxs))),
+            ])
+            self.pruneFragmentCache(self.vnodeCache, self.vnodesDict)
         self.put("</vnodes>\n")
+    #@+node:ekr.20180906051204.2: *5* fc.pruneFragmentCache
+    def pruneFragmentCache(self, cache, gnxs):
+        '''Remove all entries of the cache dict whose keys are not in gnxs.'''
+        if not self.useFragmentCache:
+            cache.clear()
+        elif len(cache) > len(gnxs):
+            for gnx in [z for z in cache if z not in gnxs]:
+                del cache[gnx]
     #@+node:ekr.20031218072017.1247: *5* fc.putXMLLine
     def putXMLLine(self):
         '''Put the **properly encoded** <?xml> element.'''
@@ -1442,6 +1660,7 @@ class FileCommands(object):
         if g.SQLITE and fileName and fileName.endswith('.db'):
             return fc.exportToSqlite(fileName)
 
+        fc.useFragmentCache = c.config.getBool('cache-leo-file-fragments', default=True)
         try:
             fc.putCount = 0
             fc.toString = toString
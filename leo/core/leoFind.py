@@ -2,10 +2,16 @@
 #@+node:ekr.20060123151617: * @file leoFind.py
 '''Leo's gui-independent find classes.'''
 import leo.core.leoGlobals as g
+import binascii
 import keyword
 import re
+try:
+    import re._parser as sre_parse # Python 3.11 and above.
+except ImportError:
+    import sre_parse
 import time
 import sys
+import zlib
 #@+<< Theory of operation of find/change >>
 #@+node:ekr.20031218072017.2414: ** << Theory of operation of find/change >>
 #@+at
@@ -131,6 +137,10 @@ class LeoFind(object):
         self.frame = None
         self.k = c.k
         self.re_obj = None
+        self.searchIndex = SearchIndex(c)
+        self.searchTree = None
+            # None or the set of vnodes that might match during batch commands,
+            # along with their ancestors.
         # Options ivars: set by FindTabManager.init.
         self.batch = None
         self.ignore_case = None
@@ -1449,6 +1459,142 @@ class LeoFind(object):
                 'Change Headline' if self.in_headline else 'Change Body',
                 undoData,
             )
+    #@+node:ekr.20180907103311.1: *4* find.batchFindAll, batchReplaceAll & helpers
+    # These methods search the headline and body of each unique vnode in a
+    # range of positions directly, without using s_ctrl. find-all and
+    # replace-all use them for suboutline-only and whole-outline searches.
+    #@+node:ekr.20180907103311.2: *5* find.batchFindAll
+    def batchFindAll(self, p, after):
+        '''
+        Find all matches in the unique vnodes from p to after.
+        Return (count, result), where result is a list of lines for the
+        "Found All" node. find-all-unique-regex updates self.unique_matches.
+        '''
+        re_obj = self.batchPattern()
+        if not re_obj:
+            return 0, []
+        both = self.search_body and self.search_headline
+        strip_cr = sys.platform.lower().startswith('win')
+            # Like find.search.
+        count, result, seen = 0, [], set()
+        for p in self.batchPositions(p, after):
+            for in_headline, s in self.batchTexts(p):
+                if strip_cr:
+                    s = s.replace('\r', '')
+                for m in re_obj.finditer(s):
+                    if m.start() == m.end():
+                        continue # Like find.regexHelper.
+                    count += 1
+                    if self.mark_finds:
+                        p.setMarked()
+                    if self.findAllUniqueFlag:
+                        self.unique_matches.add(m.group(0).strip())
+                        continue
+                    i, j = g.getLine(s, m.start())
+                    line = s[i: j].rstrip() + '\n'
+                    if both:
+                        result.append('%s%s\n%s%s\n' % (
+                            '-' * 20, p.h,
+                            "head: " if in_headline else "body: ",
+                            line))
+                    elif p.v in seen:
+                        result.append(line)
+                    else:
+                        result.append('%s%s\n%s' % ('-' * 20, p.h, line))
+                        seen.add(p.v)
+        return count, result
+    #@+node:ekr.20180907103311.3: *5* find.batchReplaceAll
+    def batchReplaceAll(self, p, after):
+        '''
+        Replace all matches in the unique vnodes from p to after with
+        self.change_text, creating one undo item for each changed vnode.
+        Return the number of replacements.
+        '''
+        c, u = self.c, self.c.undoer
+        re_obj = self.batchPattern()
+        if not re_obj:
+            return 0
+        change_text, regex = self.change_text, self.pattern_match
+        count = [0]
+
+        def repl(m):
+            if m.start() == m.end():
+                return '' # Like find.regexHelper.
+            count[0] += 1
+            groups = m.groups()
+            if regex and groups:
+                return self.makeRegexSubs(change_text, groups)
+            return change_text
+
+        self.searchTree = self.computeSearchTree()
+        try:
+            for p in self.batchPositions(p, after):
+                h, b = p.h, p.b
+                h2 = re_obj.sub(repl, h) if self.search_headline else h
+                b2 = re_obj.sub(repl, b) if self.search_body else b
+                if h2 == h and b2 == b:
+                    continue
+                undoData = u.beforeChangeNodeContents(p)
+                if h2 != h:
+                    p.v.setHeadString(h2)
+                if b2 != b:
+                    # Fix #456: replace-all is very slow.
+                    # p.b calls c.setBodyString, which is *very* slow.
+                    p.v.setBodyString(b2)
+                if self.mark_changes:
+                    p.setMarked()
+                p.v.setDirty()
+                u.afterChangeNodeContents(
+                    p,
+                    'Change Body' if b2 != b else 'Change Headline',
+                    undoData,
+                )
+                if not c.isChanged():
+                    c.setChanged(True)
+        finally:
+            self.searchTree = None
+        return count[0]
+    #@+node:ekr.20180907103311.4: *5* find.batchPattern
+    def batchPattern(self):
+        '''
+        Return a compiled regex that finds the find text using the present
+        options, or None if the find text is not a valid regex.
+        '''
+        if self.pattern_match or self.findAllUniqueFlag:
+            return self.re_obj if self.precompilePattern() else None
+        s = self.replaceBackSlashes(self.find_text)
+        pattern = re.escape(s)
+        if self.whole_word:
+            # Like find.matchWord.
+            if g.isWordChar(s[0]):
+                pattern = r'(?<!\w)' + pattern
+            if g.isWordChar(s[-1]):
+                pattern = pattern + r'(?!\w)'
+        return re.compile(pattern, re.IGNORECASE if self.ignore_case else 0)
+    #@+node:ekr.20180907103311.5: *5* find.batchPositions
+    def batchPositions(self, p, after):
+        '''
+        Yield a position for each unique vnode from p to after, skipping
+        trees outside self.searchTree.
+        '''
+        tree, seen = self.searchTree, set()
+        p = p.copy()
+        while p and p != after:
+            if p.v in seen or (tree is not None and p.v not in tree):
+                p.moveToNodeAfterTree()
+            else:
+                seen.add(p.v)
+                yield p.copy()
+                p.moveToThreadNext()
+    #@+node:ekr.20180907103311.6: *5* find.batchTexts
+    def batchTexts(self, p):
+        '''Return a list of (in_headline, text) tuples to be searched at p.'''
+        result = []
+        if self.search_headline:
+            result.append((True, p.h))
+        if self.search_body:
+            result.append((False, p.b))
+        return result
     #@+node:ekr.20031218072017.3068: *4* find.change
     @cmd('replace')
     def change(self, event=None):
@@ -1470,17 +1616,27 @@ class LeoFind(object):
         self.initBatchCommands()
         count = 0
         u.beforeChangeGroup(current, undoType)
-        # Fix bug 338172: ReplaceAll will not replace newlines
-        # indicated as \n in target string.
-        self.change_text = self.replaceBackSlashes(self.change_text)
-        while 1:
-            pos1, pos2 = self.findNextMatch()
-            if pos1 is None:
-                break
-            count += 1
-            self.batchChange(pos1, pos2)
-        p = c.p
-        u.afterChangeGroup(p, undoType, reportFlag=True)
+        try:
+            # Fix bug 338172: ReplaceAll will not replace newlines
+            # indicated as \n in target string.
+            self.change_text = self.replaceBackSlashes(self.change_text)
+            if self.node_only:
+                while 1:
+                    pos1, pos2 = self.findNextMatch()
+                    if pos1 is None:
+                        break
+                    count += 1
+                    self.batchChange(pos1, pos2)
+            else:
+                if self.suboutline_only:
+                    p, after = current.copy(), current.nodeAfterTree()
+                else:
+                    p, after = c.rootPosition(), None
+                count = self.batchReplaceAll(p, after)
+        finally:
+            # Always end the undo group, even if the search fails.
+            p = c.p
+            u.afterChangeGroup(p, undoType, reportFlag=True)
         t2 = time.clock()
         g.es('changed %s instances in %4.2f sec.' % (count, (t2-t1)))
             # self.find_text, self.change_text,
@@ -1551,7 +1707,8 @@ class LeoFind(object):
                 i = j
                 gn = int(ch) - 1
                 if gn < len(groups):
-                    result.append(groups[gn]) # Append groups[i-1]
+                    # Unmatched groups are None: substitute ''.
+                    result.append(groups[gn] or '') # Append groups[i-1]
                 else:
                     result.append('\\%s' % ch) # Append raw '\i'
         result.append(s[i:])
@@ -1626,6 +1783,7 @@ class LeoFind(object):
         if self.pattern_match or self.findAllUniqueFlag:
             ok = self.precompilePattern()
             if not ok: return
+        self.searchTree = self.computeSearchTree()
         if self.suboutline_only:
             p = c.p
             after = p.nodeAfterTree()
@@ -1645,10 +1803,25 @@ class LeoFind(object):
             # c.contractAllHeadlines()
         finally:
             c.sparse_find = old_sparse_find
+            self.searchTree = None
         if count:
             c.redraw()
         g.es("found", count, "matches for", self.find_text)
         return count
+    #@+node:ekr.20180907090145.16: *5* find.computeSearchTree
+    def computeSearchTree(self):
+        '''
+        Return the set of vnodes that might match the find pattern, along with
+        their ancestors, or None if the search index can not narrow the search.
+        '''
+        if self.pattern_match or self.findAllUniqueFlag:
+            re_obj = self.re_obj
+            return self.searchIndex.searchTree(
+                re_obj.pattern, regex=True, flags=re_obj.flags)
+        else:
+            return self.searchIndex.searchTree(
+                self.replaceBackSlashes(self.find_text),
+                ignore_case=self.ignore_case)
     #@+node:ekr.20160422072841.1: *5* find.doCloneFindAll & helpers
     def doCloneFindAll(self, after, data, flatten, p, undoType):
         '''Handle the clone-find-all command, from p to after.'''
@@ -1660,6 +1833,9 @@ class LeoFind(object):
             progress = p.copy()
             if p.v in skip:
                 p.moveToThreadNext()
+            elif self.searchTree is not None and p.v not in self.searchTree:
+                # Nothing in p's tree can match.
+                p.moveToNodeAfterTree()
             else:
                 count = self.doCloneFindAllHelper(clones, count, flatten, p, skip)
             assert p != progress
@@ -1727,28 +1903,31 @@ class LeoFind(object):
         c, u, w = self.c, self.c.undoer, self.s_ctrl
         both = self.search_body and self.search_headline
         count, found, result = 0, None, []
-        while 1:
-            pos, newpos = self.findNextMatch()
-            if not self.p: self.p = c.p
-            if pos is None: break
-            count += 1
-            s = w.getAllText()
-            i, j = g.getLine(s, pos)
-            line = s[i: j]
-            if self.findAllUniqueFlag:
-                m = self.match_obj
-                if m:
-                    self.unique_matches.add(m.group(0).strip())
-            elif both:
-                result.append('%s%s\n%s%s\n' % (
-                    '-' * 20, self.p.h,
-                    "head: " if self.in_headline else "body: ",
-                    line.rstrip()+'\n'))
-            elif self.p.isVisited():
-                result.append(line.rstrip()+'\n')
-            else:
-                result.append('%s%s\n%s' % ('-' * 20, self.p.h, line.rstrip()+'\n'))
-                self.p.setVisited()
+        if self.node_only:
+            while 1:
+                pos, newpos = self.findNextMatch()
+                if not self.p: self.p = c.p
+                if pos is None: break
+                count += 1
+                s = w.getAllText()
+                i, j = g.getLine(s, pos)
+                line = s[i: j]
+                if self.findAllUniqueFlag:
+                    m = self.match_obj
+                    if m:
+                        self.unique_matches.add(m.group(0).strip())
+                elif both:
+                    result.append('%s%s\n%s%s\n' % (
+                        '-' * 20, self.p.h,
+                        "head: " if self.in_headline else "body: ",
+                        line.rstrip()+'\n'))
+                elif self.p.isVisited():
+                    result.append(line.rstrip()+'\n')
+                else:
+                    result.append('%s%s\n%s' % ('-' * 20, self.p.h, line.rstrip()+'\n'))
+                    self.p.setVisited()
+        else:
+            count, result = self.batchFindAll(p, after)
         if result or self.unique_matches:
             undoData = u.beforeInsertNode(c.p)
             if self.findAllUniqueFlag:
@@ -2587,6 +2766,279 @@ class LeoFind(object):
             s = s[: -1]
         self.change_text = s
     #@-others
+#@+node:ekr.20180907090145.1: ** class SearchIndex
+class SearchIndex(object):
+    '''
+    An outline-wide trigram index of the headlines and body text of all
+    vnodes. The find-all, clone-find-all and quicksearch commands use the
+    index to skip nodes that can not possibly match.
+
+    For each vnode, the index contains a **signature**: a Python int with
+    one bit set for each trigram of the vnode's headline and body. Unlike
+    lists of trigrams, signatures take little memory. A vnode can match a
+    pattern only if its signature contains the bits of all trigrams that
+    every match of the pattern must contain.
+
+    The index recomputes a signature when v._headString or v._bodyString
+    change, just as g.get_directives_dict does. Each search recomputes
+    signatures for at most self.budget seconds. The search treats all
+    remaining vnodes as possible matches, and Leo computes their signatures
+    at idle time.
+
+    The index saves all signatures in c.db, so Leo need not recompute
+    them the next time it opens the outline.
+    '''
+    #@+others
+    #@+node:ekr.20180907090145.2: *3* index.__init__
+    def __init__(self, c):
+        '''Ctor for SearchIndex class.'''
+        self.c = c
+        self.budget = 0.25
+            # The maximum time, in seconds, to compute signatures during a search.
+        self.dbKey = '_leo_search_index'
+        self.entries = {}
+            # Keys are vnodes, values are (h, b, crc, mask, signature).
+        self.hashes = {}
+            # Keys are trigrams, values are their (stable) hashes.
+        self.idle = False
+            # True: self.onIdle is an idle-time callback.
+        self.n_computed = 0
+            # The number of signatures computed since they were last saved.
+        self.saved = None
+            # Keys are gnx's, values are (crc, mask, signature), loaded from c.db.
+        self.stale = set()
+            # Vnodes whose signatures onIdle should compute.
+    #@+node:ekr.20180907090145.3: *3* index.searchTree
+    def searchTree(self, pattern, regex=False, ignore_case=False, flags=0):
+        '''
+        Return the set of all vnodes that might match the pattern, along with
+        all their ancestors. Return None if the index can not narrow the search.
+
+        pattern: the text to find or a regular expression.
+        ignore_case: True if plain searches ignore case.
+        flags: the flags of a regular expression.
+        '''
+        c = self.c
+        if not c.config.getBool('use-search-index', default=True):
+            return None
+        if regex:
+            runs, flags = self.regexLiterals(pattern, flags)
+            ignore_case = bool(flags & re.IGNORECASE)
+        else:
+            runs = [pattern]
+        trigrams = self.patternTrigrams(runs, ignore_case)
+        if not trigrams:
+            return None
+        return self.ancestors(self.candidates(trigrams))
+    #@+node:ekr.20180907090145.4: *3* index.positions
+    def positions(self, tree, p=None):
+        '''
+        Yield copies of all positions of p's subtree (or the entire outline)
+        whose vnodes are in tree, a set returned by searchTree.
+        '''
+        if p:
+            p = p.copy()
+            after = p.nodeAfterTree()
+        else:
+            p = self.c.rootPosition()
+            after = None
+        while p and p != after:
+            if p.v in tree:
+                yield p.copy()
+                p.moveToThreadNext()
+            else:
+                p.moveToNodeAfterTree()
+    #@+node:ekr.20180907090145.5: *3* index.ancestors
+    def ancestors(self, vnodes):
+        '''Return the set of the given vnodes and all their ancestors.'''
+        result, todo = set(), list(vnodes)
+        while todo:
+            v = todo.pop()
+            if v not in result:
+                result.add(v)
+                todo.extend(v.parents)
+        return result
+    #@+node:ekr.20180907090145.6: *3* index.candidates
+    def candidates(self, trigrams):
+        '''
+        Return the set of vnodes whose signatures contain all the trigrams,
+        along with all vnodes whose signatures have not been computed yet.
+        '''
+        c, entries = self.c, self.entries
+        deadline = time.time() + self.budget
+        expired = False
+        masks, result = {}, set()
+        n = 0
+        for v in c.all_unique_nodes():
+            n += 1
+            entry = entries.get(v)
+            if (entry is None or
+                entry[0] is not v._headString or
+                entry[1] is not v._bodyString
+            ):
+                if expired or time.time() > deadline:
+                    expired = True
+                    result.add(v)
+                    self.stale.add(v)
+                    continue
+                entry = entries[v] = self.computeEntry(v)
+            h, b, crc, mask, sig = entry
+            bits = masks.get(mask)
+            if bits is None:
+                bits = masks[mask] = self.signature(trigrams, mask)
+            if sig & bits == bits:
+                result.add(v)
+        if len(entries) > n:
+            # Forget deleted vnodes.
+            self.entries = dict((v, entries[v]) for v in c.all_unique_nodes() if v in entries)
+        if self.stale and not self.idle and g.app.idleTimeManager:
+            self.idle = True
+            g.app.idleTimeManager.add_callback(self.onIdle)
+        if self.n_computed >= 1000:
+            self.save()
+        return result
+    #@+node:ekr.20180907090145.7: *3* index.computeEntry
+    def computeEntry(self, v):
+        '''Return the index entry for v, using the saved signature if possible.'''
+        h, b = v._headString, v._bodyString
+        crc = zlib.crc32(g.toEncodedString(h + '\n' + b)) & 0xffffffff
+        if self.saved is None:
+            self.saved = self.c.db.get(self.dbKey) or {}
+        data = self.saved.get(v.fileIndex)
+        if data and data[0] == crc:
+            crc, mask, sig = data
+        else:
+            trigrams = self.textTrigrams(h)
+            trigrams.update(self.textTrigrams(b))
+            # Use about four bits per trigram.
+            mask = 63
+            while mask < 4 * len(trigrams):
+                mask = 2 * mask + 1
+            sig = self.signature(trigrams, mask)
+            self.n_computed += 1
+        return h, b, crc, mask, sig
+    #@+node:ekr.20180907090145.9: *3* index.onIdle
+    def onIdle(self):
+        '''Compute the signatures of stale vnodes at idle time.'''
+        c, entries = self.c, self.entries
+        if not self.stale:
+            return
+        if not c.exists:
+            self.stale = set()
+            self.entries = {}
+            return
+        deadline = time.time() + 0.1
+        while self.stale and time.time() < deadline:
+            v = self.stale.pop()
+            entry = entries.get(v)
+            if (entry is None or
+                entry[0] is not v._headString or
+                entry[1] is not v._bodyString
+            ):
+                entries[v] = self.computeEntry(v)
+        if not self.stale and self.n_computed:
+            self.save()
+    #@+node:ekr.20180907090145.8: *3* index.save
+    def save(self):
+        '''Save all signatures in c.db.'''
+        d = {}
+        for v, entry in self.entries.items():
+            h, b, crc, mask, sig = entry
+            d[v.fileIndex] = crc, mask, sig
+        self.c.db[self.dbKey] = self.saved = d
+        self.n_computed = 0
+    #@+node:ekr.20180907090145.24: *3* index.Trigrams
+    #@+node:ekr.20180907090145.11: *4* index.fold
+    # Characters that match ascii letters in case-insensitive regex searches,
+    # and the final sigma, whose lower case depends on the following character.
+    fold_table = {0x130: 0x69, 0x131: 0x69, 0x17f: 0x73, 0x212a: 0x6b, 0x3c2: 0x3c3}
+
+    def fold(self, s):
+        '''Return s in the (lower) case used by the index.'''
+        table = self.fold_table
+        return s.translate(table).lower().translate(table)
+    #@+node:ekr.20180907090145.13: *4* index.patternTrigrams
+    non_ascii_pattern = re.compile(r'[^\x00-\x7f]')
+
+    def patternTrigrams(self, runs, ignore_case):
+        '''
+        Return the set of trigrams that every match must contain, given the
+        runs of literal text that every match must contain.
+        '''
+        result = set()
+        for run in runs:
+            # The index ignores '\r', so ignore trigrams containing '\r'.
+            for s in self.fold(run).split('\r'):
+                result.update(zip(s, s[1:], s[2:]))
+        if ignore_case:
+            # Non-ascii characters may have several lower-case forms.
+            result = set(z for z in result
+                if not self.non_ascii_pattern.search(''.join(z)))
+        return result
+    #@+node:ekr.20180907090145.14: *4* index.regexLiterals
+    def regexLiterals(self, pattern, flags):
+        '''
+        Return (runs, flags), where runs is a list of strings that every match
+        of the regex pattern must contain and flags are the regex's flags.
+        '''
+        try:
+            tree = sre_parse.parse(pattern, flags)
+        except Exception:
+            return [], flags
+        state = getattr(tree, 'state', None) or getattr(tree, 'pattern', None)
+        flags = getattr(state, 'flags', flags)
+        runs, run, ignore_case = [], [], []
+        atomic_group = getattr(sre_parse, 'ATOMIC_GROUP', None)
+            # New in Python 3.11.
+
+        def end_run():
+            if run:
+                runs.append(''.join(run))
+                del run[:]
+
+        def scan(items):
+            for op, av in items:
+                if op == sre_parse.LITERAL:
+                    run.append(g.u('%c') % av)
+                elif op == sre_parse.AT:
+                    pass # Zero-width assertions do not end runs.
+                elif op == sre_parse.SUBPATTERN and av[-1] is not None:
+                    # Groups match in place.
+                    if len(av) == 4 and av[1] & re.IGNORECASE:
+                        ignore_case.append(True) # A (?i:...) group.
+                    scan(av[-1])
+                elif op == atomic_group and op is not None:
+                    scan(av)
+                else:
+                    end_run()
+
+        scan(tree)
+        end_run()
+        if ignore_case:
+            flags |= re.IGNORECASE
+        return runs, flags
+    #@+node:ekr.20180907090145.10: *4* index.signature
+    def signature(self, trigrams, mask):
+        '''
+        Return an int containing one bit for each trigram: the trigram's hash,
+        modulo mask + 1. The hashes do not change between sessions.
+        '''
+        hashes = self.hashes
+        if len(hashes) > 1000000:
+            hashes.clear()
+        for z in trigrams.difference(hashes):
+            hashes[z] = zlib.crc32(g.toEncodedString(''.join(z))) & 0xffffffff
+        a = bytearray((mask + 1) // 8)
+        for h in map(hashes.__getitem__, trigrams):
+            h &= mask
+            a[h >> 3] |= 1 << (h & 7)
+        return int(binascii.hexlify(a), 16)
+    #@+node:ekr.20180907090145.15: *4* index.textTrigrams
+    def textTrigrams(self, s):
+        '''Return the set of all trigrams of s.'''
+        s = self.fold(s.replace('\r', ''))
+        return set(zip(s, s[1:], s[2:]))
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
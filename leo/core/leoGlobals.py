@@ -2542,7 +2542,13 @@ lastFunctionsDict = {}
 def clearAllIvars(o):
     """Clear all ivars of o, a member of some class."""
     if o:
-        o.__dict__.clear()
+        if hasattr(o, '__dict__'):
+            o.__dict__.clear()
+        # Also clear slots, for example, VNode slots.
+        for cls in o.__class__.__mro__:
+            for ivar in cls.__dict__.get('__slots__', []):
+                if ivar not in ('__dict__', '__weakref__') and hasattr(o, ivar):
+                    delattr(o, ivar)
 #@+node:ekr.20031218072017.1590: *4* g.collectGarbage
 def collectGarbage():
     try:
@@ -2930,13 +2936,41 @@ def get_directives_dict(p, root=None):
     following the first occurrence of each recognized directive
     """
     if root: root_node = root[0]
-    # c = p and p.v and p.v.context
+    d, has_noweb_root = g.get_cached_directives_dict(p.v)
+    if root and has_noweb_root:
+        if root_node:
+            d["root"] = 0 # value not immportant
+        else:
+            g.es('%s= may only occur in a topmost node (i.e., without a parent)' % (
+                g.angleBrackets('*')))
+    return d
+#@+node:ekr.20180906083012.1: *4* g.get_cached_directives_dict
+def get_cached_directives_dict(v):
+    '''
+    Return (d, has_noweb_root) for VNode v, where d is a new dict describing
+    the directives in v.h and v.b, and has_noweb_root is True if v.b
+    contains <<*>>=.
+
+    Cache the results in v._directiveCache. The cache is valid only if
+    v._headString and v._bodyString are the *same* strings as before, which
+    catches all changes, and if no plugin has added a directive since.
+    '''
+    c = v.context
+    h, b = v._headString, v._bodyString
+    n = len(globalDirectiveList)
+    data = v._directiveCache
+    if data and data[0] is h and data[1] is b and data[2] == n:
+        if c: # v.context is None in FastAtRead's test mode.
+            c.directiveCacheHits += 1
+        return dict(data[3]), data[4]
+    if c:
+        c.directiveCacheMisses += 1
     d = {}
     # Do this every time so plugins can add directives.
     pat = g.compute_directives_re()
     directives_pat = re.compile(pat, re.MULTILINE)
     # The headline has higher precedence because it is more visible.
-    for kind, s in (('head', p.h), ('body', p.b)):
+    for kind, s in (('head', v.headString()), ('body', v.bodyString())):
         anIter = directives_pat.finditer(s)
         for m in anIter:
             word = m.group(1).strip()
@@ -2954,16 +2988,9 @@ def get_directives_dict(p, root=None):
             d[word] = val
             # New in Leo 5.7.1: @path is allowed in body text.
             # This is very useful when doing recursive imports.
-    if root:
-        anIter = g_noweb_root.finditer(p.b)
-        for m in anIter:
-            if root_node:
-                d["root"] = 0 # value not immportant
-            else:
-                g.es('%s= may only occur in a topmost node (i.e., without a parent)' % (
-                    g.angleBrackets('*')))
-            break
-    return d
+    has_noweb_root = bool(g_noweb_root.search(v.bodyString()))
+    v._directiveCache = h, b, n, d, has_noweb_root
+    return dict(d), has_noweb_root
 #@+node:ekr.20090214075058.10: *4* g.compute_directives_re
 def compute_directives_re():
     '''
@@ -4065,14 +4092,16 @@ def recursiveUNLFind(unlList, c, depth=0, p=None, maxdepth=0, maxp=None,
     - `maxdepth`: part of recursion, don't set explicitly
     - `maxp`: part of recursion, don't set explicitly
     """
+    import leo.core.leoNodes as leoNodes
     if depth == 0:
-        nds = list(c.rootPosition().self_and_siblings())
+        parent_v = c.hiddenRootNode
         unlList = [i.replace('--%3E', '-->') for i in unlList if i.strip()]
         # drop empty parts so "-->node name" works
     else:
-        nds = list(p.children())
-    heads = [i.h for i in nds]
-    # work out order in which to try nodes
+        parent_v = p.v
+    n_children = len(parent_v.children)
+    # work out order in which to try nodes.
+    # v.childIndices finds nodes by headline without scanning all siblings.
     order = []
     nth_sib = nth_same = nth_line_no = nth_col_no = None
     try:
@@ -4090,30 +4119,33 @@ def recursiveUNLFind(unlList, c, depth=0, p=None, maxdepth=0, maxp=None,
         use_idx_mode = True # ok to use hard/soft_idx
         target = re.sub(pos_pattern, "", target).replace('--%3E', '-->')
         if hard_idx:
-            if nth_sib < len(heads):
+            if nth_sib < n_children:
                 order.append(nth_sib)
         else:
+            nths = parent_v.childIndices(target)
             # First we try the nth node with same header
             if nth_same:
-                nths = [n for n, i in enumerate(heads) if i == target]
-                if nth_same < len(nths) and heads[nths[nth_same]] == target:
+                if nth_same < len(nths):
                     order.append(nths[nth_same])
             # Then we try *all* other nodes with same header
-            order += [n for n, s in enumerate(heads)
-                        if n not in order and s == target]
+            order += [n for n in nths if n not in order]
             # Then position based, if requested
-            if soft_idx and nth_sib < len(heads):
+            if soft_idx and nth_sib < n_children:
                 order.append(nth_sib)
     elif hard_idx:
         pass # hard_idx mode with no idx in unl, go with empty order list
     else:
-        order = range(len(nds))
         target = target.replace('--%3E', '-->')
+        # Only nodes with the target headline can match.
+        order = parent_v.childIndices(target)
         use_idx_mode = False # not ok to use hard/soft_idx
         # note, the above also fixes calling with soft_idx=True and an old UNL
 
     for ndi in order:
-        nd = nds[ndi]
+        if depth == 0:
+            nd = leoNodes.Position(parent_v.children[ndi], ndi, [])
+        else:
+            nd = p.copy().moveToNthChild(ndi)
         if (
             target == nd.h or
             (use_idx_mode and (soft_idx or hard_idx) and ndi == nth_sib)
@@ -4159,6 +4191,38 @@ def recursiveUNLFind(unlList, c, depth=0, p=None, maxdepth=0, maxp=None,
             maxp = p
             maxdepth = p.level()
     return False, maxdepth, maxp
+#@+node:ekr.20180907180000.2: *4* g.findUNLs
+def findUNLs(unls, c, soft_idx=False, hard_idx=False):
+    """
+    Resolve many UNLs in the commander c at once, without changing the
+    selected position.
+
+    Each item of unls is either a list of UNL parts, as for
+    g.recursiveUNLFind, or a string such as 'a-->b:0' or
+    'unl://path#a-->b:0'. The path, if any, is ignored.
+
+    Return a list containing one (found, depth, p) tuple, as returned by
+    g.recursiveUNLFind, for each UNL. Equal UNLs are resolved only once.
+    """
+    result, d = [], {}
+    for unl in unls:
+        if g.isString(unl):
+            if unl.lower().startswith(('unl:' + '//', 'file://')):
+                unl = unl.split('//', 1)[1]
+            unl = g.unquoteUrl(unl.strip())
+            unlList = unl.split('#', 1)[-1].split('-->')
+        else:
+            unlList = unl
+        key = tuple(unlList)
+        data = d.get(key)
+        if data:
+            found, depth, p = data
+            data = found, depth, p and p.copy()
+        else:
+            data = d[key] = g.recursiveUNLFind(unlList, c,
+                soft_idx=soft_idx, hard_idx=hard_idx)
+        result.append(data)
+    return result
 #@+node:tbrown.20171221094755.1: *4* g.recursiveUNLParts
 pos_pattern = re.compile(r':(\d+),?(\d+)?,?([-\d]+)?,?(\d+)?$')
 
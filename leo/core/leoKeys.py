@@ -1942,7 +1942,8 @@ class KeyHandlerClass(object):
     def finishCreate(self):
         '''
         Complete the construction of the keyHandler class.
-        c.commandsDict has been created when this is called.
+        c.commandsDict has been created when this is called,
+        unless c.createLazySubCommander will create it.
         '''
         c, k = self.c, self
         k.w = c.frame.miniBufferWidget
@@ -1951,9 +1952,10 @@ class KeyHandlerClass(object):
             # A singleton. Defined here so that c.k will exist.
         k.getArgInstance = GetArg(c)
             # a singleton. Defined here so that c.k will exist.
-        k.makeAllBindings()
-            # Important: This must be called this now,
-            # even though LM.laod calls g.app.makeAllBindings later.
+        if 'commandsDict' not in c.lazySubCommanders:
+            k.makeAllBindings()
+                # Important: This must be called this now,
+                # even though LM.laod calls g.app.makeAllBindings later.
         k.initCommandHistory()
         k.inited = True
         k.setDefaultInputState()
@@ -27,7 +27,7 @@ class LeoMenu(object):
         # pylint: disable=unnecessary-lambda
         # The lambdas *are* necessary.
         c = self.c
-        if not c.commandsDict:
+        if 'commandsDict' in c.lazySubCommanders or not c.commandsDict:
             return # This is not an error: it happens during init.
         self.enable_dict = d = {
 
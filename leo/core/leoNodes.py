@@ -10,6 +10,7 @@ import leo.core.signal_manager as sig
     # # g.pr("enabled psyco classes",__file__)
     # try: from psyco.classes import *
     # except ImportError: pass
+import bisect
 import copy
 import time
 import re
@@ -540,11 +541,10 @@ class Position(object):
     def self_and_subtree(self, copy=True):
         '''Yield p and all positions in p's subtree.'''
         p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        while p and p != after:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        if p.v:
+            yield p.copy()
+            for p2 in p.subtree(copy=copy):
+                yield p2
 
     # Compatibility with old code...
     self_and_subtree_iter = self_and_subtree
@@ -552,12 +552,10 @@ class Position(object):
     def subtree(self, copy=True):
         '''Yield all positions in p's subtree, but not p.'''
         p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        p.moveToThreadNext()
-        while p and p != after:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        if p.v:
+            stack = p.stack + [(p.v, p._childIndex)]
+            for p2 in position_generator(p.v, stack, copy=copy):
+                yield p2
 
     # Compatibility with old code...
     subtree_iter = subtree
@@ -746,14 +744,10 @@ class Position(object):
         aList = []
         for i in self.self_and_parents(copy=False):
             if with_index or with_count:
-                count = 0
-                ind = 0
-                p = i.copy()
-                while p.hasBack():
-                    ind = ind + 1
-                    p.moveToBack()
-                    if i.h == p.h:
-                        count = count + 1
+                ind = i._childIndex
+                # The number of previous siblings with the same headline.
+                indices = i._parentVnode().childIndices(i.v._headString)
+                count = bisect.bisect_left(indices, ind)
                 aList.append(i.h.replace('-->', '--%3E') + ":" + str(ind))
                     # g.recursiveUNLFind and sf.copy_to_my_settings undo this replacement.
                 if count or with_count:
@@ -1179,11 +1173,22 @@ class Position(object):
     def moveToNodeAfterTree(self):
         """Move a position to the node after the position's tree."""
         p = self
-        while p:
-            if p.hasNext():
-                p.moveToNext()
+        if not p.v:
+            return p
+        # Inline p.hasNext, p.moveToNext and p.moveToParent.
+        hiddenRootNode = p.v.context.hiddenRootNode
+        stack = p.stack
+        n = p._childIndex + 1
+        while True:
+            parent_v = stack[-1][0] if stack else hiddenRootNode
+            if n < len(parent_v.children):
+                p.v, p._childIndex = parent_v.children[n], n
                 break
-            p.moveToParent()
+            if not stack:
+                p.v = None
+                break
+            p.v, n = stack.pop()
+            n += 1
         return p
     #@+node:ekr.20080416161551.206: *4* p.moveToNthChild
     def moveToNthChild(self, n):
@@ -1218,19 +1223,13 @@ class Position(object):
     def moveToThreadNext(self):
         """Move a position to threadNext position."""
         p = self
-        if p.v:
-            if p.v.children:
-                p.moveToFirstChild()
-            elif p.hasNext():
-                p.moveToNext()
+        v = p.v
+        if v:
+            if v.children:
+                p.stack.append((v, p._childIndex),)
+                p.v, p._childIndex = v.children[0], 0
             else:
-                p.moveToParent()
-                while p:
-                    if p.hasNext():
-                        p.moveToNext()
-                        break #found
-                    p.moveToParent()
-                # not found.
+                p.moveToNodeAfterTree()
         return p
     #@+node:ekr.20080416161551.210: *4* p.moveToVisBack & helper
     def moveToVisBack(self, c):
@@ -1368,7 +1367,7 @@ class Position(object):
 
     def copyTreeFromSelfTo(self, p2, copyGnxs=False):
         p = self
-        p2.v._headString = g.toUnicode(p.h, reportErrors=True) # 2017/01/24
+        p2.v.setHeadString(g.toUnicode(p.h, reportErrors=True)) # 2017/01/24
         p2.v._bodyString = g.toUnicode(p.b, reportErrors=True) # 2017/01/24
         # Fix bug 1019794: p.copyTreeFromSelfTo, should deepcopy p.v.u.
         p2.v.u = copy.deepcopy(p.v.u)
@@ -1869,6 +1868,58 @@ class Position(object):
     #@-others
 
 position = Position # compatibility.
+#@+node:ekr.20180906071745.1: ** position_generator
+def position_generator(parent_v, stack=None, copy=True, unique=False, vnodes=False):
+    '''
+    A generator yielding the positions of all descendants of parent_v, in
+    outline order. stack is the stack of the positions of parent_v's
+    children.
+
+    This is the traversal engine for c.all_positions, p.subtree, etc. It
+    walks vnodes using its own stack of child indices, so it never calls
+    p.copy or p.moveToThreadNext.
+
+    copy:   True:  yield a new position for each node.
+            False: yield a single position, changed in place.
+                   Callers must not change the yielded position.
+    unique: True:  yield only the first position of each vnode, skipping
+                   the subtrees of all later positions.
+    vnodes: True:  yield vnodes instead of positions.
+    '''
+    stack = stack[:] if stack else []
+    p = Position(None, 0, None)
+    p.stack = stack # The cursor for copy=False.
+    seen = set()
+    children, i = parent_v.children, 0
+    parents = [] # Stack of (children, i) tuples, one per entry of stack.
+    while True:
+        # Check len(children) on each iteration, like p.moveToThreadNext.
+        if i < len(children):
+            v = children[i]
+            if unique:
+                if v in seen:
+                    i += 1
+                    continue
+                seen.add(v)
+            if vnodes:
+                yield v
+            elif copy:
+                yield Position(v, i, stack)
+            else:
+                p.v, p._childIndex = v, i
+                yield p
+            if v.children:
+                parents.append((children, i),)
+                stack.append((v, i),)
+                children, i = v.children, 0
+            else:
+                i += 1
+        elif parents:
+            children, i = parents.pop()
+            stack.pop()
+            i += 1
+        else:
+            break
 #@+node:ville.20090311190405.68: ** class PosList (leoNodes.py)
 class PosList(list):
     #@+others
@@ -1944,6 +1995,38 @@ class VNodeBase(object):
     writeBit = 0x400
     orphanBit = 0x800 # True: error in @<file> tree prevented it from being written.
     #@-<< VNode constants >>
+    #@+<< VNode slots >>
+    #@+node:ekr.20180906062318.1: *3* << VNode slots >>
+    # Slots save well over 100 bytes per VNode, which matters for outlines
+    # containing millions of nodes. The __dict__ slot allows plugins to add
+    # ivars. The dict is created only when a plugin does so.
+    if not use_zodb:
+        # ZODB.Persistence.Persistent has its own instance layout.
+        __slots__ = (
+            '__dict__',
+            '_bodyString',
+            '_directiveCache',
+            '_expandedPositions',
+            '_headString',
+            '_headlineIndex',
+            '_p_changed', # Set throughout Leo for ZODB.
+            'children',
+            'context',
+            'fileIndex',
+            'iconVal',
+            'parents',
+            'statusBits',
+        )
+    # Rarely used ivars. Setting them creates v.__dict__.
+    insertSpot = None
+        # Location of previous insert point.
+    scrollBarSpot = None
+        # Previous value of scrollbar position.
+    selectionLength = 0
+        # The length of the selected body text.
+    selectionStart = 0
+        # The start of the selected body text.
+    #@-<< VNode slots >>
     #@+others
     #@+node:ekr.20031218072017.3342: *3* v.Birth & death
     #@+node:ekr.20031218072017.3344: *4* v.__init
@@ -1972,16 +2055,16 @@ class VNodeBase(object):
         self.context = context # The context containing context.hiddenRootNode.
             # Required so we can compute top-level siblings.
             # It is named .context rather than .c to emphasize its limited usage.
-        self.expandedPositions = []
+        self._directiveCache = None
+            # Used only by g.get_cached_directives_dict.
+        self._expandedPositions = None
             # Positions that should be expanded.
-        self.insertSpot = None
-            # Location of previous insert point.
-        self.scrollBarSpot = None
-            # Previous value of scrollbar position.
-        self.selectionLength = 0
-            # The length of the selected body text.
-        self.selectionStart = 0
-            # The start of the selected body text.
+            # Created only when needed. See the v.expandedPositions property.
+        self._headlineIndex = None
+            # The headlines of v.children. Created only when needed.
+            # See v.childIndices.
+        # v.insertSpot, v.scrollBarSpot, v.selectionLength and v.selectionStart
+        # are class ivars until set. See << VNode slots >>.
         # To make VNode's independent of Leo's core,
         # wrap all calls to the VNode ctor::
         #
@@ -2201,6 +2284,31 @@ class VNodeBase(object):
     getBody = bodyString
         # Deprecated, but here for compatibility.
     #@+node:ekr.20031218072017.3360: *4* v.Children
+    #@+node:ekr.20180907180000.1: *5* v.childIndices
+    def childIndices(self, h):
+        '''
+        Return the sorted list of the indices of v's children whose
+        headline is h. Don't change the list.
+
+        v._headlineIndex caches a dict whose keys are headlines of v's
+        children. The link methods and v.setHeadString clear the cache, so
+        code that changes the headline of an existing vnode must use
+        v.setHeadString. Because some code changes v.children directly,
+        this method recomputes the dict if v.children has changed or if a
+        cached child no longer has headline h.
+        '''
+        v = self
+        children = v.children
+        index = v._headlineIndex
+        if index and index[0] is children and index[1] == len(children):
+            indices = index[2].get(h)
+            if indices and all(children[i]._headString == h for i in indices):
+                return indices
+        d = {}
+        for i, child in enumerate(children):
+            d.setdefault(child._headString, []).append(i)
+        v._headlineIndex = children, len(children), d
+        return d.get(h, [])
     #@+node:ekr.20031218072017.3362: *5* v.firstChild
     def firstChild(self):
         v = self
@@ -2497,6 +2605,8 @@ class VNodeBase(object):
                     self.unicode_warning_given = True
                     g.internalError(s)
                     g.es_exception()
+        for parent_v in v.parents:
+            parent_v._headlineIndex = None
 
     initBodyString = setBodyString
     initHeadString = setHeadString
@@ -2539,6 +2649,7 @@ class VNodeBase(object):
             # For a plugin.
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex, v)
+        parent_v._headlineIndex = None
         v.parents.append(parent_v)
         # Set zodb changed flags.
         v._p_changed = 1
@@ -2552,6 +2663,7 @@ class VNodeBase(object):
             # For a plugin.
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex, v)
+        parent_v._headlineIndex = None
         v.parents.append(parent_v)
         # Set zodb changed flags.
         v._p_changed = 1
@@ -2578,6 +2690,7 @@ class VNodeBase(object):
         parent_v.childrenModified()
         assert parent_v.children[childIndex] == v
         del parent_v.children[childIndex]
+        parent_v._headlineIndex = None
         if parent_v in v.parents:
             try:
                 v.parents.remove(parent_v)
@@ -2618,6 +2731,7 @@ class VNodeBase(object):
                 g.trace('v2.parents:')
                 g.printObj(v2.parents)
         v.children = []
+        v._headlineIndex = None
     #@+node:ekr.20031218072017.3425: *4* v._linkAsNthChild
     def _linkAsNthChild(self, parent_v, n):
         """Links self as the n'th child of VNode pv"""
@@ -2678,6 +2792,20 @@ class VNodeBase(object):
     gnx = property(
         __get_gnx, # __set_gnx,
         doc="VNode gnx property")
+    #@+node:ekr.20180906062318.2: *4* v.expandedPositions property
+    def __get_expandedPositions(self):
+        v = self
+        if v._expandedPositions is None:
+            v._expandedPositions = []
+        return v._expandedPositions
+
+    def __set_expandedPositions(self, val):
+        v = self
+        v._expandedPositions = val
+
+    expandedPositions = property(
+        __get_expandedPositions, __set_expandedPositions,
+        doc="VNode expandedPositions property")
     #@-others
 
 if use_zodb and ZODB:
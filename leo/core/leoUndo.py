@@ -41,9 +41,17 @@
 # operation. More than one list may be generated: client code is responsible for
 # merging lists using the pattern dirtyVnodeList.extend(dirtyVnodeList2)
 # 
+# New in Leo 5.8: Beads for u.before/afterChangeNodeContents contain only the
+# changed part of the body text, not the old and new bodies. u.undoNodeContents
+# and u.redoNodeContents recreate the old and new text from p.b. Beads for
+# u.before/afterChangeTree save the new tree only when the operation is first
+# undone. The @int max_undo_stack_bytes setting limits the (estimated) size of
+# all beads. The show-undo-stats command shows the size of the beads.
+# 
 # I first saw this model of unlimited undo in the documentation for Apple's Yellow Box classes.
 #@-<< How Leo implements unlimited undo >>
 import leo.core.leoGlobals as g
+import sys
 # pylint: disable=unpacking-non-sequence
 #@+others
 #@+node:ekr.20031218072017.3605: ** class Undoer
@@ -61,6 +69,7 @@ class Undoer(object):
         self.debug_print = False # True: enable print statements in debug code.
         self.granularity = None # Set in reloadSettings.
         self.max_undo_stack_size = c.config.getInt('max_undo_stack_size') or 0
+        self.max_undo_stack_bytes = 0 # Set in reloadSettings.
         # Statistics comparing old and new ways (only if self.debug_Undoer is on).
         self.new_mem = 0
         self.old_mem = 0
@@ -81,6 +90,8 @@ class Undoer(object):
         # Set the following ivars to keep pylint happy.
         self.afterTree = None
         self.beforeTree = None
+        self.bodyDelta = None
+        self.bunch = None # The bead being undone or redone.
         self.children = None
         self.deleteMarkedNodesData = None
         self.dirtyVnodeList = None
@@ -128,6 +139,7 @@ class Undoer(object):
             self.granularity = self.granularity.lower()
         if self.granularity not in ('node', 'line', 'word', 'char'):
             self.granularity = 'line'
+        self.max_undo_stack_bytes = c.config.getInt('max_undo_stack_bytes') or 0
 
     def redoHelper(self):
         pass
@@ -140,6 +152,39 @@ class Undoer(object):
         # pylint: disable=no-self-argument
         return g.new_cmd_decorator(name, ['c', 'undoer', ])
     #@+node:ekr.20050416092908.1: *3* u.Internal helpers
+    #@+node:ekr.20180907071532.2: *4* u.beadBytes
+    def beadBytes(self, bunch, cache=True):
+        '''
+        Return the estimated number of bytes used by the strings and
+        containers in the bunch. This includes strings shared with the outline.
+
+        If cache is True, return the size found by a previous call.
+        '''
+        if cache:
+            n = bunch.get('byteCount')
+            if n is not None:
+                return n
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            if g.isString(obj) or isinstance(obj, bytes):
+                seen.add(id(obj))
+                return sys.getsizeof(obj)
+            if isinstance(obj, (list, tuple)):
+                seen.add(id(obj))
+                return sys.getsizeof(obj) + sum(size(z) for z in obj)
+            if isinstance(obj, g.Bunch):
+                obj = obj.__dict__
+            if isinstance(obj, dict):
+                seen.add(id(obj))
+                return sys.getsizeof(obj) + sum(size(z) for z in obj.values())
+            return 0
+
+        n = size(bunch)
+        bunch.byteCount = n
+        return n
     #@+node:ekr.20031218072017.3607: *4* u.clearOptionalIvars
     def clearOptionalIvars(self):
         u = self
@@ -161,6 +206,66 @@ class Undoer(object):
                 # g.trace('Cutting undo stack to %d entries' % (n))
             u.beads = u.beads[-n:]
             u.bead = n - 1
+        if u.max_undo_stack_bytes > 0 and not g.app.unitTesting:
+            u.cutStackBytes(u.max_undo_stack_bytes)
+    #@+node:ekr.20180907071532.1: *5* u.cutStackBytes
+    def cutStackBytes(self, max_bytes):
+        '''Remove the oldest beads until all beads take at most max_bytes.'''
+        u = self
+        sizes = [u.beadBytes(bunch, cache=abs(i - u.bead) > 1)
+            for i, bunch in enumerate(u.beads)]
+        total = sum(sizes)
+        n = 0
+        # Always keep the present bead.
+        while total > max_bytes and n < u.bead:
+            bunch = u.beads[n]
+            if bunch.get('kind') == 'beforeGroup':
+                break # Don't split a group that is being created.
+            total -= sizes[n]
+            n += 1
+        if n > 0:
+            u.beads = u.beads[n:]
+            u.bead -= n
+    #@+node:ekr.20180907071532.3: *4* u.diffText & patchText
+    def diffText(self, old, new):
+        '''
+        Return a compact description of the change from old to new:
+        (i, old_middle, new_middle, j), where i and j are the lengths of the
+        common prefix and suffix of old and new.
+        '''
+        n = min(len(old), len(new))
+        # Find the common prefix by bisection, comparing slices in C.
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old.startswith(new[lo:mid], lo):
+                lo = mid
+            else:
+                hi = mid - 1
+        i = lo
+        # Find the common suffix, which must not overlap the prefix.
+        lo, hi = 0, n - i
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old.endswith(new[len(new) - mid: len(new) - lo], 0, len(old) - lo):
+                lo = mid
+            else:
+                hi = mid - 1
+        j = lo
+        return i, old[i: len(old) - j], new[i: len(new) - j], j
+
+    def patchText(self, s, delta, undo):
+        '''
+        Return the old text (undo) or new text (redo) described by the delta,
+        given s, the new text (undo) or the old text (redo).
+
+        Return None if s does not match the delta.
+        '''
+        i, old_middle, new_middle, j = delta
+        middle, other = (old_middle, new_middle) if undo else (new_middle, old_middle)
+        if len(s) != i + len(other) + j:
+            return None
+        return s[: i] + middle + s[len(s) - j:]
     #@+node:ekr.20080623083646.10: *4* u.dumpBead
     def dumpBead(self, n):
         u = self
@@ -263,6 +368,7 @@ class Undoer(object):
             setattr(u, key, val)
             if key not in u.optionalIvars:
                 u.optionalIvars.append(key)
+        u.bunch = bunch
     #@+node:ekr.20031218072017.3614: *4* u.setRedoType
     # These routines update both the ivar and the menu label.
 
@@ -325,37 +431,22 @@ class Undoer(object):
         else:
             u.setRedoType("Can't Redo")
         u.cutStack()
-    #@+node:EKR.20040530121329: *4* u.restoreTree & helpers
+    #@+node:EKR.20040530121329: *4* u.restoreTree
     def restoreTree(self, treeInfo):
         """Use the tree info to restore all VNode data,
         including all links."""
-        u = self
         # This effectively relinks all vnodes.
-        for v, vInfo, tInfo in treeInfo:
-            u.restoreVnodeUndoInfo(vInfo)
-            u.restoreTnodeUndoInfo(tInfo)
-    #@+node:ekr.20050415170737.2: *5* u.restoreVnodeUndoInfo
-    def restoreVnodeUndoInfo(self, bunch):
-        """Restore all ivars saved in the bunch."""
-        v = bunch.v
-        v.statusBits = bunch.statusBits
-        v.children = bunch.children
-        v.parents = bunch.parents
-        uA = bunch.get('unknownAttributes')
-        if uA is not None:
-            v.unknownAttributes = uA
-            v._p_changed = 1
-    #@+node:ekr.20050415170812.2: *5* u.restoreTnodeUndoInfo
-    def restoreTnodeUndoInfo(self, bunch):
-        v = bunch.v
-        v.h = bunch.headString
-        v.b = bunch.bodyString
-        v.statusBits = bunch.statusBits
-        uA = bunch.get('unknownAttributes')
-        if uA is not None:
-            v.unknownAttributes = uA
-            v._p_changed = 1
-    #@+node:EKR.20040528075307: *4* u.saveTree & helpers
+        for v, statusBits, parents, children, h, b, uA in treeInfo:
+            v.statusBits = statusBits
+            v.children = list(children)
+            v.parents = list(parents)
+            if uA is not None:
+                v.unknownAttributes = uA
+                v._p_changed = 1
+            v.h = h
+            v.b = b
+            v.statusBits = statusBits
+    #@+node:EKR.20040528075307: *4* u.saveTree
     def saveTree(self, p, treeInfo=None):
         """Return a list of tuples with all info needed to handle a general undo operation."""
         # WARNING: read this before doing anything "clever"
@@ -371,50 +462,29 @@ class Undoer(object):
         # needed to properly restore the vnodes and tnodes. It creates a list of
         # tuples, on tuple for each VNode in the tree. Each tuple has the form,
         # 
-        # (vnodeInfo, tnodeInfo)
+        # (v, statusBits, parents, children, headString, bodyString, uA)
         # 
-        # where vnodeInfo and tnodeInfo are dicts contain all info needed to
-        # recreate the nodes. The v.createUndoInfoDict and t.createUndoInfoDict
-        # methods correspond to the old v.copy and t.copy methods.
+        # where parents and children are tuples and uA is None if v has no
+        # unknownAttributes. Tuples take much less memory than the g.Bunches
+        # used before Leo 5.8.
         # 
         # Aside: Prior to 4.2 Leo used a scheme that was equivalent to the
         # createUndoInfoDict info, but quite a bit uglier.
         #@-<< about u.saveTree >>
-        u = self; topLevel = (treeInfo is None)
-        if topLevel: treeInfo = []
+        if treeInfo is None: treeInfo = []
         # Add info for p.v.  Duplicate tnode info is harmless.
-        data = (p.v, u.createVnodeUndoInfo(p.v), u.createTnodeUndoInfo(p.v))
-        treeInfo.append(data)
+        v = p.v
+        treeInfo.append((
+            v, v.statusBits, tuple(v.parents), tuple(v.children),
+            v._headString, v._bodyString,
+            getattr(v, 'unknownAttributes', None),
+        ))
         # Recursively add info for the subtree.
         child = p.firstChild()
         while child:
             self.saveTree(child, treeInfo)
             child = child.next()
         return treeInfo
-    #@+node:ekr.20050415170737.1: *5* u.createVnodeUndoInfo
-    def createVnodeUndoInfo(self, v):
-        """Create a bunch containing all info needed to recreate a VNode for undo."""
-        bunch = g.Bunch(
-            v=v,
-            statusBits=v.statusBits,
-            parents=v.parents[:],
-            children=v.children[:],
-        )
-        if hasattr(v, 'unknownAttributes'):
-            bunch.unknownAttributes = v.unknownAttributes
-        return bunch
-    #@+node:ekr.20050415170812.1: *5* u.createTnodeUndoInfo
-    def createTnodeUndoInfo(self, v):
-        """Create a bunch containing all info needed to recreate a VNode."""
-        bunch = g.Bunch(
-            v=v,
-            headString=v.h,
-            bodyString=v.b,
-            statusBits=v.statusBits,
-        )
-        if hasattr(v, 'unknownAttributes'):
-            bunch.unknownAttributes = v.unknownAttributes
-        return bunch
     #@+node:ekr.20050525151449: *4* u.trace
     def trace(self):
         ivars = ('kind', 'undoType')
@@ -486,7 +556,9 @@ class Undoer(object):
         bunch.redoHelper = u.redoNodeContents
         bunch.dirtyVnodeList = dirtyVnodeList
         bunch.inHead = inHead # 2013/08/26
-        bunch.newBody = p.b
+        # Remember only the changed part of the body.
+        bunch.bodyDelta = u.diffText(bunch.oldBody, p.b)
+        del bunch.oldBody
         bunch.newChanged = u.c.isChanged()
         bunch.newDirty = p.isDirty()
         bunch.newHead = p.h
@@ -508,10 +580,10 @@ class Undoer(object):
         bunch.undoType = command
         bunch.undoHelper = u.undoTree
         bunch.redoHelper = u.redoTree
-        # Set by beforeChangeTree: changed, oldSel, oldText, oldTree, p
+        # Set by beforeChangeTree: changed, oldSel, oldTree, p
         bunch.newSel = w.getSelectionRange()
-        bunch.newText = w.getAllText()
-        bunch.newTree = u.saveTree(p)
+        bunch.newTree = None
+            # u.undoRedoTree sets newTree when first undoing the operation.
         u.pushBead(bunch)
     #@+node:ekr.20050424161505: *5* u.afterClearRecentFiles
     def afterClearRecentFiles(self, bunch):
@@ -786,7 +858,6 @@ class Undoer(object):
         w = c.frame.body.wrapper
         bunch = u.createCommonBunch(p)
         bunch.oldSel = w.getSelectionRange()
-        bunch.oldText = w.getAllText()
         bunch.oldTree = u.saveTree(p)
         return bunch
     #@+node:ekr.20050424161505.1: *5* u.beforeClearRecentFiles
@@ -1361,9 +1432,13 @@ class Undoer(object):
     def redoNodeContents(self):
         u = self; c = u.c; w = c.frame.body.wrapper
         # Restore the body.
-        u.p.setBodyString(u.newBody)
-        w.setAllText(u.newBody)
-        c.frame.body.recolor(u.p)
+        newBody = u.patchText(u.p.b, u.bodyDelta, undo=False)
+        if newBody is None:
+            g.error('can not redo: body changed: %s' % u.p.h)
+        else:
+            u.p.setBodyString(newBody)
+            w.setAllText(newBody)
+            c.frame.body.recolor(u.p)
         # Restore the headline.
         u.p.initHeadString(u.newHead)
         # This is required so.  Otherwise redraw will revert the change!
@@ -1435,6 +1510,25 @@ class Undoer(object):
         if u.yview:
             c.bodyWantsFocus()
             w.setYScrollPosition(u.yview)
+    #@+node:ekr.20180907071532.4: *3* u.showUndoStats
+    @cmd('show-undo-stats')
+    def showUndoStats(self, event=None):
+        """Print statistics about the undo stack."""
+        u = self
+        counts, total = {}, 0
+        for bunch in u.beads:
+            key = bunch.get('undoType') or bunch.get('kind') or '<unknown>'
+            counts[key] = counts.get(key, 0) + 1
+            total += u.beadBytes(bunch, cache=False)
+        max_bytes = u.max_undo_stack_bytes
+        result = [
+            'undo stack: %s beads, current bead: %s' % (len(u.beads), u.bead),
+            'estimated size: %s bytes, limit: %s' % (
+                total, '%s bytes' % max_bytes if max_bytes > 0 else 'none'),
+        ]
+        for key in sorted(counts):
+            result.append('%6s %s' % (counts[key], key))
+        g.es_print('\n'.join(result))
     #@+node:ekr.20031218072017.2039: *3* u.undo
     @cmd('undo')
     def undo(self, event=None):
@@ -1652,9 +1746,13 @@ class Undoer(object):
         '''
         u = self; c = u.c
         w = c.frame.body.wrapper
-        u.p.b = u.oldBody
-        w.setAllText(u.oldBody)
-        c.frame.body.recolor(u.p)
+        oldBody = u.patchText(u.p.b, u.bodyDelta, undo=True)
+        if oldBody is None:
+            g.error('can not undo: body changed: %s' % u.p.h)
+        else:
+            u.p.b = oldBody
+            w.setAllText(oldBody)
+            c.frame.body.recolor(u.p)
         u.p.h = u.oldHead
         # This is required.  Otherwise c.redraw will revert the change!
         c.frame.tree.setHeadline(u.p, u.oldHead)
@@ -1738,9 +1836,8 @@ class Undoer(object):
         if new_data is None:
             # This is the first time we have undone the operation.
             # Put the new data in the bead.
-            bunch = u.beads[u.bead]
-            bunch.newTree = u.saveTree(p.copy())
-            u.beads[u.bead] = bunch
+            u.bunch.newTree = u.saveTree(p.copy())
+            u.bunch.byteCount = None
         # Replace data in tree with old data.
         u.restoreTree(old_data)
         c.setBodyString(p, p.b)
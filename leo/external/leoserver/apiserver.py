@@ -0,0 +1,594 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907210000.1: * @file c:/leo.repo/leo-editor/leo/external/leoserver/apiserver.py
+#@+<< docstring >>
+#@+node:ekr.20180907210000.2: ** << docstring >>
+'''
+A headless server for Leo outlines, using leoBridge and asyncio.
+
+Usage: python apiserver.py [--host HOST] [--port PORT] [outline.leo ...]
+
+Clients send requests and receive responses as lines of JSON. A request
+contains a batch of operations, done in one round trip::
+
+    {"id": 1, "outline": "c:/test/x.leo", "ops": [
+        {"op": "set_body", "gnx": "ekr.20180907210000.1", "b": "text"},
+        {"op": "get_nodes", "gnxs": ["ekr.20180907210000.1"]}]}
+
+The response contains the result of each operation::
+
+    {"id": 1, "results": [null, [{"gnx": ..., "h": ..., "b": ..., "children": [...]}]]}
+
+If an operation fails, the response contains the results of the previous
+operations, the index of the failed operation and an error message. The
+remaining operations are not done. Previous operations are not undone.
+
+Operations take the outline named in the request unless they contain an
+"outline" key. Outlines are named by the absolute paths returned by open.
+
+Operations:
+
+- open {path}: Open an outline. Return {outline, root, generation}. root
+  is the gnx of the hidden root node, the parent of all top-level nodes.
+- close: Close the outline *without* saving it.
+- get_nodes {gnxs, bodies=true}: Return a list of nodes. Each node is
+  {gnx, h, b, children}, where children is a list of gnxs.
+- get_subtree {gnx=root, depth=null, bodies=true}: Return the nodes of the
+  subtree, at most depth levels below gnx, in outline order. Clones appear
+  once.
+- set_body {gnx, b} and set_headline {gnx, h}.
+- insert {parent=root, index=last, h, b}: Return the gnx of the new node.
+- move {gnx, parent, index=last, old_parent}: Move a node to the index'th
+  child of parent. old_parent selects the clone to move.
+- delete {gnx, parent}: Delete a node. parent selects the clone to delete.
+- save {path}: Save the outline. Return its file name.
+- write_at_file_nodes {all=false}: Write dirty (or all) @<file> nodes.
+- subscribe and unsubscribe.
+
+After each batch that changes an outline, subscribers receive an event::
+
+    {"event": "changed", "outline": ..., "generation": 7,
+     "changed": [gnxs], "deleted": [gnxs]}
+
+"changed" contains the gnxs of nodes whose headline, body or children have
+changed. Events for slow subscribers are merged. A batch that subscribes
+and gets a subtree misses no changes.
+
+The outline changes only in the thread running the asyncio event loop,
+one batch at a time, so each batch is atomic. Many clients connect at
+once, and their batches interleave.
+'''
+#@-<< docstring >>
+#@+<< imports >>
+#@+node:ekr.20180907210000.3: ** << imports >>
+import argparse
+import asyncio
+import json
+import leo.core.leoBridge as leoBridge
+#@-<< imports >>
+max_line_length = 2 ** 26
+    # The longest request or response, in bytes.
+#@+others
+#@+node:ekr.20180907210000.4: ** class ServerError
+class ServerError(Exception):
+    '''An error in a request.'''
+    pass
+#@+node:ekr.20180907210000.5: ** class Outline
+class Outline(object):
+    '''An outline opened by an OutlineServer.'''
+
+    def __init__(self, name, c):
+        '''Ctor for the Outline class.'''
+        self.c = c
+        self.generation = 0
+            # Incremented after each batch that changes the outline.
+        self.name = name
+        self.subscribers = set()
+            # Connections.
+#@+node:ekr.20180907210000.6: ** class Connection
+class Connection(object):
+    '''A client's connection to an OutlineServer.'''
+    #@+others
+    #@+node:ekr.20180907210000.7: *3* conn.__init__
+    def __init__(self, writer):
+        '''Ctor for the Connection class.'''
+        self.closed = False
+        self.flushing = False
+        self.outlines = set()
+            # The subscribed outlines.
+        self.pending = {}
+            # Keys are outline names, values are (generation, changed, deleted).
+        self.writer = writer
+    #@+node:ekr.20180907210000.8: *3* conn.flush
+    async def flush(self):
+        '''Send all pending events.'''
+        try:
+            while self.pending and not self.closed:
+                pending, self.pending = self.pending, {}
+                for name in sorted(pending):
+                    generation, changed, deleted = pending[name]
+                    self.send({
+                        'event': 'changed',
+                        'outline': name,
+                        'generation': generation,
+                        'changed': sorted(changed - deleted),
+                        'deleted': sorted(deleted),
+                    })
+                # Events arriving while the client is slow are merged.
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.flushing = False
+    #@+node:ekr.20180907210000.9: *3* conn.notify
+    def notify(self, outline, changed, deleted):
+        '''Queue an event about changed and deleted gnxs.'''
+        data = self.pending.get(outline.name)
+        if data:
+            changed |= data[1]
+            deleted |= data[2]
+        self.pending[outline.name] = outline.generation, changed, deleted
+        if not self.flushing:
+            self.flushing = True
+            asyncio.ensure_future(self.flush())
+    #@+node:ekr.20180907210000.10: *3* conn.send
+    def send(self, message):
+        '''Send a message (a dict).'''
+        if not self.closed:
+            self.writer.write(encode(message))
+    #@-others
+#@+node:ekr.20180907210000.11: ** class OutlineServer
+class OutlineServer(object):
+    '''Serve outlines opened with a leoBridge to clients.'''
+    #@+others
+    #@+node:ekr.20180907210000.12: *3* server.__init__
+    def __init__(self, bridge):
+        '''Ctor for the OutlineServer class.'''
+        self.bridge = bridge
+        self.g = bridge.globals()
+        import leo.core.leoNodes as leoNodes
+        self.leoNodes = leoNodes
+        self.outlines = {}
+            # Keys are outline names, values are Outlines.
+    #@+node:ekr.20180907210000.13: *3* server.start
+    def start(self, host='127.0.0.1', port=8371):
+        '''Return a coroutine that starts the server.'''
+        return asyncio.start_server(self.handle_connection, host, port,
+            limit=max_line_length)
+    #@+node:ekr.20180907210000.14: *3* server.handle_connection
+    async def handle_connection(self, reader, writer):
+        '''Handle all requests of one client.'''
+        conn = Connection(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                conn.send(self.handle_request(conn, line))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError: the line is longer than max_line_length.
+            pass
+        finally:
+            conn.closed = True
+            for outline in conn.outlines:
+                outline.subscribers.discard(conn)
+            writer.close()
+    #@+node:ekr.20180907210000.15: *3* server.handle_request & helpers
+    def handle_request(self, conn, line):
+        '''Do all operations of a request. Return the response.'''
+        g = self.g
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('not an object')
+        except ValueError as e:
+            return {'id': None, 'error': 'invalid request: %s' % e}
+        results = []
+        response = {'id': request.get('id'), 'results': results}
+        ops = request.get('ops')
+        if not isinstance(ops, list):
+            response['error'] = 'ops must be a list'
+            return response
+        batch = g.Bunch(
+            changes={}, # Keys are Outlines, values are (changed, deleted).
+            conn=conn,
+            outline=request.get('outline'),
+        )
+        for i, op in enumerate(ops):
+            try:
+                results.append(self.handle_op(op, batch))
+            except ServerError as e:
+                response['error'], response['index'] = str(e), i
+                break
+            except Exception as e:
+                g.es_exception()
+                response['error'], response['index'] = 'internal error: %r' % e, i
+                break
+        for outline, (changed, deleted) in batch.changes.items():
+            outline.generation += 1
+            for conn2 in outline.subscribers:
+                conn2.notify(outline, set(changed), set(deleted))
+        return response
+    #@+node:ekr.20180907210000.16: *4* server.arg
+    def arg(self, op, name, kind, default=ServerError):
+        '''Return op[name], which must have the given kind.'''
+        if name not in op:
+            if default is ServerError:
+                raise ServerError('%s: no %s' % (op['op'], name))
+            return default
+        value = op[name]
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise ServerError('%s: bad %s: %r' % (op['op'], name, value))
+        return value
+    #@+node:ekr.20180907210000.17: *4* server.changed
+    def changed(self, batch, outline, nodes, deleted=()):
+        '''
+        Record that the headlines, bodies or children of nodes have
+        changed. Set the dirty bits of nodes and their @<file> nodes.
+        '''
+        c = outline.c
+        aSet, deletedSet = batch.changes.setdefault(outline, (set(), set()))
+        for v in nodes:
+            aSet.add(v.gnx)
+            if v is not c.hiddenRootNode:
+                v.setDirty()
+                v.setAllAncestorAtFileNodesDirty()
+        deletedSet.update(v.gnx for v in deleted)
+        c.setChanged(True)
+    #@+node:ekr.20180907210000.18: *4* server.handle_op
+    def handle_op(self, op, batch):
+        '''Do one operation. Return its result.'''
+        if not isinstance(op, dict) or not isinstance(op.get('op'), str):
+            raise ServerError('not an operation: %r' % (op,))
+        method = getattr(self, 'do_' + op['op'], None)
+        if not method:
+            raise ServerError('unknown operation: %s' % op['op'])
+        return method(op, batch)
+    #@+node:ekr.20180907210000.19: *4* server.get_index
+    def get_index(self, op, n):
+        '''Return the index of a new child of a parent with n children.'''
+        index = self.arg(op, 'index', int, n)
+        if not 0 <= index <= n:
+            raise ServerError('%s: bad index: %s' % (op['op'], index))
+        return index
+    #@+node:ekr.20180907210000.20: *4* server.get_node
+    def get_node(self, outline, gnx, kind='node'):
+        '''Return the vnode of the outline with the given gnx.'''
+        c = outline.c
+        if not isinstance(gnx, str):
+            raise ServerError('bad %s: %r' % (kind, gnx))
+        if gnx == c.hiddenRootNode.gnx:
+            return c.hiddenRootNode
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v or not v.parents:
+            raise ServerError('no %s: %s' % (kind, gnx))
+        return v
+    #@+node:ekr.20180907210000.21: *4* server.get_outline
+    def get_outline(self, op, batch):
+        '''Return the Outline named in op or in the request.'''
+        name = self.arg(op, 'outline', str, batch.outline)
+        outline = self.outlines.get(name)
+        if not outline:
+            raise ServerError('%s: outline not open: %s' % (op['op'], name))
+        return outline
+    #@+node:ekr.20180907210000.22: *4* server.get_parent
+    def get_parent(self, op, outline, v, key='parent'):
+        '''Return the parent of v given by op[key], or v's first parent.'''
+        gnx = self.arg(op, key, str, None)
+        if gnx is None:
+            return v.parents[0]
+        parent_v = self.get_node(outline, gnx, key)
+        if parent_v not in v.parents:
+            raise ServerError('%s: %s is not a parent of %s' % (op['op'], gnx, v.gnx))
+        return parent_v
+    #@+node:ekr.20180907210000.45: *4* server.linked
+    def linked(self, c):
+        '''Select the first node if links have removed c.p from the outline.'''
+        # Save and write_at_file_nodes use c.p.
+        if not c.positionExists(c.p):
+            c.selectPosition(c.rootPosition())
+    #@+node:ekr.20180907210000.23: *4* server.node_dict
+    def node_dict(self, v, bodies):
+        '''Return a dict describing v.'''
+        d = {'gnx': v.gnx, 'h': v.h, 'children': [z.gnx for z in v.children]}
+        if bodies:
+            d['b'] = v.b
+        return d
+    #@+node:ekr.20180907210000.24: *3* server.operations
+    #@+node:ekr.20180907210000.25: *4* server.do_close
+    def do_close(self, op, batch):
+        '''Close the outline without saving it.'''
+        g = self.g
+        outline = self.get_outline(op, batch)
+        for conn in outline.subscribers:
+            conn.outlines.discard(outline)
+            conn.send({'event': 'closed', 'outline': outline.name})
+        del self.outlines[outline.name]
+        batch.changes.pop(outline, None)
+        c = outline.c
+        c.setChanged(False)
+        g.app.closeLeoWindow(c.frame, finish_quit=False)
+    #@+node:ekr.20180907210000.26: *4* server.do_delete
+    def do_delete(self, op, batch):
+        '''Delete a node.'''
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        v = self.get_node(outline, self.arg(op, 'gnx', str))
+        if v is c.hiddenRootNode:
+            raise ServerError('delete: can not delete the hidden root node')
+        parent_v = self.get_parent(op, outline, v)
+        if parent_v is c.hiddenRootNode and len(parent_v.children) == 1:
+            raise ServerError('delete: can not delete the only top-level node')
+        v._cutLink(parent_v.children.index(v), parent_v)
+        # v._cutLink removes the parent links of all unreachable nodes.
+        deleted, stack = [], [v]
+        while stack:
+            v2 = stack.pop()
+            if not v2.parents:
+                deleted.append(v2)
+                stack.extend(v2.children)
+        self.changed(batch, outline, [parent_v], deleted)
+        self.linked(c)
+    #@+node:ekr.20180907210000.27: *4* server.do_get_nodes
+    def do_get_nodes(self, op, batch):
+        '''Return the nodes with the given gnxs.'''
+        outline = self.get_outline(op, batch)
+        bodies = self.arg(op, 'bodies', bool, True)
+        return [self.node_dict(self.get_node(outline, gnx), bodies)
+            for gnx in self.arg(op, 'gnxs', list)]
+    #@+node:ekr.20180907210000.28: *4* server.do_get_subtree
+    def do_get_subtree(self, op, batch):
+        '''Return the nodes of a subtree in outline order.'''
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        v = self.get_node(outline, self.arg(op, 'gnx', str, c.hiddenRootNode.gnx))
+        depth = self.arg(op, 'depth', int, None)
+        bodies = self.arg(op, 'bodies', bool, True)
+        result, seen, stack = [], set(), [(v, 0)]
+        while stack:
+            v, level = stack.pop()
+            if v in seen:
+                continue
+            seen.add(v)
+            result.append(self.node_dict(v, bodies))
+            if depth is None or level < depth:
+                stack.extend((child, level + 1) for child in reversed(v.children))
+        return result
+    #@+node:ekr.20180907210000.29: *4* server.do_insert
+    def do_insert(self, op, batch):
+        '''Insert a new node. Return its gnx.'''
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        parent_v = self.get_node(outline,
+            self.arg(op, 'parent', str, c.hiddenRootNode.gnx), 'parent')
+        index = self.get_index(op, len(parent_v.children))
+        v = self.leoNodes.VNode(context=c)
+        v.h = self.arg(op, 'h', str, 'NewHeadline')
+        v.b = self.arg(op, 'b', str, '')
+        v._addLink(index, parent_v)
+        self.changed(batch, outline, [v, parent_v])
+        return v.gnx
+    #@+node:ekr.20180907210000.30: *4* server.do_move
+    def do_move(self, op, batch):
+        '''Move a node.'''
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        v = self.get_node(outline, self.arg(op, 'gnx', str))
+        if v is c.hiddenRootNode:
+            raise ServerError('move: can not move the hidden root node')
+        old_parent = self.get_parent(op, outline, v, 'old_parent')
+        parent_v = self.get_node(outline, self.arg(op, 'parent', str), 'parent')
+        # Refuse to move v into its own subtree.
+        nodes, seen = [parent_v], set()
+        while nodes:
+            v2 = nodes.pop()
+            if v2 is v:
+                raise ServerError('move: %s is in the subtree of %s' % (parent_v.gnx, v.gnx))
+            if v2 not in seen:
+                seen.add(v2)
+                nodes.extend(v2.parents)
+        if (old_parent is c.hiddenRootNode and parent_v is not old_parent and
+            len(old_parent.children) == 1
+        ):
+            raise ServerError('move: can not move the only top-level node')
+        n = len(parent_v.children)
+        index = self.get_index(op, n - 1 if parent_v is old_parent else n)
+        v._cutLink(old_parent.children.index(v), old_parent)
+        v._addLink(index, parent_v)
+        self.changed(batch, outline, [old_parent, parent_v])
+        self.linked(c)
+    #@+node:ekr.20180907210000.31: *4* server.do_open
+    def do_open(self, op, batch):
+        '''Open an outline. Make it the outline of the batch.'''
+        path = self.arg(op, 'path', str)
+        outline = self.open_outline(path)
+        batch.outline = outline.name
+        return {
+            'outline': outline.name,
+            'root': outline.c.hiddenRootNode.gnx,
+            'generation': outline.generation,
+        }
+    #@+node:ekr.20180907210000.32: *4* server.do_save
+    def do_save(self, op, batch):
+        '''Save the outline. Return its file name.'''
+        g = self.g
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        path = self.arg(op, 'path', str, None)
+        if path:
+            path = self.bridge.completeFileName(path)
+        elif not c.mFileName:
+            raise ServerError('save: no file name')
+        if g.app.disableSave:
+            raise ServerError('save: saving is disabled')
+        c.save(fileName=path)
+        if c.changed:
+            raise ServerError('save: can not save %s' % c.fileName())
+        return c.fileName()
+    #@+node:ekr.20180907210000.33: *4* server.do_set_body & do_set_headline
+    def do_set_body(self, op, batch):
+        '''Set the body text of a node.'''
+        outline = self.get_outline(op, batch)
+        v = self.get_node(outline, self.arg(op, 'gnx', str))
+        v.b = self.arg(op, 'b', str)
+        self.changed(batch, outline, [v])
+
+    def do_set_headline(self, op, batch):
+        '''Set the headline of a node.'''
+        outline = self.get_outline(op, batch)
+        v = self.get_node(outline, self.arg(op, 'gnx', str))
+        v.h = self.arg(op, 'h', str)
+        self.changed(batch, outline, [v])
+    #@+node:ekr.20180907210000.34: *4* server.do_subscribe & do_unsubscribe
+    def do_subscribe(self, op, batch):
+        '''Send events about changes of the outline. Return its generation.'''
+        outline = self.get_outline(op, batch)
+        outline.subscribers.add(batch.conn)
+        batch.conn.outlines.add(outline)
+        return outline.generation
+
+    def do_unsubscribe(self, op, batch):
+        '''Stop sending events about changes of the outline.'''
+        outline = self.get_outline(op, batch)
+        outline.subscribers.discard(batch.conn)
+        batch.conn.outlines.discard(outline)
+    #@+node:ekr.20180907210000.35: *4* server.do_write_at_file_nodes
+    def do_write_at_file_nodes(self, op, batch):
+        '''Write all dirty @<file> nodes, or all @<file> nodes.'''
+        outline = self.get_outline(op, batch)
+        c = outline.c
+        fc = c.fileCommands
+        if self.arg(op, 'all', bool, False):
+            p = c.p
+            for root in c.rootPosition().self_and_siblings():
+                c.selectPosition(root)
+                fc.writeAtFileNodes()
+            c.selectPosition(p)
+        else:
+            fc.writeDirtyAtFileNodes()
+    #@+node:ekr.20180907210000.36: *3* server.open_outline
+    def open_outline(self, path):
+        '''Open the outline at path, if it is not already open. Return its Outline.'''
+        name = self.bridge.completeFileName(path)
+        if not name:
+            raise ServerError('open: no path')
+        outline = self.outlines.get(name)
+        if not outline:
+            c = self.bridge.openLeoFile(name)
+            if not c:
+                raise ServerError('open: can not open %s' % name)
+            outline = self.outlines[name] = Outline(name, c)
+        return outline
+    #@-others
+#@+node:ekr.20180907210000.37: ** class Client
+class Client(object):
+    '''
+    A client of an OutlineServer, for scripts and tests.
+
+    Requests may overlap. client.events is an asyncio.Queue of the events
+    sent to subscribers.
+    '''
+    #@+others
+    #@+node:ekr.20180907210000.38: *3* client.__init__ & connect
+    def __init__(self, reader, writer):
+        '''Ctor for the Client class.'''
+        self.events = asyncio.Queue()
+        self.futures = {}
+            # Keys are request ids.
+        self.next_id = 0
+        self.reader = reader
+        self.writer = writer
+        self.task = asyncio.ensure_future(self.read_messages())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8371):
+        '''Connect to a server. Return a Client.'''
+        reader, writer = await asyncio.open_connection(host, port,
+            limit=max_line_length)
+        return cls(reader, writer)
+    #@+node:ekr.20180907210000.39: *3* client.close
+    def close(self):
+        '''Close the connection.'''
+        self.task.cancel()
+        self.writer.close()
+    #@+node:ekr.20180907210000.40: *3* client.read_messages
+    async def read_messages(self):
+        '''Read responses and events until the server closes the connection.'''
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line.decode('utf-8'))
+                if 'event' in message:
+                    self.events.put_nowait(message)
+                else:
+                    future = self.futures.pop(message.get('id'), None)
+                    if future and not future.done():
+                        future.set_result(message)
+        finally:
+            for future in self.futures.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection closed'))
+    #@+node:ekr.20180907210000.41: *3* client.request
+    async def request(self, ops, outline=None):
+        '''
+        Send a batch of operations. Return their results.
+        Raise ServerError if an operation fails.
+        '''
+        self.next_id += 1
+        request = {'id': self.next_id, 'ops': ops}
+        if outline:
+            request['outline'] = outline
+        future = self.futures[self.next_id] = asyncio.Future()
+        self.writer.write(encode(request))
+        await self.writer.drain()
+        response = await future
+        if 'error' in response:
+            raise ServerError('%s (operation %s)' % (
+                response['error'], response.get('index')))
+        return response['results']
+    #@-others
+#@+node:ekr.20180907210000.42: ** encode
+def encode(message):
+    '''Return a message (a dict) as a line of JSON.'''
+    s = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+    return (s + '\n').encode('utf-8')
+#@+node:ekr.20180907210000.43: ** open_bridge
+def open_bridge():
+    '''Open Leo bridge and return it.'''
+    print('opening leoBridge...')
+    return leoBridge.controller(
+        gui='nullGui',
+        loadPlugins=False,  # True: attempt to load plugins.
+        readSettings=False, # True: read standard settings files.
+        silent=True,        # True: don't print signon messages.
+        verbose=False,      # True: print informational messages.
+    )
+#@+node:ekr.20180907210000.44: ** main
+def main():
+    '''Serve outlines until interrupted.'''
+    parser = argparse.ArgumentParser(description='A headless server for Leo outlines.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8371)
+    parser.add_argument('paths', nargs='*', help='outlines to open')
+    args = parser.parse_args()
+    server = OutlineServer(open_bridge())
+    for path in args.paths:
+        server.open_outline(path)
+    loop = asyncio.get_event_loop()
+    aServer = loop.run_until_complete(server.start(args.host, args.port))
+    print('serving outlines at %s:%s' % (args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        print('Keyboard interrupt. Bye')
+    finally:
+        aServer.close()
+        loop.run_until_complete(aServer.wait_closed())
+#@-others
+if __name__ == '__main__':
+    main()
+#@@language python
+#@@tabwidth -4
+#@-leo
@@ -4296,7 +4296,7 @@ class HeadWrapper(leoFrame.StringTextWrapper):
         i = len(self.s)
         self.ins = i
         self.sel = i, i
-        self.p.v._headString = self.s
+        self.p.v.setHeadString(self.s)
     #@-others
 #@+node:ekr.20170525062512.1: *3* class LogWrapper (leoFrame.StringTextWrapper)
 class LogWrapper(leoFrame.StringTextWrapper):
@@ -71,6 +71,23 @@ Start clicking :-)
 You can use the browser's refresh button to update the top-level view in the
 browser after you have opened or closed files.
 
+The server remembers the html of each node, so it recomputes the html only
+for changed nodes. Each page has an ETag that changes whenever the outline
+changes. Clients that poll an outline should send the ETag in an
+If-None-Match header: the server answers 304 (Not Modified) if the outline
+has not changed.
+
+The following query parameters load large outlines lazily:
+
+``depth`` (optional)
+    Send only the given number of outline levels, e.g.
+    http://localhost:8130/LeoDocs.leo?depth=1. Clicking a node whose
+    children have not been sent loads them.
+
+``gnx`` (optional)
+    Send only the html of the subtree of the node with the given gnx, e.g.
+    http://localhost:8130/LeoDocs.leo?gnx=ekr.20040517080250.1&depth=1
+
 **Note**: IP address 127.0.0.1 is accessible by all users logged into your
 local machine. That means while Leo and mod_http is running anyone logged into
 your machine will be able to browse all your leo outlines and add bookmarks.
@@ -219,6 +236,7 @@ import leo.core.leoGlobals as g
 import asynchat
 import asyncore
 import cgi
+import collections
 import json
 if g.isPython3:
     import http.server
@@ -241,6 +259,7 @@ if g.isPython3:
 else:
     import urlparse
 import os
+import re
 import select
 import shutil
 import socket
@@ -254,6 +273,17 @@ browser_encoding = 'utf-8' # To do: Can we query the browser for this?
     # If it does not, non-ascii characters will look very strange.
 
 sockets_to_close = []
+
+etag_prefix = '%x' % int(time.time())
+    # Distinguishes the ETags of different Leo sessions.
+outline_caches = {}
+    # Keys are commanders, values are OutlineCaches.
+ticks = 0
+    # Incremented whenever the outline may have changed.
+    # The outline can not change while the server handles requests,
+    # except in LeoActions.
+leading_blanks_pattern = re.compile(r'^ +', re.MULTILINE)
+    # Used by escape.
 #@-<< data >>
 #@+others
 #@+node:ekr.20060830091349: ** init & helpers (mod_http.py)
@@ -272,6 +302,7 @@ def init():
                 return False
             asyncore.read = a_read
             g.registerHandler("idle", plugin_wrapper)
+            g.registerHandler("close-frame", onClose)
             g.es("http serving enabled at %s:%s" % (
                 config.http_ip, config.http_port), color="purple")
     g.plugin_signon(__name__)
@@ -299,10 +330,16 @@ def getGlobalConfiguration():
     new_rst2_http_attributename = g.app.config.getString("rst2_http_attributename")
     if new_rst2_http_attributename:
         config.rst2_http_attributename = new_rst2_http_attributename
+#@+node:ekr.20180907200000.1: *3* onClose
+def onClose(tag, keywords):
+    '''Forget the html of the closed outline.'''
+    c = keywords.get('c')
+    outline_caches.pop(c, None)
 #@+node:EKR.20040517080250.45: *3* plugin_wrapper
 def plugin_wrapper(tag, keywords):
     if g.app.killed:
         return
+    outline_changed() # Leo may have changed outlines since the last call.
     # first = True
     while loop(config.http_timeout):
         pass
@@ -357,6 +394,11 @@ class config(object):
     rst2_http_attributename = 'rst_http_attribute'
 #@+node:EKR.20040517080250.4: ** class delayedSocketStream
 class delayedSocketStream(asyncore.dispatcher_with_send):
+    '''
+    Collect the parts of a response, then send them in chunks of at most
+    chunk_size bytes, so a large page is never copied as a whole.
+    '''
+    chunk_size = 65536
     #@+others
     #@+node:EKR.20040517080250.5: *3* __init__
     def __init__(self, sock):
@@ -366,15 +408,17 @@ class delayedSocketStream(asyncore.dispatcher_with_send):
         self.socket.setblocking(0)
         self.closed = 1 # compatibility with SocketServer
         self.buffer = []
+        self.offset = 0
+            # The number of bytes of self.buffer[0] already in self.out_buffer.
+        self.out_buffer = b''
     #@+node:EKR.20040517080250.6: *3* write
     def write(self, data):
         self.buffer.append(data)
     #@+node:EKR.20040517080250.7: *3* initiate_sending
     def initiate_sending(self):
-        ### Create a bytes string.
-        aList = [g.toEncodedString(z) for z in self.buffer]
-        self.out_buffer = b''.join(aList)
-        del self.buffer
+        ### Create bytes strings.
+        self.buffer = collections.deque(g.toEncodedString(z) for z in self.buffer)
+        self.refill()
         self.set_socket(self.socket, None)
         self.socket.setblocking(0)
         self.connected = 1
@@ -386,8 +430,27 @@ class delayedSocketStream(asyncore.dispatcher_with_send):
     #@+node:EKR.20040517080250.8: *3* handle_read
     def handle_read(self):
         pass
+    #@+node:ekr.20180907200000.2: *3* refill
+    def refill(self):
+        '''Move up to chunk_size bytes from self.buffer to self.out_buffer.'''
+        n = len(self.out_buffer)
+        if n >= self.chunk_size or not self.buffer:
+            return
+        aList = [self.out_buffer]
+        while self.buffer and n < self.chunk_size:
+            s, i = self.buffer[0], self.offset
+            j = min(len(s), i + self.chunk_size - n)
+            aList.append(s[i:j])
+            n += j - i
+            if j == len(s):
+                self.buffer.popleft()
+                self.offset = 0
+            else:
+                self.offset = j
+        self.out_buffer = b''.join(aList)
     #@+node:EKR.20040517080250.9: *3* writable
     def writable(self):
+        self.refill()
         result = (not self.connected) or len(self.out_buffer)
         if not result:
             sockets_to_close.append(self)
@@ -413,9 +476,12 @@ class leo_interface(object):
          """
         try:
             # self.path is provided by the RequestHandler class.
-            path = self.split_leo_path(self.path)
+            parsed_url = urlparse.urlparse(self.path)
+            path = self.split_leo_path(parsed_url.path)
+            etag = None
             if path[0] == '_':
                 f = self.leo_actions.get_response()
+                outline_changed() # LeoActions may change outlines.
             elif len(path) == 1 and path[0] == 'favicon.ico':
                 f = self.leo_actions.get_favicon()
             elif path == '/':
@@ -429,8 +495,25 @@ class leo_interface(object):
                     if root is None:
                         self.send_error(404, "No root node")
                         return None
-                    f = StringIO()
-                    self.write_leo_tree(f, window, root)
+                    etag = get_outline_cache(window.c).etag()
+                    if self.etag_matches(etag):
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return None
+                    query = urlparse.parse_qs(parsed_url.query)
+                    depth = query.get('depth')
+                    try:
+                        depth = int(depth[0]) if depth else None
+                    except ValueError:
+                        self.send_error(400, "Bad depth")
+                        return None
+                    f = PageWriter()
+                    gnx = query.get('gnx')
+                    if gnx:
+                        self.write_subtree(f, window, gnx[0], depth)
+                    else:
+                        self.write_leo_tree(f, window, root, depth)
                 except nodeNotFound:
                     self.send_error(404, "Node not found")
                     return None
@@ -446,12 +529,23 @@ class leo_interface(object):
             self.send_response(200)
             self.send_header("Content-type", getattr(f, "mime_type", "text/html"))
             self.send_header("Content-Length", str(length))
+            if etag:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
             self.end_headers()
             return f
         except Exception:
             import traceback
             traceback.print_exc()
             raise
+    #@+node:ekr.20180907200000.3: *4* etag_matches
+    def etag_matches(self, etag):
+        '''Return True if the If-None-Match header of the request matches etag.'''
+        s = self.headers.get('If-None-Match')
+        if not s:
+            return False
+        tags = [z.strip() for z in s.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
     #@+node:EKR.20040517080250.26: *4* find_window_and_root
     def find_window_and_root(self, path):
         """
@@ -476,16 +570,26 @@ class leo_interface(object):
             path = path[1:]
         return path.split('/')
     #@+node:ekr.20161001114512.1: *4* write_leo_tree & helpers
-    def write_leo_tree(self, f, window, root):
-        '''Wriite the entire html file to f.'''
+    def write_leo_tree(self, f, window, root, depth=None):
+        '''
+        Wriite the entire html file to f, showing at most depth levels of
+        the outline.
+        '''
+        c = window.c
+        cache = get_outline_cache(c)
         root = root.copy()
         self.write_head(f, root.h, window)
         f.write('<body>')
         f.write('<div class="container">')
         f.write('<div class="outlinepane">')
         f.write('<h1>%s</h1>' % window.shortFileName())
-        for sib in root.self_and_siblings():
-            self.write_node_and_subtree(f, sib)
+        if depth is None and root == c.rootPosition():
+            # Use the html computed for the ETag.
+            cache.update()
+            f.write_parts(cache.parts, cache.length)
+        else:
+            for sib in root.self_and_siblings():
+                cache.write_subtree(f, sib.v, depth)
         f.write('</div>')
         f.write('</div>')
         self.write_body_pane(f, root)
@@ -522,22 +626,19 @@ class leo_interface(object):
         )
     #@+node:ekr.20161001122919.1: *5* write_node_and_subtree
     def write_node_and_subtree(self, f, p):
-
-        # This organization, with <headline> elements in <node> elements,
-        # allows proper highlighting of nodes.
-        f.write('<div class="node" id=n:%s>' % (
-            quoteattr(p.gnx),
-        ))
-        f.write('<div class="headline" id=h:%s expand="%s" icon="%02d" b=%s>%s</div>' % (
-            quoteattr(p.gnx),
-            '+' if p.hasChildren() else '-',
-            p.computeIcon(),
-            quoteattr(p.b),
-            escape(p.h),
-        ))
-        for child in p.children():
-            self.write_node_and_subtree(f, child)
-        f.write('</div>')
+        '''Write the html of p's subtree to f.'''
+        get_outline_cache(p.v.context).write_subtree(f, p.v)
+    #@+node:ekr.20180907200000.4: *5* write_subtree
+    def write_subtree(self, f, window, gnx, depth=None):
+        '''
+        Write the html of the subtree of the node with the given gnx to f,
+        at most depth levels deep.
+        '''
+        c = window.c
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v:
+            raise nodeNotFound
+        get_outline_cache(c).write_subtree(f, v, depth)
     #@+node:EKR.20040517080250.27: *4* write_leo_windowlist
     def write_leo_windowlist(self):
         f = StringIO()
@@ -972,6 +1073,153 @@ class noLeoNodePath(Exception):
     Most likely a reference to a picture.
     """
     pass
+#@+node:ekr.20180907200000.7: ** class OutlineCache
+class OutlineCache(object):
+    '''
+    The html of all nodes of one outline.
+
+    The html of each node is encoded once and reused until the node's
+    headline, body, icon or children change. As in fc.putVnode, the html
+    is valid only if v._headString and v._bodyString are the *same*
+    strings as when the html was computed.
+
+    The generation changes whenever the html of the outline changes.
+    ETags contain the generation.
+    '''
+    close = b'</div>'
+    #@+others
+    #@+node:ekr.20180907200000.8: *3* oc.__init__
+    def __init__(self, c):
+        '''Ctor for the OutlineCache class.'''
+        self.c = c
+        self.fragments = {}
+            # Keys are gnx's, values are (h, b, icon, expand, html).
+        self.generation = 0
+        self.length = 0
+            # The number of bytes in self.parts.
+        self.parts = []
+            # The html of all top-level nodes and their subtrees.
+        self.tick = None
+            # The value of ticks when self.parts was computed.
+    #@+node:ekr.20180907200000.9: *3* oc.etag
+    def etag(self):
+        '''Return the ETag of the outline's html.'''
+        self.update()
+        return '"%s-%s"' % (etag_prefix, self.generation)
+    #@+node:ekr.20180907200000.10: *3* oc.fragment
+    def fragment(self, v):
+        '''Return the encoded html that starts the div of v's node.'''
+        h, b = v._headString, v._bodyString
+        icon, expand = v.computeIcon(), '+' if v.children else '-'
+        data = self.fragments.get(v.gnx)
+        if (data and data[0] is h and data[1] is b and
+            data[2] == icon and data[3] == expand
+        ):
+            return data[4]
+        # This organization, with <headline> elements in <node> elements,
+        # allows proper highlighting of nodes.
+        s = (
+            '<div class="node" id=n:%s>'
+            '<div class="headline" id=h:%s expand="%s" icon="%02d" b=%s>%s</div>'
+        ) % (
+            quoteattr(v.gnx),
+            quoteattr(v.gnx),
+            expand,
+            icon,
+            quoteattr(v.b),
+            escape(v.h),
+        )
+        s = g.toEncodedString(s, browser_encoding)
+        self.fragments[v.gnx] = h, b, icon, expand, s
+        return s
+    #@+node:ekr.20180907200000.11: *3* oc.put_subtree
+    def put_subtree(self, v, parts, depth=None):
+        '''
+        Append the html of v and its descendants to parts,
+        at most depth levels deep.
+        '''
+        close, fragment = self.close, self.fragment
+        stack = [(v, 1)]
+        while stack:
+            v, level = stack.pop()
+            if v is None:
+                parts.append(close)
+                continue
+            parts.append(fragment(v))
+            stack.append((None, level))
+            if v.children and (depth is None or level < depth):
+                stack.extend((child, level + 1) for child in reversed(v.children))
+    #@+node:ekr.20180907200000.12: *3* oc.update
+    def update(self):
+        '''
+        Recompute the html of the outline, at most once per tick.
+        Increment the generation if the html has changed.
+        '''
+        if self.tick == ticks:
+            return
+        self.tick = ticks
+        parts = []
+        for v in self.c.hiddenRootNode.children:
+            self.put_subtree(v, parts)
+        if parts != self.parts:
+            self.generation += 1
+            self.length = sum(len(z) for z in parts)
+            self.parts = parts
+        # Forget the html of deleted nodes.
+        if len(self.fragments) > len(parts) // 2:
+            gnxs = set(v.gnx for v in self.c.all_unique_nodes())
+            for gnx in list(self.fragments):
+                if gnx not in gnxs:
+                    del self.fragments[gnx]
+    #@+node:ekr.20180907200000.13: *3* oc.write_subtree
+    def write_subtree(self, f, v, depth=None):
+        '''Write the html of v's subtree, at most depth levels deep, to f.'''
+        parts = []
+        self.put_subtree(v, parts, depth)
+        if isinstance(f, PageWriter):
+            f.write_parts(parts, sum(len(z) for z in parts))
+        else:
+            for s in parts:
+                f.write(g.toUnicode(s, browser_encoding))
+    #@-others
+#@+node:ekr.20180907200000.14: ** class PageWriter
+class PageWriter(object):
+    '''
+    A file-like object holding the encoded parts of an html page.
+    RequestHandler.copyfile sends the parts without joining them.
+    '''
+    mime_type = 'text/html'
+    #@+others
+    #@+node:ekr.20180907200000.15: *3* pw.__init__
+    def __init__(self):
+        '''Ctor for the PageWriter class.'''
+        self.length = 0
+            # The number of bytes in self.parts.
+        self.parts = []
+    #@+node:ekr.20180907200000.16: *3* pw.file-like methods
+    def close(self):
+        pass
+
+    def seek(self, pos):
+        pass
+
+    def tell(self):
+        return self.length
+
+    def write(self, s):
+        s = g.toEncodedString(s, browser_encoding)
+        self.parts.append(s)
+        self.length += len(s)
+    #@+node:ekr.20180907200000.17: *3* pw.getvalue & write_parts
+    def getvalue(self):
+        '''Return the encoded page.'''
+        return b''.join(self.parts)
+
+    def write_parts(self, parts, length):
+        '''Append encoded parts containing length bytes.'''
+        self.parts.extend(parts)
+        self.length += length
+    #@-others
 #@+node:EKR.20040517080250.13: ** class RequestHandler
 class RequestHandler(
     leo_interface,
@@ -1012,7 +1260,11 @@ class RequestHandler(
         -- note however that this the default server uses this
         to copy binary data as well.
          """
-        shutil.copyfileobj(source, outputfile, length=255)
+        if isinstance(source, PageWriter):
+            # Send the encoded parts of the page without copying them.
+            outputfile.buffer.extend(source.parts)
+        else:
+            shutil.copyfileobj(source, outputfile, length=255)
     #@+node:EKR.20040517080250.16: *3* log_message
     def log_message(self, format, *args):
         """Log an arbitrary message.
@@ -1069,7 +1321,7 @@ class RequestHandler(
             query = cgi.parse_multipart(self.rfile, pdict)
         elif ctype == 'application/x-www-form-urlencoded':
             qs = self.rfile.read(length)
-            query = cgi.parse_qs(qs, keep_blank_values=1)
+            query = urlparse.parse_qs(qs, keep_blank_values=1)
         else:
             query = '' # Unknown content-type
         # some browsers send 2 more bytes...
@@ -1115,7 +1367,7 @@ class RequestHandler(
         if self.path.find('?') >= 0:
             self.qs = self.path[self.path.find('?') + 1:]
             self.path_without_qs = self.path[: self.path.find('?')]
-        self.QUERY = self.query(cgi.parse_qs(self.qs, 1))
+        self.QUERY = self.query(urlparse.parse_qs(self.qs, 1))
         if self.command in ['GET', 'HEAD']:
             # if method is GET or HEAD, call do_GET or do_HEAD and finish
             method = "do_" + self.command
@@ -1185,35 +1437,21 @@ def escape(s):
     s = s.replace('&', "&amp;")
     s = s.replace('<', "&lt;")
     s = s.replace('>', "&gt;")
-    # is there a more elegant way to do this?
-    # Replaces blanks with &nbsp; id they are in
-    # the beginning of the line.
-    lines = s.split('\n')
-    result = []
-    blank = chr(32)
-    for line in lines:
-        if line.startswith(blank):
-            resultchars = []
-            startline = True
-            for char in line:
-                if char == blank:
-                    if startline:
-                        resultchars.append('&nbsp;')
-                    else:
-                        resultchars.append(' ')
-                else:
-                    startline = False
-                    resultchars.append(char)
-            result.append(''.join(resultchars))
-        else:
-            result.append(line)
-    s = '\n'.join(result)
+    # Replace blanks with &nbsp; if they are at the start of a line.
+    s = leading_blanks_pattern.sub(lambda m: '&nbsp;' * len(m.group(0)), s)
     s = s.replace('\n', '<br />')
     s = s.replace(chr(9), '&nbsp;&nbsp;&nbsp;&nbsp;')
     # 8/9/2007
     # s = g.toEncodedString(s,encoding=browser_encoding,reportErrors=False)
     # StringIO.write(self, s)
     return s
+#@+node:ekr.20180907200000.5: *3* get_outline_cache
+def get_outline_cache(c):
+    '''Return the OutlineCache for c.'''
+    cache = outline_caches.get(c)
+    if cache is None:
+        cache = outline_caches[c] = OutlineCache(c)
+    return cache
 #@+node:EKR.20040517080250.44: *3* loop (asynchore override)
 def loop(timeout=5.0, use_poll=0, map=None):
     """
@@ -1228,6 +1466,11 @@ def node_reference(vnode):
     Use by the rst3 plugin.
     """
     return leo_interface().node_reference(vnode)
+#@+node:ekr.20180907200000.6: *3* outline_changed
+def outline_changed():
+    '''Tell all OutlineCaches that outlines may have changed.'''
+    global ticks
+    ticks += 1
 #@+node:EKR.20040517080250.40: *3* poll
 def poll(timeout=0.0):
     global sockets_to_close
@@ -576,11 +576,11 @@ class QuickSearchController(object):
             flags = 0
         combo = self.widgetUI.comboBox.currentText()
         if combo == "All":
-            hNodes = self.c.all_positions()
-            bNodes = self.c.all_positions()
+            hNodes = self.indexedPositions(hpat, flags)
+            bNodes = self.indexedPositions(bpat, flags)
         elif combo == "Subtree":
-            hNodes = self.c.p.self_and_subtree()
-            bNodes = self.c.p.self_and_subtree()
+            hNodes = self.indexedPositions(hpat, flags, self.c.p)
+            bNodes = self.indexedPositions(bpat, flags, self.c.p)
         elif combo == "File":
             found = False
             node = self.c.p
@@ -667,9 +667,9 @@ class QuickSearchController(object):
             flags = 0
         combo = self.widgetUI.comboBox.currentText()
         if combo == "All":
-            hNodes = self.c.all_positions()
+            hNodes = self.indexedPositions(hpat, flags)
         elif combo == "Subtree":
-            hNodes = self.c.p.self_and_subtree()
+            hNodes = self.indexedPositions(hpat, flags, self.c.p)
         else:
             hNodes = [self.c.p]
         hm = self.find_h(hpat, hNodes, flags)
@@ -678,6 +678,21 @@ class QuickSearchController(object):
         # self.addBodyMatches(bm)
         return hm, []
         # self.lw.insertItem(0, "%d hits"%self.lw.count())
+    #@+node:ekr.20180907090145.17: *3* indexedPositions
+    def indexedPositions(self, regex, flags, p=None):
+        '''
+        Return an iterator over all positions of p's subtree (or the entire
+        outline) that might match the regex, along with their ancestors.
+        '''
+        c = self.c
+        index = c.findCommands.searchIndex
+        tree = index.searchTree(regex, regex=True, flags=flags)
+        if tree is not None:
+            return index.positions(tree, p)
+        elif p:
+            return p.self_and_subtree()
+        else:
+            return c.all_positions()
     #@+node:jlunz.20150826091415.1: *3* find_h
     def find_h(self, regex, nodes, flags=re.IGNORECASE):
         """ Return list (a PosList) of all nodes where zero or more characters at
@@ -59,6 +59,10 @@ viewrendered.py creates the following (``Alt-X``) commands:
 ``vr-show``
     Makes the rendering pane visible.
 
+``vr-stats``
+    Prints the hit rate of the rendering cache and the time taken by recent
+    renderings of reStructuredText and markdown.
+
 ``vr-toggle``
     Shows the rendering pane if invisible, otherwise hides it.
 
@@ -170,6 +174,10 @@ Settings
   Suitable extensions can be seen here:
   http://pythonhosted.org/Markdown/extensions/index.html
 
+- ``@int view-rendered-workers = 1``
+  The number of worker processes that render reStructuredText and markdown.
+  Zero: render in Leo's own process.
+
 Acknowledgments
 ================
 
@@ -203,6 +211,7 @@ trace = False
 import leo.core.leoGlobals as g
 import leo.plugins.qt_text as qt_text
 import leo.plugins.free_layout as free_layout
+import leo.plugins.vr_render as vr_render
 from leo.core.leoQt import isQt5, QtCore, QtGui, QtWidgets
 from leo.core.leoQt import phonon, QtMultimedia, QtSvg, QtWebKitWidgets
 try:
@@ -212,8 +221,8 @@ except ImportError:
     docutils = None
 if docutils:
     try:
-        from docutils.core import publish_string
-        from docutils.utils import SystemMessage
+        # vr_render.py renders rST with these modules.
+        import docutils.utils
         got_docutils = True
     except ImportError:
         got_docutils = False
@@ -225,7 +234,8 @@ else:
     got_docutils = False
 # markdown support, non-vital
 try:
-    from markdown import markdown
+    import markdown
+    assert markdown # for pyflakes.
     got_markdown = True
 except ImportError:
     got_markdown = False
@@ -483,6 +493,17 @@ def show_rendering_pane(event):
             pass # hide_rendering_pane(event)
         else:
             viewrendered(event)
+#@+node:ekr.20180907190000.14: *3* g.command('vr-stats')
+@g.command('vr-stats')
+def show_rendering_stats(event):
+    '''Print statistics about rendering reStructuredText and markdown.'''
+    c = event.get('c')
+    if c:
+        vr = controllers.get(c.hash())
+        if vr:
+            g.es_print(vr.render_queue.stats())
+        else:
+            g.es_print('no rendering pane')
 #@+node:ekr.20131001100335.16606: *3* g.command('vr-toggle')
 @g.command('vr-toggle')
 def toggle_rendering_pane(event):
@@ -599,6 +620,10 @@ if QtWidgets: # NOQA
             self.length = 0 # The length of previous p.b.
             self.locked = False
             self.pyplot_active = False
+            self.render_queue = vr_render.RenderQueue()
+                # Renders rST and markdown, in a worker process if possible.
+            self.render_timer = None
+                # A QTimer that calls vr.on_render_timer while rendering.
             self.scrollbar_pos_dict = {} # Keys are vnodes, values are positions.
             self.sizes = [] # Saved splitter sizes.
             self.splitter = None
@@ -644,6 +669,8 @@ if QtWidgets: # NOQA
             # self.auto_hide    = c.config.getBool('view-rendered-auto-hide',False)
             self.background_color = c.config.getColor('rendering-pane-background-color') or 'white'
             self.default_kind = c.config.getString('view-rendered-default-kind') or 'rst'
+            n = c.config.getInt('view-rendered-workers')
+            self.render_queue.workers = 1 if n is None else n
         #@+node:tbrown.20110621120042.22676: *3* vr.closeEvent
         def closeEvent(self, event):
             '''Close the vr window.'''
@@ -685,6 +712,9 @@ if QtWidgets: # NOQA
             g.unregisterHandler('select2', pc.update)
             g.unregisterHandler('idle', pc.update)
             pc.active = False
+            pc.render_queue.close()
+            if pc.render_timer:
+                pc.render_timer.stop()
         #@+node:ekr.20110321072702.14508: *3* vr.lock/unlock
         def lock(self):
             '''Lock the vr pane.'''
@@ -744,6 +774,8 @@ if QtWidgets: # NOQA
                 if not f:
                     g.trace('no handler for kind: %s' % kind)
                     f = pc.update_rst
+                # Never show the html of previous requests.
+                pc.render_queue.forget()
                 f(s, keywords)
             else:
                 # Save the scroll position.
@@ -1005,33 +1037,21 @@ if QtWidgets: # NOQA
                 if force or language in ('rst', 'rest', 'markdown', 'md'):
                     if not isHtml:
                         s = self.convert_to_markdown(s)
-                self.set_html(s,w)
+                if s is not None:
+                    self.set_html(s,w)
             else:
                 g.trace('markdown not available: using rst')
                 self.update_rst(s,keywords)
         #@+node:ekr.20160921134552.1: *5* convert_to_markdown
         def convert_to_markdown(self, s):
-            '''Convert s to html using the markdown processor.'''
-            pc = self
-            c, p = pc.c, pc.c.p
-            path = g.scanAllAtPathDirectives(c, p) or c.getNodePath(p)
-            if not os.path.isdir(path):
-                path = os.path.dirname(path)
-            if os.path.isdir(path):
-                os.chdir(path)
-            try:
-                if pc.title:
-                    s = pc.underline(pc.title) + s
-                    pc.title = None
-                mdext = c.config.getString('view-rendered-md-extensions') or 'extra'
-                mdext = [x.strip() for x in mdext.split(',')]
-                s = markdown(s, mdext)
-                s = g.toUnicode(s)
-            except SystemMessage as sm:
-                msg = sm.args[0]
-                if 'SEVERE' in msg or 'FATAL' in msg:
-                    s = 'MD error:\n%s\n\n%s' % (msg, s)
-            return s
+            '''
+            Convert s to html using the markdown processor.
+            Return None if vr.on_render_timer will show the html.
+            '''
+            c = self.c
+            mdext = c.config.getString('view-rendered-md-extensions') or 'extra'
+            mdext = [x.strip() for x in mdext.split(',')]
+            return self.render('md', s, mdext)
         #@+node:ekr.20110320120020.14481: *4* vr.update_movie
         movie_warning = False
 
@@ -1159,12 +1179,32 @@ if QtWidgets: # NOQA
                     # force or language in ('rst', 'rest', 'markdown', 'md'):
                 if not isHtml:
                     s = pc.convert_to_html(s)
-                pc.set_html(s, w)
+                if s is not None:
+                    pc.set_html(s, w)
             else:
                 w.setPlainText(s)
         #@+node:ekr.20160920221324.1: *5* vr.convert_to_html
         def convert_to_html(self, s):
-            '''Convert s to html using docutils.'''
+            '''
+            Convert s to html using docutils.
+            Return None if vr.on_render_timer will show the html.
+            '''
+            return self.render('rst', s)
+        #@+node:ekr.20180907190000.15: *5* vr.on_render_timer
+        def on_render_timer(self):
+            '''Show the html of the latest request when it is ready.'''
+            pc = self
+            s = pc.render_queue.poll()
+            if s is not None and pc.w.__class__ == QtWidgets.QTextBrowser:
+                pc.set_html(s, pc.w)
+            if not pc.render_queue.busy():
+                pc.render_timer.stop()
+        #@+node:ekr.20180907190000.16: *5* vr.render
+        def render(self, kind, s, extensions=None):
+            '''
+            Convert s to html using the render queue. kind is 'md' or 'rst'.
+            Return None if vr.on_render_timer will show the html.
+            '''
             c, p = self.c, self.c.p
             # Update the current path.
             path = g.scanAllAtPathDirectives(c, p) or c.getNodePath(p)
@@ -1172,17 +1212,15 @@ if QtWidgets: # NOQA
                 path = os.path.dirname(path)
             if os.path.isdir(path):
                 os.chdir(path)
-            try:
-                if self.title:
-                    s = self.underline(self.title) + s
-                    self.title = None
-                # Call docutils to get the string.
-                s = publish_string(s, writer_name='html')
-                s = g.toUnicode(s)
-            except SystemMessage as sm:
-                msg = sm.args[0]
-                if 'SEVERE' in msg or 'FATAL' in msg:
-                    s = 'RST error:\n%s\n\n%s' % (msg, s)
+            if self.title:
+                s = self.underline(self.title) + s
+                self.title = None
+            s = self.render_queue.request(kind, s, path, extensions)
+            if s is None:
+                if not self.render_timer:
+                    self.render_timer = QtCore.QTimer()
+                    self.render_timer.timeout.connect(self.on_render_timer)
+                self.render_timer.start(20)
             return s
         #@+node:ekr.20110320120020.14479: *4* vr.update_svg
         # http://doc.trolltech.com/4.4/qtsvg.html
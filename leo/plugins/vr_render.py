@@ -0,0 +1,231 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907190000.1: * @file vr_render.py
+'''
+    A helper for the viewrendered plugin.
+    This is *NOT* a real plugin.
+
+    The RenderQueue class renders rST and markdown text to html in a worker
+    process and caches the results. This module does not use Qt, so worker
+    processes can import it quickly.
+'''
+#@+<< vr_render imports >>
+#@+node:ekr.20180907190000.2: ** << vr_render imports >>
+import leo.core.leoGlobals as g
+import collections
+import hashlib
+import os
+import time
+#@-<< vr_render imports >>
+#@+others
+#@+node:ekr.20180907190000.24: ** init
+def init():
+    '''Return True if the plugin has loaded successfully.'''
+    g.trace('vr_render.py is not a plugin.')
+    return False
+#@+node:ekr.20180907190000.3: ** class RenderQueue
+class RenderQueue(object):
+    '''
+    Render rST and markdown text to html, in a worker process if possible.
+
+    rq.request(kind, s, path, extensions) returns the html for s at once if
+    it is in the cache. Otherwise it starts to render s and returns None.
+    The caller must then call rq.poll() until rq.busy() is False. rq.poll()
+    returns the html of the latest request once it is ready.
+
+    The cache holds the html of the last max_cache_entries renderings. Keys
+    are (kind, md5 digest of s, path, extensions).
+
+    At most one rendering runs at a time. A newer request replaces (cancels)
+    a request that has not yet started. rq.poll() never returns the html of
+    a request that a newer request superseded, but the cache keeps it.
+    '''
+    #@+others
+    #@+node:ekr.20180907190000.4: *3* rq.__init__
+    def __init__(self, workers=1, max_cache_entries=100):
+        '''Ctor for the RenderQueue class.'''
+        self.cache = collections.OrderedDict()
+            # Keys are (kind, digest, path, extensions), values are html.
+        self.job = None
+            # The request being rendered in the pool.
+        self.latest = None
+            # The request whose html poll must return.
+        self.max_cache_entries = max_cache_entries
+        self.pending = None
+            # The newest request waiting for the pool.
+        self.pool = None
+        self.workers = workers
+            # Zero: render in Leo's own process.
+        # Statistics.
+        self.cancelled = 0
+        self.hits = 0
+        self.latencies = []
+            # Seconds from request to result, for the last 100 renderings.
+        self.misses = 0
+        self.render_times = []
+            # Seconds spent rendering, for the last 100 renderings.
+    #@+node:ekr.20180907190000.5: *3* rq.busy
+    def busy(self):
+        '''Return True if a rendering is running.'''
+        return self.job is not None
+    #@+node:ekr.20180907190000.6: *3* rq.close
+    def close(self):
+        '''Forget all requests and stop the worker process.'''
+        self.forget()
+        self.job = None
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+    #@+node:ekr.20180907190000.7: *3* rq.finish
+    def finish(self, request, result):
+        '''Cache the result of render_worker. Return the html.'''
+        html, seconds = result
+        self.cache[request.key] = html
+        while len(self.cache) > self.max_cache_entries:
+            self.cache.popitem(last=False)
+        for aList, value in (
+            (self.latencies, time.time() - request.t1),
+            (self.render_times, seconds),
+        ):
+            aList.append(value)
+            del aList[:-100]
+        return html
+    #@+node:ekr.20180907190000.8: *3* rq.forget
+    def forget(self):
+        '''Cancel the pending request. poll will return no html.'''
+        if self.pending:
+            self.cancelled += 1
+            self.pending = None
+        self.latest = None
+    #@+node:ekr.20180907190000.9: *3* rq.poll
+    def poll(self):
+        '''
+        Start the pending request when the running rendering finishes.
+        Return the html of the latest request if it has just become
+        ready, and None otherwise.
+        '''
+        job = self.job
+        if not job or not job.result.ready():
+            return None
+        self.job = None
+        try:
+            html = self.finish(job, job.result.get())
+        except Exception:
+            g.es_exception()
+            html = None
+        if self.pending:
+            request, self.pending = self.pending, None
+            if not self.start(request):
+                html = self.finish(request, render_worker(request.aTuple))
+                job = request
+        return html if job is self.latest else None
+    #@+node:ekr.20180907190000.10: *3* rq.request
+    def request(self, kind, s, path, extensions=None):
+        '''
+        Request the html for s. kind is 'md' or 'rst'.
+        Return the html if it is ready now. Otherwise return None, and
+        poll will return the html later.
+        '''
+        extensions = tuple(extensions or [])
+        digest = hashlib.md5(g.toEncodedString(s)).hexdigest()
+        key = (kind, digest, path, extensions)
+        html = self.cache.get(key)
+        if html is not None:
+            self.hits += 1
+            del self.cache[key]
+            self.cache[key] = html # Make key the most recently used key.
+            self.forget()
+            return html
+        self.misses += 1
+        job = self.job
+        if job and job.key == key:
+            # s is being rendered.
+            self.forget()
+            self.latest = job
+            return None
+        request = g.Bunch(key=key, aTuple=(kind, s, path, extensions), t1=time.time())
+        self.forget()
+        self.latest = request
+        if job:
+            self.pending = request
+            return None
+        if self.start(request):
+            return None
+        return self.finish(request, render_worker(request.aTuple))
+    #@+node:ekr.20180907190000.11: *3* rq.start
+    def start(self, request):
+        '''
+        Start rendering the request in the worker process, if possible.
+        Return True if poll will return the html.
+        '''
+        if self.workers < 1 or g.unitTesting:
+            return False
+        try:
+            if not self.pool:
+                import multiprocessing
+                self.pool = multiprocessing.Pool(self.workers)
+            request.result = self.pool.apply_async(render_worker, (request.aTuple,))
+        except Exception:
+            g.es_exception()
+            g.es_print('rendering in this process')
+            self.workers = 0
+            return False
+        self.job = request
+        return True
+    #@+node:ekr.20180907190000.12: *3* rq.stats
+    def stats(self):
+        '''Return a string describing the statistics of the queue.'''
+        n = self.hits + self.misses
+        result = [
+            'cache: %s entries, %s hits, %s misses, hit rate %2.0f%%' % (
+                len(self.cache), self.hits, self.misses,
+                100.0 * self.hits / n if n else 0.0),
+            'requests cancelled: %s' % self.cancelled,
+            'worker processes: %s%s' % (self.workers,
+                ' (rendering)' if self.busy() else ''),
+        ]
+        for name, aList in (
+            ('latency', self.latencies),
+            ('render time', self.render_times),
+        ):
+            if aList:
+                result.append('%s of last %s renderings: %4.3f sec. average, %4.3f sec. max' % (
+                    name, len(aList), sum(aList) / len(aList), max(aList)))
+        return '\n'.join(result)
+    #@-others
+#@+node:ekr.20180907190000.13: ** function: render_worker
+def render_worker(aTuple):
+    '''
+    Render rST or markdown text to html, in a worker process or in Leo's
+    own process.
+
+    aTuple is (kind, s, path, extensions). kind is 'md' or 'rst'. path is
+    the directory of the node, so relative paths work in rST directives.
+    Return (html, seconds).
+    '''
+    kind, s, path, extensions = aTuple
+    t1 = time.time()
+    if path and os.path.isdir(path):
+        os.chdir(path)
+    try:
+        from docutils.utils import SystemMessage
+    except ImportError:
+        SystemMessage = None
+    try:
+        if kind == 'md':
+            from markdown import markdown
+            s = markdown(s, extensions=list(extensions))
+        else:
+            from docutils.core import publish_string
+            s = publish_string(s, writer_name='html')
+        s = g.toUnicode(s)
+    except Exception as e:
+        if SystemMessage is None or not isinstance(e, SystemMessage):
+            raise
+        msg = e.args[0]
+        if 'SEVERE' in msg or 'FATAL' in msg:
+            s = '%s error:\n%s\n\n%s' % ('MD' if kind == 'md' else 'RST', msg, s)
+    return s, time.time() - t1
+#@-others
+#@@language python
+#@@tabwidth -4
+#@-leo
@@ -0,0 +1,218 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907210000.46: * @file ../test/bench-apiserver.py
+'''
+Benchmark the headless outline server in leo/external/leoserver/apiserver.py.
+
+Creates an outline with n_files @file nodes and n_nodes nodes in a
+temporary directory and serves it on a free port. Reports the time of
+n_ops set_body operations sent one per request and in one batch. Then
+n_clients client processes read nodes while another client changes nodes
+and a subscriber receives events. Reports the requests per second of the
+readers and the writer, and checks that the events report exactly the
+changed nodes. Finally checks that inserts, moves and deletes change the
+outline as expected, that bad operations fail without changing it, and
+that the saved outline and the written @file nodes contain all changes.
+
+Usage: python bench-apiserver.py [n_clients]
+'''
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+n_files = 50
+n_nodes = 10000
+n_ops = 2000            # Number of set_body operations.
+n_reads = 500           # Number of requests per reading client.
+n_batch = 10            # Number of operations per reading and writing request.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.external.leoserver.apiserver as apiserver
+
+#@+others
+#@+node:ekr.20180907210000.47: ** make_outline
+def make_outline(c):
+    '''
+    Create n_files @file nodes with n_nodes nodes in all.
+    Return the gnxs of the children of the @file nodes.
+    '''
+    root = c.rootPosition()
+    root.h = 'files'
+    for i in range(n_files):
+        p = root.insertAsLastChild()
+        p.h, p.b = '@file file%s.py' % i, '@others\n'
+        for j in range(n_nodes // n_files - 1):
+            child = p.insertAsLastChild()
+            child.h = 'def f%s' % j
+            child.b = 'def f%s():\n    return %s\n' % (j, j)
+    return [v.gnx for v in c.all_unique_nodes() if not v.children]
+#@+node:ekr.20180907210000.48: ** read_worker
+def read_worker(aTuple):
+    '''Send n_reads requests, each getting n_batch nodes. Return seconds.'''
+    port, outline, gnxs = aTuple
+    random.seed(os.getpid())
+
+    async def read():
+        client = await apiserver.Client.connect(port=port)
+        t1 = time.time()
+        for i in range(n_reads):
+            ops = [{'op': 'get_nodes', 'gnxs': random.sample(gnxs, n_batch)}]
+            results = await client.request(ops, outline)
+            assert len(results[0]) == n_batch
+        t2 = time.time()
+        client.close()
+        return t2 - t1
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(read())
+    finally:
+        loop.close()
+#@+node:ekr.20180907210000.49: ** round_trips
+async def round_trips(client, outline, gnxs):
+    '''Set n_ops bodies, one per request, then in one batch. Return seconds.'''
+    sample = random.sample(gnxs, n_ops)
+    t1 = time.time()
+    for gnx in sample:
+        await client.request([{'op': 'set_body', 'gnx': gnx, 'b': 'one = 1\n'}], outline)
+    t2 = time.time()
+    results = await client.request([{'op': 'set_body', 'gnx': gnx, 'b': 'batch = 1\n'}
+        for gnx in sample], outline)
+    t3 = time.time()
+    assert results == [None] * n_ops
+    return t2 - t1, t3 - t2
+#@+node:ekr.20180907210000.50: ** read_and_write
+async def read_and_write(pool, port, client, outline, gnxs):
+    '''
+    Change nodes while n_clients processes read nodes.
+    Return (reads/sec, writes/sec).
+    '''
+    loop = asyncio.get_event_loop()
+    subscriber = await apiserver.Client.connect(port=port)
+    await subscriber.request([{'op': 'subscribe'}], outline)
+    readers = loop.run_in_executor(None, pool.map, read_worker,
+        [(port, outline, gnxs)] * n_clients)
+    changed, writes, i = set(), 0, 0
+    t1 = time.time()
+    while not readers.done():
+        sample = random.sample(gnxs, n_batch)
+        await client.request([{'op': 'set_body', 'gnx': gnx, 'b': 'write = %s\n' % i}
+            for gnx in sample], outline)
+        changed.update(sample)
+        writes += 1
+        i += 1
+    t2 = time.time()
+    seconds = await readers
+    # Check the events.
+    generation = (await client.request([{'op': 'subscribe'}], outline))[0]
+    events, reported = 0, set()
+    while True:
+        event = await subscriber.events.get()
+        events += 1
+        reported.update(event['changed'])
+        assert not event['deleted']
+        if event['generation'] == generation:
+            break
+    assert reported == changed, (len(reported), len(changed))
+    subscriber.close()
+    print('%s writing requests, %s events' % (writes, events))
+    return n_clients * n_reads / max(seconds), writes / (t2 - t1)
+#@+node:ekr.20180907210000.51: ** check_structure
+async def check_structure(client, outline, c, directory):
+    '''Insert, move, delete, save and write @file nodes. Check the results.'''
+    root = c.hiddenRootNode.gnx
+    files = c.rootPosition().v
+    file0, file1 = files.children[0], files.children[1]
+    moved, deleted = file0.children[0], file0.children[1]
+    results = await client.request([
+        {'op': 'insert', 'parent': file1.gnx, 'index': 0, 'h': 'def inserted', 'b': 'inserted = 1\n'},
+        {'op': 'move', 'gnx': moved.gnx, 'parent': file1.gnx},
+        {'op': 'delete', 'gnx': deleted.gnx},
+        {'op': 'get_subtree', 'gnx': file1.gnx, 'depth': 1, 'bodies': False},
+    ], outline)
+    inserted = results[0]
+    nodes = results[3]
+    assert nodes[0]['gnx'] == file1.gnx and 'b' not in nodes[0]
+    assert nodes[1]['gnx'] == inserted and nodes[-1]['gnx'] == moved.gnx
+    assert [z['gnx'] for z in nodes[1:]] == nodes[0]['children']
+    assert deleted.gnx not in [z.gnx for z in file0.children]
+    # Bad operations.
+    for op in (
+        {'op': 'move', 'gnx': files.gnx, 'parent': file1.gnx},
+        {'op': 'move', 'gnx': moved.gnx, 'parent': file0.gnx, 'index': 1000},
+        {'op': 'delete', 'gnx': files.gnx},
+        {'op': 'set_body', 'gnx': deleted.gnx, 'b': ''},
+        {'op': 'set_body', 'gnx': moved.gnx, 'b': 1},
+        {'op': 'get_nodes', 'gnxs': [1]},
+        {'op': 'no_such_op'},
+    ):
+        try:
+            await client.request([{'op': 'get_nodes', 'gnxs': [root]}, op], outline)
+            assert False, op
+        except apiserver.ServerError as e:
+            assert '(operation 1)' in str(e), e
+    assert moved in file1.children and files.parents == [c.hiddenRootNode]
+    # Save and write.
+    t1 = time.time()
+    fn = (await client.request([{'op': 'save'}], outline))[0]
+    t2 = time.time()
+    await client.request([{'op': 'write_at_file_nodes'}], outline)
+    t3 = time.time()
+    assert fn == outline and not c.changed
+    s1 = open(os.path.join(directory, 'file1.py')).read()
+    assert 'inserted = 1' in s1 and '#@+node:%s:' % moved.gnx in s1
+    s0 = open(os.path.join(directory, 'file0.py')).read()
+    for v in (moved, deleted):
+        assert '#@+node:%s:' % v.gnx not in s0, v.gnx
+    return t2 - t1, t3 - t2
+#@+node:ekr.20180907210000.52: ** main
+def main():
+    random.seed(1)
+    pool = multiprocessing.Pool(n_clients)
+        # Fork the clients before the server starts.
+    directory = tempfile.mkdtemp(prefix='bench-apiserver')
+    loop = asyncio.get_event_loop()
+    try:
+        server = apiserver.OutlineServer(bridge)
+        outline = server.open_outline(os.path.join(directory, 'bench.leo'))
+        c = outline.c
+        gnxs = make_outline(c)
+        aServer = loop.run_until_complete(server.start(port=0))
+        port = aServer.sockets[0].getsockname()[1]
+        print('%s nodes, %s reading clients' % (n_nodes, n_clients))
+
+        async def run():
+            client = await apiserver.Client.connect(port=port)
+            t_one, t_batch = await round_trips(client, outline.name, gnxs)
+            print('%-32s %8.3f sec' % ('%s requests' % n_ops, t_one))
+            print('%-32s %8.3f sec' % ('1 request, %s operations' % n_ops, t_batch))
+            reads, writes = await read_and_write(pool, port, client, outline.name, gnxs)
+            print('%-32s %8.1f requests/sec' % ('reads, %s gnxs each' % n_batch, reads))
+            print('%-32s %8.1f requests/sec' % ('writes, %s bodies each' % n_batch, writes))
+            t_save, t_write = await check_structure(client, outline.name, c, directory)
+            print('%-32s %8.3f sec' % ('save', t_save))
+            print('%-32s %8.3f sec' % ('write dirty @file nodes', t_write))
+            client.close()
+
+        loop.run_until_complete(run())
+        aServer.close()
+        loop.run_until_complete(aServer.wait_closed())
+    finally:
+        pool.terminate()
+        shutil.rmtree(directory)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
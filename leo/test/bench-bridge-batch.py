@@ -0,0 +1,100 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907150000.4: * @file ../test/bench-bridge-batch.py
+'''
+Benchmark leoBridge.batch.
+
+Writes n_outlines .leo files of n_nodes nodes each to a temporary
+directory, then opens all of them with leoBridge.batch, using cpu_count..2
+worker processes, and finally in this process alone. Reports the outlines
+per second of each run and checks the results of every job.
+
+Usage: python bench-bridge-batch.py [n_outlines]
+'''
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_outlines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+n_nodes = 200           # Number of nodes in each outline.
+n_lines = 10            # Number of body lines per node.
+files_per_process = 100 # Replace workers after this many outlines.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+
+#@+others
+#@+node:ekr.20180907150000.5: ** job
+def job(c):
+    '''The job run for each outline: return (number of nodes, number of lines).'''
+    n = n_lines = 0
+    for p in c.all_unique_positions():
+        n += 1
+        n_lines += len(p.b.splitlines())
+    return n, n_lines
+#@+node:ekr.20180907150000.6: ** make_outlines
+def make_outlines(directory):
+    '''Write n_outlines .leo files to the given directory. Return their paths.'''
+    vnodes, tnodes = [], []
+    for i in range(n_nodes):
+        gnx = 'bench.20180907150000.%s' % (i + 1)
+        vnodes.append('<v t="%s"><vh>node %s</vh></v>' % (gnx, i))
+        body = '\n'.join(['line %s of node %s' % (j, i) for j in range(n_lines)])
+        tnodes.append('<t tx="%s">%s</t>' % (gnx, body))
+    s = '\n'.join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<leo_file xmlns:leo="http://leoeditor.com/namespaces/leo-python-editor/1.1" >',
+        '<leo_header file_format="2"/>',
+        '<vnodes>',
+    ] + vnodes + [
+        '</vnodes>',
+        '<tnodes>',
+    ] + tnodes + [
+        '</tnodes>',
+        '</leo_file>',
+        '',
+    ])
+    paths = []
+    for i in range(n_outlines):
+        path = os.path.join(directory, 'outline%s.leo' % i)
+        with open(path, 'w') as f:
+            f.write(s)
+        paths.append(path)
+    return paths
+#@+node:ekr.20180907150000.7: ** run
+def run(paths, processes):
+    '''Run batch with the given number of processes. Return outlines per second.'''
+    t1 = time.time()
+    n = 0
+    for path, result, error in leoBridge.batch(paths, job,
+        processes=processes,
+        files_per_process=files_per_process,
+        loadPlugins=False, readSettings=False, silent=True, verbose=False,
+    ):
+        assert not error, error
+        assert result == (n_nodes, n_nodes * n_lines), (path, result)
+        n += 1
+    assert n == len(paths), n
+    return n / (time.time() - t1)
+#@+node:ekr.20180907150000.8: ** main
+def main():
+    directory = tempfile.mkdtemp(prefix='bench-bridge-batch')
+    try:
+        paths = make_outlines(directory)
+        print('%s outlines, %s nodes each' % (n_outlines, n_nodes))
+        print('%10s %12s' % ('processes', 'outlines/sec'))
+        # Run batch in this process last: it creates this process's bridge.
+        n = max(2, multiprocessing.cpu_count())
+        for processes in list(range(n, 1, -1)) + [1]:
+            print('%10s %12.1f' % (processes, run(paths, processes)))
+    finally:
+        shutil.rmtree(directory)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
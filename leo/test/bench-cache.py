@@ -0,0 +1,138 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907183000.12: * @file ../test/bench-cache.py
+'''
+Benchmark the write-back cache of SqlitePickleShare.
+
+Runs n_ops random gets and sets of n_keys keys, first with a copy of the
+old code, which reads from or writes to sqlite for every operation, then
+with the cache, including the time to flush all changes. Then reads all
+keys with get and with get_many after emptying the cache. Checks that
+another connection sees exactly the expected values, that the cache
+notices values that another connection changes, and that setting a value
+changed by another connection is written even if it equals the cached value.
+
+Usage: python bench-cache.py [n_ops]
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+n_keys = 1000
+set_ratio = 0.2         # The fraction of operations that are sets.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.core.leoCache as leoCache
+
+#@+others
+#@+node:ekr.20180907183000.13: ** old_get & old_set
+def old_get(db, key):
+    '''The old SqlitePickleShare.get.'''
+    for row in db.conn.execute('select 1 from cachevalues where key=?;', (key,)):
+        break
+    else:
+        return None
+    for row in db.conn.execute('select data from cachevalues where key=?', (key,)):
+        return db.loader(row[0])
+    return None
+
+def old_set(db, key, value):
+    '''The old SqlitePickleShare.__setitem__.'''
+    data = db.dumper(value)
+    db.conn.execute('replace into cachevalues(key, data) values(?,?);', (key, data))
+#@+node:ekr.20180907183000.14: ** make_ops
+def make_ops():
+    '''Return a list of (key, value) tuples. value is None for gets.'''
+    keys = ['file%s.leo:::key%s' % (i % 50, i) for i in range(n_keys)]
+    ops = []
+    for i in range(n_ops):
+        key = random.choice(keys)
+        if random.random() < set_ratio:
+            if i % 2:
+                value = ','.join('ekr.20180907.%s' % j for j in range(i % 100))
+            else:
+                value = {'n': i, 'list': list(range(i % 20))}
+            ops.append((key, value))
+        else:
+            ops.append((key, None))
+    return keys, ops
+#@+node:ekr.20180907183000.15: ** run
+def run(db, ops, old):
+    '''Run all operations. Return (seconds, expected values).'''
+    expected = {}
+    t1 = time.time()
+    for key, value in ops:
+        if value is None:
+            result = old_get(db, key) if old else db.get(key)
+            assert result == expected.get(key), (key, result)
+        else:
+            if old:
+                old_set(db, key, value)
+            else:
+                db[key] = value
+            expected[key] = value
+    if not old:
+        db.flush()
+    return time.time() - t1, expected
+#@+node:ekr.20180907183000.16: ** main
+def main():
+    random.seed(1)
+    directory = tempfile.mkdtemp(prefix='bench-cache')
+    try:
+        keys, ops = make_ops()
+        print('%s operations on %s keys, %d%% sets' % (n_ops, n_keys, 100 * set_ratio))
+        results = []
+        for old in (True, False):
+            path = os.path.join(directory, 'old' if old else 'new')
+            db = leoCache.SqlitePickleShare(path)
+            t, expected = run(db, ops, old)
+            results.append(t)
+            # Check the values seen by another connection.
+            db2 = leoCache.SqlitePickleShare(path)
+            for key in keys:
+                assert db2.get(key) == expected.get(key), key
+            print('%-28s %8.3f sec' % ('old code' if old else 'write-back cache', t))
+        print('%-28s %8.1f' % ('speedup', results[0] / results[1]))
+        print('hits: %s, misses: %s, flushes: %s' % (db.hits, db.misses, db.flushes))
+        # Read all keys from sqlite.
+        db.uncache()
+        t1 = time.time()
+        values = [db.get(key) for key in keys]
+        t2 = time.time()
+        db.uncache()
+        values2 = db.get_many(keys)
+        t3 = time.time()
+        assert values == values2
+        print('%-28s %8.3f sec' % ('get %s uncached keys' % n_keys, t2 - t1))
+        print('%-28s %8.3f sec' % ('get_many %s uncached keys' % n_keys, t3 - t2))
+        # Changes made by another connection become visible.
+        db2[keys[0]] = 'changed'
+        db2.flush()
+        db.next_version_check = 0.0
+        assert db.get(keys[0]) == 'changed'
+        # Setting a cached value that another connection has changed.
+        db[keys[1]] = 'x'
+        db.flush()
+        db2[keys[1]] = 'y'
+        db2.flush()
+        db[keys[1]] = 'x'
+        db.flush()
+        assert leoCache.SqlitePickleShare(path).get(keys[1]) == 'x'
+        db.close()
+        db2.close()
+    finally:
+        shutil.rmtree(directory)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
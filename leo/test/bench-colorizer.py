@@ -0,0 +1,185 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907160411.3: * @file ../test/bench-colorizer.py
+'''
+Benchmark the line caches of the JEditColorizer, without Qt.
+
+Creates nodes whose bodies are the mode files python.py and latex.py (and
+an html file), then colors them as QSyntaxHighlighter would: each node
+selection colors every line of the body, and each edit recolors lines
+from the changed line until the state of a line doesn't change.
+
+Reports the time to color each node the first time, the time of later
+selections with and without the line caches, and the average number of
+lines recolored and the time taken by each edit. Checks that every coloring
+matches a coloring done without the line caches.
+
+Usage: python bench-colorizer.py [n_switches]
+'''
+import os
+import sys
+import time
+
+# Switches...
+n_switches = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+n_edits = 20        # Number of edits per node.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.core.leoColorizer as leoColorizer
+
+#@+others
+#@+node:ekr.20180907160411.4: ** class Colorizer
+class Colorizer(leoColorizer.JEditColorizer):
+    '''A JEditColorizer whose formats are just tag names.'''
+
+    def setTag(self, tag, s, i, j):
+        self.n_setTag += 1
+        if i != j:
+            self.setFormat(i, j - i, tag.lower())
+#@+node:ekr.20180907160411.5: ** class Highlighter
+class Highlighter(object):
+    '''Emulate the parts of QSyntaxHighlighter used by the JEditColorizer.'''
+
+    def __init__(self, colorizer):
+        self.colorizer = colorizer
+        self.formats = [] # One list of (i, length, format) per line.
+        self.lines = []
+        self.n = 0 # The number of the line being colored.
+        self.states = [] # The state of each line.
+
+    #@+others
+    #@+node:ekr.20180907160411.6: *3* QSyntaxHighlighter methods
+    def blockNumber(self):
+        return self.n
+
+    def currentBlock(self):
+        return self
+
+    def currentBlockState(self):
+        return self.states[self.n]
+
+    def isValid(self):
+        return True
+
+    def previousBlockState(self):
+        return self.states[self.n - 1] if self.n > 0 else -1
+
+    def setCurrentBlockState(self, n):
+        self.states[self.n] = n
+
+    def setFormat(self, i, length, format):
+        self.formats[self.n].append((i, length, format))
+    #@+node:ekr.20180907160411.7: *3* color_line
+    def color_line(self, n):
+        '''Color line n. Return True if its state changed.'''
+        old_state = self.states[n]
+        self.n = n
+        self.formats[n] = []
+        self.colorizer.recolor(self.lines[n])
+        return self.states[n] != old_state
+    #@+node:ekr.20180907160411.8: *3* edit
+    def edit(self, n, s):
+        '''Replace line n by s. Return the number of recolored lines.'''
+        self.lines[n] = s
+        i = n
+        while i < len(self.lines) and self.color_line(i):
+            i += 1
+        return min(i + 1, len(self.lines)) - n
+    #@+node:ekr.20180907160411.9: *3* set_text
+    def set_text(self, s):
+        '''Set the text of the document and color all lines.'''
+        self.lines = s.split('\n')
+        self.formats = [[] for z in self.lines]
+        self.states = [-1 for z in self.lines]
+        for n in range(len(self.lines)):
+            self.color_line(n)
+    #@-others
+#@+node:ekr.20180907160411.10: ** make_outline
+def make_outline():
+    '''Create one node for each test file.'''
+    c = bridge.openLeoFile('')
+    table = (
+        ('python', 'modes', 'python.py'),
+        ('python', 'modes', 'latex.py'),
+        ('html', 'doc', 'html', 'techReport.html'),
+    )
+    p = c.rootPosition()
+    for data in table:
+        path = os.path.join(dir_, 'leo', *data[1:])
+        s, e = g.readFileIntoString(path)
+        p = p.insertAfter()
+        p.h = data[-1]
+        p.b = '@language %s\n%s' % (data[0], s)
+    c.rootPosition().doDelete()
+    return c
+#@+node:ekr.20180907160411.11: ** select
+def select(c, colorizer, p):
+    '''Select p and color its body. Return the elapsed time.'''
+    t1 = time.time()
+    c.selectPosition(p)
+    colorizer.old_v = None # Always color as if p had just been selected.
+    colorizer.highlighter.set_text(p.b)
+    return time.time() - t1
+#@+node:ekr.20180907160411.12: ** check
+def check(c, colorizer, p):
+    '''Check the coloring of p against a coloring without line caches.'''
+    h = colorizer.highlighter
+    colorizer2 = Colorizer(c, None, g.NullObject())
+    colorizer2.highlighter = h2 = Highlighter(colorizer2)
+    colorizer2.max_line_caches = 0
+    h2.set_text('\n'.join(h.lines))
+    assert h.formats == h2.formats, p.h
+    # States are numbered independently.
+    names = [colorizer.stateDict.get(n) for n in h.states]
+    names2 = [colorizer2.stateDict.get(n) for n in h2.states]
+    assert names == names2, p.h
+#@+node:ekr.20180907160411.13: ** main
+def main():
+    c = make_outline()
+    colorizer = Colorizer(c, None, g.NullObject())
+    colorizer.highlighter = Highlighter(colorizer)
+    positions = list(c.all_positions())
+    print('selecting nodes (msec)')
+    print('%-16s %6s %8s %8s %8s' % ('node', 'lines', 'first', 'cached', 'uncached'))
+    first = {}
+    for p in positions:
+        first[p.v] = select(c, colorizer, p)
+    for p in positions:
+        cached = min(select(c, colorizer, p) for i in range(n_switches))
+        check(c, colorizer, p)
+        colorizer.max_line_caches = 0
+        colorizer.line_cache_d.clear()
+        del colorizer.line_cache_vnodes[:]
+        uncached = min(select(c, colorizer, p) for i in range(n_switches))
+        colorizer.max_line_caches = 50
+        print('%-16s %6s %8.1f %8.1f %8.1f' % (
+            p.h, len(colorizer.highlighter.lines),
+            1000 * first[p.v], 1000 * cached, 1000 * uncached))
+    print('')
+    print('editing nodes')
+    print('%-16s %6s %8s' % ('node', 'lines', 'msec'))
+    for p in positions:
+        select(c, colorizer, p)
+        h = colorizer.highlighter
+        n_lines, t = 0, 0.0
+        for i in range(n_edits):
+            n = (i + 1) * len(h.lines) // (n_edits + 1)
+            s = h.lines[n]
+            # Start a string, then end it, so the state changes twice.
+            t1 = time.time()
+            n_lines += h.edit(n, s + " '''")
+            n_lines += h.edit(n, s)
+            t += time.time() - t1
+        check(c, colorizer, p)
+        print('%-16s %6s %8.3f' % (p.h, n_lines / (2.0 * n_edits), 1000 * t / (2 * n_edits)))
+    print('line cache hits: %s, misses: %s' % (
+        colorizer.line_cache_hits, colorizer.line_cache_misses))
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
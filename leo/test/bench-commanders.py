@@ -0,0 +1,69 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907140216.2: * @file ../test/bench-commanders.py
+'''
+Compare the time and memory needed to create headless commanders with
+and without lazy subcommanders.
+
+Creates n_commanders new outlines with bridge.openLeoFile, first with
+g.app.lazySubCommanders False, then with it True. Reports milliseconds
+and kilobytes (as measured by tracemalloc) per commander, including the
+commander's frame and outline. Checks that lazy commanders create their
+subcommanders and commands when first used.
+
+Usage: python bench-commanders.py [n_commanders]
+'''
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Switches...
+n_commanders = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907140216.3: ** measure
+def measure(lazy):
+    '''
+    Return (msec per commander, KB per commander, list of commanders).
+    Measure time and memory separately: tracemalloc is slow.
+    '''
+    g.app.lazySubCommanders = lazy
+    bridge.openLeoFile('') # Do all imports.
+    t1 = time.time()
+    commanders = [bridge.openLeoFile('') for i in range(n_commanders)]
+    t2 = time.time()
+    gc.collect()
+    tracemalloc.start()
+    commanders.extend([bridge.openLeoFile('') for i in range(n_commanders)])
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    n = float(n_commanders)
+    return 1000 * (t2 - t1) / n, size / n / 1024, commanders
+#@+node:ekr.20180907140216.4: ** main
+def main():
+    g.app.silentMode = True
+    print('%s commanders' % n_commanders)
+    print('%10s %10s %10s' % ('lazy', 'msec', 'KB'))
+    for lazy in (False, True):
+        msec, kb, commanders = measure(lazy)
+        print('%10s %10.2f %10.1f' % (lazy, msec, kb))
+        c = commanders[-1]
+        assert bool(c.lazySubCommanders) == lazy
+        assert c.rstCommands and c.findCommands
+        assert 'rst3' in c.commandsDict
+        assert not c.lazySubCommanders.get('rstCommands')
+        for c in commanders:
+            g.app.closeLeoWindow(c.frame)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
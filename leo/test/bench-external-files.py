@@ -0,0 +1,121 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907153012.5: * @file ../test/bench-external-files.py
+'''
+Benchmark the idle-time checks of the ExternalFilesController.
+
+Creates an outline containing n_files @edit nodes whose files exist in a
+temporary directory. Reports the time taken to walk the outline and
+compute the path of each node (what each pass did before the registry
+existed), the time of the first pass (which creates the registry and
+checksums each file), and the files per second, longest tick and number
+of ticks of later passes. Checks that changed files are detected, and that
+the registry follows renamed, inserted and read @<file> nodes.
+
+Usage: python bench-external-files.py [n_files]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+n_passes = 5            # Number of passes after the first.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907153012.6: ** make_outline
+def make_outline(directory):
+    '''Create an outline with n_files @edit nodes, and their files.'''
+    c = bridge.openLeoFile('')
+    root = c.rootPosition()
+    root.h = '@path %s' % directory
+    for i in range(n_files):
+        fn = 'file%s.txt' % i
+        with open(os.path.join(directory, fn), 'w') as f:
+            f.write('line %s\n' % i * 20)
+        p = root.insertAsLastChild()
+        p.h = '@edit %s' % fn
+    return c
+#@+node:ekr.20180907153012.7: ** run_pass
+def run_pass(efc, c):
+    '''Check all files of c, one idle tick at a time. Return (seconds, ticks).'''
+    t1 = time.time()
+    n = 1
+    while not efc.idle_check_commander(c):
+        n += 1
+    return time.time() - t1, n
+#@+node:ekr.20180907220000.2: ** check_registry
+def check_registry(efc, c, directory):
+    '''Check that the registry follows renamed, inserted and read nodes.'''
+    d = efc.get_tracked(c)
+    for fn in ('renamed.txt', 'inserted.txt'):
+        with open(os.path.join(directory, fn), 'w') as f:
+            f.write('%s\n' % fn)
+    # Rename a node. This does not change the structure of the outline.
+    p = c.rootPosition().firstChild()
+    old_path = g.fullPath(c, p)
+    p.h = '@edit renamed.txt'
+    run_pass(efc, c)
+    assert efc.get_tracked(c) is d
+    assert old_path not in d and d.get(g.fullPath(c, p)) == (p.v, p.h)
+    # Insert a node. The next pass rebuilds the registry.
+    p = c.rootPosition().insertAsLastChild()
+    p.h = '@edit inserted.txt'
+    run_pass(efc, c)
+    d = efc.get_tracked(c)
+    assert d.get(g.fullPath(c, p)) == (p.v, p.h)
+    # Read an @edit node.
+    path = g.fullPath(c, p)
+    del d[path]
+    c.atFileCommands.readOneAtEditNode('inserted.txt', p)
+    assert d.get(path) == (p.v, p.h) and p.b.endswith('inserted.txt\n')
+#@+node:ekr.20180907153012.8: ** main
+def main():
+    directory = tempfile.mkdtemp(prefix='bench-external-files')
+    try:
+        # The bridge creates neither of these objects.
+        import leo.core.leoApp as leoApp
+        import leo.core.leoExternalFiles as leoExternalFiles
+        g.app.idleTimeManager = leoApp.IdleTimeManager()
+        g.app.externalFilesController = efc = leoExternalFiles.ExternalFilesController()
+        c = make_outline(directory)
+        changed = []
+        efc.ask = lambda c, path, p=None: changed.append(path)
+        print('%s files, tick budget: %s msec' % (n_files, 1000 * efc.tick_budget))
+        # The cost of each pass without the registry.
+        t1 = time.time()
+        for p in c.all_unique_positions():
+            if p.isAnyAtFileNode():
+                g.fullPath(c, p)
+        print('%-30s %8.3f sec' % ('walk outline', time.time() - t1))
+        t, n = run_pass(efc, c)
+        print('%-30s %8.3f sec, %s ticks' % ('first pass', t, n))
+        efc.n_checked, efc.check_time, efc.max_tick_time = 0, 0.0, 0.0
+        for i in range(n_passes):
+            run_pass(efc, c)
+        efc.show_stats()
+        # Change one file's size and another's contents.
+        paths = sorted(efc.get_tracked(c))
+        with open(paths[0], 'a') as f:
+            f.write('more\n')
+        with open(paths[1], 'r+') as f:
+            f.write('LINE')
+        os.utime(paths[1], (time.time() + 10, time.time() + 10))
+        run_pass(efc, c)
+        assert sorted(changed) == paths[:2], changed
+        check_registry(efc, c, directory)
+    finally:
+        shutil.rmtree(directory)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
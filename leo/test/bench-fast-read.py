@@ -0,0 +1,136 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180903061225.5: * @file ../test/bench-fast-read.py
+'''
+Benchmark fast.readWithIterParse against fast.readWithElementTree.
+
+Creates synthetic .leo files of the given sizes, reads each with both
+readers, checks that both readers create the same tree and reports wall
+time and peak memory (as measured by tracemalloc).
+
+Usage: python bench-fast-read.py [n1 n2 ...]
+
+The default sizes are 10000, 100000 and 1000000 nodes.
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Switches...
+fanout = 10             # Number of children of each organizer node.
+clone_every = 100       # Every nth node is a clone of an earlier leaf.
+ua_every = 50           # Every nth node has a uA.
+sizes = [int(z) for z in sys.argv[1:]] or [10000, 100000, 1000000]
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.core.leoFileCommands as leoFileCommands
+
+#@+others
+#@+node:ekr.20180903061225.6: ** make_leo_file
+def make_leo_file(path, n):
+    '''Write a synthetic .leo file containing about n nodes.'''
+    ua = ' str_color="red"'
+    gnxs = []
+    leaves = []
+    with open(path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file xmlns:leo="http://leoeditor.com/namespaces/leo-python-editor/1.1" >\n'
+            '<leo_header file_format="2"/>\n'
+            '<globals/>\n'
+            '<preferences/>\n'
+            '<find_panel_settings/>\n'
+            '<vnodes>\n')
+
+        def put(level, count):
+            if count[0] >= n:
+                return
+            i = count[0]
+            count[0] += 1
+            if leaves and i % clone_every == 0:
+                gnx = leaves[i % len(leaves)]
+                f.write('<v t="%s"></v>\n' % gnx)
+                return
+            gnx = 'bench.%s' % i
+            gnxs.append(gnx)
+            f.write('<v t="%s"><vh>node %s</vh>' % (gnx, i))
+            if level < 6 and count[0] < n:
+                f.write('\n')
+                for child in range(fanout):
+                    put(level + 1, count)
+            else:
+                leaves.append(gnx)
+            f.write('</v>\n')
+
+        count = [0]
+        while count[0] < n:
+            put(1, count)
+        f.write('</vnodes>\n<tnodes>\n')
+        for i, gnx in enumerate(gnxs):
+            f.write('<t tx="%s"%s>body of %s\nline 2 &lt;tag&gt;\n</t>\n' % (
+                gnx, ua if i % ua_every == 0 else '', gnx))
+        f.write('</tnodes>\n</leo_file>\n')
+#@+node:ekr.20180903061225.7: ** dump_tree
+def dump_tree(hidden_v):
+    '''Return a list describing every node of the tree.'''
+    result, seen = [], set()
+
+    def visit(v):
+        result.append((v.gnx, v._headString, v._bodyString,
+            getattr(v, 'unknownAttributes', None),
+            [z.gnx for z in v.children]))
+        if v.gnx not in seen:
+            seen.add(v.gnx)
+            for child in v.children:
+                visit(child)
+
+    visit(hidden_v)
+    return result
+#@+node:ekr.20180903061225.8: ** read
+def read(c, kind, path, trace_memory):
+    '''Read path with the given reader. Return (hidden_v, seconds, peak).'''
+    fast = leoFileCommands.FastRead(c, {})
+    c.fileCommands.gnxDict = fast.gnx2vnode
+    if trace_memory:
+        tracemalloc.start()
+    t1 = time.time()
+    if kind == 'iterparse':
+        v = fast.readFile(path)
+    else:
+        with open(path, 'rb') as f:
+            v = fast.readWithElementTree(path, f.read())
+    t2 = time.time()
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return v, t2 - t1, peak
+#@+node:ekr.20180903061225.9: ** main
+def main():
+    c = bridge.openLeoFile('')
+    tmp_dir = tempfile.mkdtemp()
+    print('%10s %12s %10s %10s' % ('nodes', 'reader', 'seconds', 'peak MB'))
+    for n in sizes:
+        path = os.path.join(tmp_dir, 'bench-%s.leo' % n)
+        make_leo_file(path, n)
+        trees = {}
+        for kind in ('etree', 'iterparse'):
+            v, seconds, unused_peak = read(c, kind, path, trace_memory=False)
+            trees[kind] = dump_tree(v)
+            v = None
+            unused_v, unused_seconds, peak = read(c, kind, path, trace_memory=True)
+            print('%10s %12s %10.2f %10.1f' % (n, kind, seconds, peak / 1.0e6))
+        assert trees['etree'] == trees['iterparse'], 'trees differ: %s' % n
+        os.remove(path)
+    os.rmdir(tmp_dir)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,228 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907200000.18: * @file ../test/bench-http.py
+'''
+Benchmark serving a large outline with the mod_http plugin.
+
+Creates an outline with n_nodes nodes and serves it on a free port, running
+the server loop in the main thread as Leo's idle handler does, while
+client threads send requests. Reports the time to compute the html of the
+outline with a copy of the old code and with the cache of the plugin, the
+time to get the page (cold and warm), conditional requests (304), pages
+with depth=1 and single subtrees. Checks that the page contains exactly the
+html of the old code, and that the ETag changes after an edit. Finally
+reports the throughput of n_clients clients polling the outline with and
+without ETags.
+
+Usage: python bench-http.py [n_nodes]
+'''
+import os
+import re
+import sys
+import threading
+import time
+try:
+    import http.client as httplib
+    from urllib.parse import quote
+except ImportError:
+    import httplib # Python 2.x
+    from urllib import quote
+
+# Switches...
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+n_children = 20         # Number of children of each node with children.
+n_clients = 8           # Number of polling clients.
+n_polls = 50            # Number of requests per polling client.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.plugins.mod_http as mod_http
+import asyncore
+from xml.sax.saxutils import quoteattr
+
+#@+others
+#@+node:ekr.20180907200000.19: ** make_outline
+def make_outline():
+    '''Create an outline with n_nodes nodes. Return c.'''
+    c = bridge.openLeoFile('')
+    body = ''.join('    if x < %s and y > %s: # & line %s\n' % (i, i, i) for i in range(10))
+    parents = [c.rootPosition()]
+    p = c.rootPosition()
+    p.h, p.b = 'node 0', body
+    for i in range(1, n_nodes):
+        if i < n_children:
+            p = p.insertAfter()
+        else:
+            parent = parents[(i - n_children) // n_children]
+            p = parent.insertAsLastChild()
+        p.h, p.b = '<node> %s' % i, body
+        parents.append(p.copy())
+    return c
+#@+node:ekr.20180907200000.20: ** old_page
+def old_escape(s):
+    '''The old mod_http.escape.'''
+    s = s.replace('&', "&amp;")
+    s = s.replace('<', "&lt;")
+    s = s.replace('>', "&gt;")
+    lines = s.split('\n')
+    result = []
+    blank = chr(32)
+    for line in lines:
+        if line.startswith(blank):
+            resultchars = []
+            startline = True
+            for char in line:
+                if char == blank:
+                    if startline:
+                        resultchars.append('&nbsp;')
+                    else:
+                        resultchars.append(' ')
+                else:
+                    startline = False
+                    resultchars.append(char)
+            result.append(''.join(resultchars))
+        else:
+            result.append(line)
+    s = '\n'.join(result)
+    s = s.replace('\n', '<br />')
+    s = s.replace(chr(9), '&nbsp;&nbsp;&nbsp;&nbsp;')
+    return s
+
+def old_write_node_and_subtree(f, p):
+    '''The old leo_interface.write_node_and_subtree.'''
+    f.write('<div class="node" id=n:%s>' % (
+        quoteattr(p.gnx),
+    ))
+    f.write('<div class="headline" id=h:%s expand="%s" icon="%02d" b=%s>%s</div>' % (
+        quoteattr(p.gnx),
+        '+' if p.hasChildren() else '-',
+        p.computeIcon(),
+        quoteattr(p.b),
+        old_escape(p.h),
+    ))
+    for child in p.children():
+        old_write_node_and_subtree(f, child)
+    f.write('</div>')
+
+def old_page(c):
+    '''Return the encoded html of all nodes, computed by the old code.'''
+    aList = []
+    f = g.Bunch(write=aList.append)
+    for p in c.rootPosition().self_and_siblings():
+        old_write_node_and_subtree(f, p)
+    return g.toEncodedString(''.join(aList), mod_http.browser_encoding)
+#@+node:ekr.20180907200000.25: ** page_gnxs
+def page_gnxs(body):
+    '''
+    Return the gnxs of the node divs of a page, computed from their id
+    attributes as the http_script does.
+    '''
+    s = g.toUnicode(body, mod_http.browser_encoding)
+    ids = re.findall(r'<div class="node" id=([^\s>]+)>', s)
+    return [re.sub('["\']', '', z[2:]) for z in ids]
+#@+node:ekr.20180907200000.21: ** serve
+def serve(target):
+    '''Run target in a thread while serving requests. Return its result.'''
+    result = []
+    thread = threading.Thread(target=lambda: result.append(target()))
+    thread.start()
+    while thread.is_alive():
+        mod_http.plugin_wrapper('idle', {})
+        time.sleep(0.001)
+    thread.join()
+    return result[0]
+#@+node:ekr.20180907200000.22: ** get
+def get(port, url, etag=None):
+    '''Send one GET request. Return (status, ETag, body, seconds).'''
+    t1 = time.time()
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('GET', url, headers={'If-None-Match': etag} if etag else {})
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response.status, response.getheader('ETag'), body, time.time() - t1
+#@+node:ekr.20180907200000.23: ** poll
+def poll(port, url, etag):
+    '''Run n_clients clients sending n_polls requests each. Return requests/sec.'''
+    def client():
+        for i in range(n_polls):
+            status, etag2, body, t = get(port, url, etag)
+            assert status == (304 if etag else 200), status
+    def run():
+        t1 = time.time()
+        threads = [threading.Thread(target=client) for i in range(n_clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return n_clients * n_polls / (time.time() - t1)
+    return serve(run)
+#@+node:ekr.20180907200000.24: ** main
+def main():
+    c = make_outline()
+    c.frame.shortFileName = lambda: 'bench.leo'
+    g.app.windowList.append(c.frame)
+    asyncore.read = mod_http.a_read
+    server = mod_http.Server('127.0.0.1', 0, mod_http.RequestHandler)
+    port = server.socket.getsockname()[1]
+    url = '/bench.leo'
+    print('%s nodes' % len(list(c.all_unique_nodes())))
+    # Compute the html.
+    t1 = time.time()
+    expected = old_page(c)
+    t2 = time.time()
+    cache = mod_http.get_outline_cache(c)
+    mod_http.outline_changed()
+    cache.update()
+    t3 = time.time()
+    mod_http.outline_changed()
+    cache.update()
+    t4 = time.time()
+    assert b''.join(cache.parts) == expected
+    print('%-30s %8.3f sec' % ('html: old code', t2 - t1))
+    print('%-30s %8.3f sec' % ('html: empty cache', t3 - t2))
+    print('%-30s %8.3f sec' % ('html: full cache', t4 - t3))
+    mod_http.outline_caches.clear()
+    # Get the page.
+    status, etag, body, t_cold = serve(lambda: get(port, url))
+    assert status == 200 and expected in body, status
+    status, etag2, body2, t_warm = serve(lambda: get(port, url))
+    assert status == 200 and etag2 == etag and body2 == body
+    status, etag2, body2, t_304 = serve(lambda: get(port, url, etag))
+    assert status == 304 and etag2 == etag and not body2, status
+    print('%-30s %8.3f sec, %s bytes' % ('page: cold', t_cold, len(body)))
+    print('%-30s %8.3f sec' % ('page: warm', t_warm))
+    print('%-30s %8.3f sec' % ('page: not modified (304)', t_304))
+    # Edit a node.
+    p = c.rootPosition().next()
+    p.b = p.b + 'changed\n'
+    status, etag2, body2, t = serve(lambda: get(port, url, etag))
+    assert status == 200 and etag2 != etag and b'changed' in body2, status
+    print('%-30s %8.3f sec' % ('page: after an edit', t))
+    # Lazy loading.
+    status, etag, body, t = serve(lambda: get(port, url + '?depth=1'))
+    assert status == 200 and body.count(b'class="node"') == n_children, status
+    print('%-30s %8.3f sec, %s bytes' % ('page: depth=1', t, len(body)))
+    # Get the gnx of p's subtree as the http_script does.
+    gnx = page_gnxs(body)[1]
+    assert gnx == p.gnx, gnx
+    status, etag, body, t = serve(lambda: get(port, url + '?depth=2&gnx=' + quote(gnx)))
+    assert status == 200 and body.count(b'class="node"') == n_children + 1, status
+    assert page_gnxs(body)[0] == p.gnx
+    print('%-30s %8.3f sec, %s bytes' % ('subtree: depth=2', t, len(body)))
+    status, etag2, body, t = serve(lambda: get(port, url + '?gnx=nosuchgnx'))
+    assert status == 404, status
+    # Poll.
+    status, etag, body, t = serve(lambda: get(port, url))
+    for etag2, kind in ((None, 'full pages'), (etag, 'not modified (304)')):
+        rate = poll(port, url, etag2)
+        print('%-30s %8.1f requests/sec' % ('%s clients: %s' % (n_clients, kind), rate))
+    server.close()
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
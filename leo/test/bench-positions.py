@@ -0,0 +1,163 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180906071745.2: * @file ../test/bench-positions.py
+'''
+Micro-benchmarks for Leo's position iterators.
+
+Times c.all_positions, c.all_unique_positions, p.self_and_subtree,
+p.subtree, c.all_nodes and c.all_unique_nodes, with copy=True and
+copy=False, against reference generators that use p.copy() and
+p.moveToThreadNext. Checks that both generate the same positions.
+
+Creates two synthetic outlines: a plain tree and a clone-heavy tree in
+which every clone_every'th node is a clone of another node.
+
+Usage: python bench-positions.py [n_nodes]
+'''
+import os
+import sys
+import time
+
+# Switches...
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+fanout = 10             # Number of children of each organizer node.
+clone_every = 50        # Every nth node of the clone-heavy tree is a clone.
+repeat = 3              # Report the fastest of this many runs.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.core.leoNodes as leoNodes
+
+#@+others
+#@+node:ekr.20180906071745.3: ** make_outline
+def make_outline(c, n, clones):
+    '''Create about n nodes in c, with clones if clones is True.'''
+    hidden = c.hiddenRootNode
+    hidden.children = []
+    parents, count = [hidden], 0
+    while count < n:
+        next_parents = []
+        for parent_v in parents:
+            for i in range(fanout):
+                if count >= n:
+                    break
+                count += 1
+                if clones and next_parents and count % clone_every == 0:
+                    # Clone a node of the next generation.
+                    # Such nodes are never ancestors of parent_v.
+                    v = next_parents[count % len(next_parents)]
+                    if v in parent_v.children:
+                        continue
+                else:
+                    v = leoNodes.VNode(context=c)
+                    v._headString = 'node %s' % count
+                    next_parents.append(v)
+                v._addLink(len(parent_v.children), parent_v)
+        parents = next_parents
+    c.selectPosition(c.rootPosition())
+#@+node:ekr.20180906071745.4: ** Reference generators
+def ref_all_positions(c, copy=True):
+    p = c.rootPosition()
+    while p:
+        yield p.copy() if copy else p
+        p.moveToThreadNext()
+
+def ref_all_unique_positions(c, copy=True):
+    p = c.rootPosition()
+    seen = set()
+    while p:
+        if p.v in seen:
+            p.moveToNodeAfterTree()
+        else:
+            seen.add(p.v)
+            yield p.copy() if copy else p
+            p.moveToThreadNext()
+
+def ref_subtree(c, copy=True):
+    p = c.rootPosition().copy()
+    after = p.nodeAfterTree()
+    p.moveToThreadNext()
+    while p and p != after:
+        yield p.copy() if copy else p
+        p.moveToThreadNext()
+
+def ref_self_and_subtree(c, copy=True):
+    p = c.rootPosition().copy()
+    after = p.nodeAfterTree()
+    while p and p != after:
+        yield p.copy() if copy else p
+        p.moveToThreadNext()
+
+def ref_all_nodes(c):
+    for p in ref_all_positions(c):
+        yield p.v
+
+def ref_all_unique_nodes(c):
+    for p in ref_all_unique_positions(c, copy=False):
+        yield p.v
+#@+node:ekr.20180906071745.5: ** run
+def run(func):
+    '''Return (seconds, list of keys) for the fastest of repeat runs.'''
+    best = None
+    for i in range(repeat):
+        t1 = time.time()
+        for z in func():
+            pass
+        t2 = time.time()
+        if best is None or t2 - t1 < best:
+            best = t2 - t1
+    keys = []
+    for z in func():
+        if isinstance(z, leoNodes.Position):
+            keys.append((z.v, z._childIndex, tuple(z.stack)))
+        else:
+            keys.append(z)
+    return best, keys
+#@+node:ekr.20180906071745.6: ** main
+def main():
+    c = bridge.openLeoFile('')
+
+    def root():
+        return c.rootPosition()
+
+    table = (
+        ('all_positions', lambda: c.all_positions(), lambda: ref_all_positions(c)),
+        ('all_positions(copy=False)',
+            lambda: c.all_positions(copy=False),
+            lambda: ref_all_positions(c, copy=False)),
+        ('all_unique_positions',
+            lambda: c.all_unique_positions(),
+            lambda: ref_all_unique_positions(c)),
+        ('all_unique_positions(copy=False)',
+            lambda: c.all_unique_positions(copy=False),
+            lambda: ref_all_unique_positions(c, copy=False)),
+        ('subtree', lambda: root().subtree(), lambda: ref_subtree(c)),
+        ('subtree(copy=False)',
+            lambda: root().subtree(copy=False),
+            lambda: ref_subtree(c, copy=False)),
+        ('self_and_subtree',
+            lambda: root().self_and_subtree(),
+            lambda: ref_self_and_subtree(c)),
+        ('all_nodes', lambda: c.all_nodes(), lambda: ref_all_nodes(c)),
+        ('all_unique_nodes', lambda: c.all_unique_nodes(), lambda: ref_all_unique_nodes(c)),
+    )
+    for clones in (False, True):
+        make_outline(c, n_nodes, clones)
+        print('%s nodes, %s positions, %s' % (
+            len(list(c.all_unique_nodes())),
+            len(list(c.all_positions(copy=False))),
+            'with clones' if clones else 'no clones'))
+        print('%35s %10s %10s' % ('iterator', 'reference', 'new'))
+        for name, new_func, ref_func in table:
+            seconds1, keys1 = run(ref_func)
+            seconds2, keys2 = run(new_func)
+            assert keys1 == keys2, name
+            print('%35s %10.3f %10.3f' % (name, seconds1, seconds2))
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,90 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180904055203.6: * @file ../test/bench-read-cache.py
+'''
+Benchmark at.readAll with and without the @file read cache, and with
+various numbers of worker processes.
+
+Creates a project of synthetic @file nodes in a temp directory, writes
+all external files, then times at.readAll:
+
+- without the cache (sentinel scanning only),
+- with a cold cache (scanning, then filling the cache),
+- with a warm cache (rebuilding every tree from the cache),
+- without the cache, scanning files in 2, 4, ... worker processes.
+
+Usage: python bench-read-cache.py [n_files [n_nodes_per_file]]
+'''
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+n_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+n_lines = 20            # Number of body lines per node.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180904055203.7: ** make_project
+def make_project(c, tmp_dir):
+    '''Create and write n_files @file nodes, each with n_nodes children.'''
+    body = ''.join('    x = %s # line %s\n' % (i, i) for i in range(n_lines))
+    root = c.rootPosition()
+    for i in range(n_files):
+        p = root.insertAfter() if i else root
+        p.h = '@file %s' % os.path.join(tmp_dir, 'file_%s.py' % i)
+        p.b = '@others\n'
+        for j in range(n_nodes):
+            child = p.insertAsLastChild()
+            child.h = 'def f%s' % j
+            child.b = 'def f%s():\n%s' % (j, body)
+        p.setDirty()
+        root = p
+    c.atFileCommands.writeAll()
+#@+node:ekr.20180904055203.8: ** dump_outline
+def dump_outline(c):
+    '''Return a list describing all positions of the outline.'''
+    return [(p.level(), p.gnx, p.h, p.b) for p in c.all_positions()]
+#@+node:ekr.20180904055203.9: ** read_all
+def read_all(c, use_cache, workers=0):
+    '''Time at.readAll.'''
+    at = c.atFileCommands
+    at.useReadCache = use_cache
+    at.readWorkers = workers
+    t1 = time.time()
+    at.readAll(c.rootPosition(), force=False)
+    return time.time() - t1
+#@+node:ekr.20180904055203.10: ** main
+def main():
+    g.app.silentMode = True
+    tmp_dir = tempfile.mkdtemp()
+    c = bridge.openLeoFile(os.path.join(tmp_dir, 'bench.leo'))
+    make_project(c, tmp_dir)
+    expected = dump_outline(c)
+    for key in list(g.app.commander_db.keys('%s*' % tmp_dir)):
+        del g.app.commander_db[key[0]]
+    print('%s files, %s nodes per file' % (n_files, n_nodes))
+    table = [('no cache', False, 0), ('cold', True, 0), ('warm', True, 0)]
+    workers = 2
+    while workers <= max(2, multiprocessing.cpu_count()):
+        table.append(('%s workers' % workers, False, workers))
+        workers *= 2
+    for kind, use_cache, workers in table:
+        seconds = read_all(c, use_cache, workers)
+        assert dump_outline(c) == expected, kind
+        print('%10s: %6.2f sec.' % (kind, seconds))
+    shutil.rmtree(tmp_dir)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
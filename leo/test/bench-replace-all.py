@@ -0,0 +1,117 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907103311.7: * @file ../test/bench-replace-all.py
+'''
+Benchmark the replace-all command of the LeoFind class.
+
+Creates an outline of n_nodes nodes whose headlines and bodies contain
+random words, then times replace-all for each search in the table below.
+Checks the result against re.sub applied to each node and checks that
+undo restores the outline.
+
+Usage: python bench-replace-all.py [n_nodes]
+'''
+import os
+import random
+import re
+import sys
+import time
+
+# Switches...
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+fanout = 100            # Number of children of each organizer node.
+n_lines = 5             # Number of body lines per node.
+n_words = 5000          # Number of distinct words.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907103311.8: ** class FindTabManager
+class FindTabManager(object):
+    '''A find tab manager containing only the find and change patterns.'''
+
+    entry_focus = None
+
+    def __init__(self, pattern, change):
+        self.pattern = pattern
+        self.change = change
+
+    def getFindText(self):
+        return self.pattern
+
+    def getReplaceText(self):
+        return self.change
+#@+node:ekr.20180907103311.9: ** make_outline
+def make_outline(c):
+    '''Create about n_nodes nodes containing random words.'''
+    random.seed(42)
+    words = ['w%s' % i for i in range(n_words)]
+    p = c.rootPosition()
+    i = 0
+    while i < n_nodes:
+        p = p.insertAfter()
+        p.h = 'organizer %s' % i
+        for j in range(fanout):
+            child = p.insertAsLastChild()
+            # p.h and p.b are much slower.
+            child.v.setHeadString('node %s %s' % (i, random.choice(words)))
+            child.v.setBodyString(''.join('%s\n' % ' '.join(random.sample(words, 8))
+                for k in range(n_lines)))
+            i += 1
+#@+node:ekr.20180907103311.10: ** contents
+def contents(c):
+    '''Return a list of the headlines and bodies of all nodes.'''
+    return [(v.h, v.b) for v in c.all_unique_nodes()]
+#@+node:ekr.20180907103311.11: ** replace_all
+def replace_all(c, pattern, change, regex=False, whole_word=False):
+    '''Return the time taken by a replace-all command.'''
+    fc = c.findCommands
+    fc.ftm = FindTabManager(pattern, change)
+    fc.find_text = pattern
+    fc.change_text = change
+    fc.pattern_match = regex
+    fc.whole_word = whole_word
+    fc.ignore_case = fc.reverse = False
+    fc.suboutline_only = fc.node_only = False
+    fc.mark_changes = fc.mark_finds = False
+    fc.search_body = fc.search_headline = True
+    c.selectPosition(c.rootPosition())
+    t1 = time.time()
+    fc.changeAll()
+    return time.time() - t1
+#@+node:ekr.20180907103311.12: ** main
+def main():
+    g.app.silentMode = True
+    c = bridge.openLeoFile('')
+    make_outline(c)
+    print('%s nodes' % len(list(c.all_unique_nodes())))
+    table = (
+        ('w1234 ', 'xyz ', False, False, r'w1234 ', 'xyz '),
+        ('w12', 'W12', False, True, r'\bw12\b', 'W12'),
+        (r'w(\d)(\d)\b', r'v\2\1', True, False, r'w(\d)(\d)\b', r'v\2\1'),
+        ('no such text', '', False, False, r'no such text', ''),
+    )
+    print('%20s %8s %10s %10s' % ('pattern', 'nodes', 'replace', 'undo'))
+    for pattern, change, regex, whole_word, ref_pattern, ref_change in table:
+        before = contents(c)
+        expected = [(re.sub(ref_pattern, ref_change, h), re.sub(ref_pattern, ref_change, b))
+            for h, b in before]
+        seconds1 = replace_all(c, pattern, change, regex, whole_word)
+        after = contents(c)
+        assert after == expected, pattern
+        n = len([z for z in zip(before, after) if z[0] != z[1]])
+        t1 = time.time()
+        if n:
+            c.undoer.undo()
+        seconds2 = time.time() - t1
+        assert contents(c) == before, pattern
+        print('%20s %8s %10.3f %10.3f' % (pattern, n, seconds1, seconds2))
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
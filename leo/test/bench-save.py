@@ -0,0 +1,94 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180906051204.4: * @file ../test/bench-save.py
+'''
+Benchmark saving a large .leo file as a function of the number of changed
+nodes, with and without the fragment cache of the FileCommands class.
+
+Creates an outline of n_nodes nodes, saves it once to fill the cache, then
+changes the body and headline of n nodes before each timed save. Checks that
+both ways of saving write the same file.
+
+Usage: python bench-save.py [n_nodes]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+fanout = 250            # Number of children of each organizer node.
+n_lines = 20            # Number of body lines per node.
+n_dirty = [0, 1, 10, 100, 1000, 10000, 100000]
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180906051204.5: ** make_outline
+def make_outline(c):
+    '''Create about n_nodes nodes. Return the list of leaf vnodes.'''
+    body = ''.join('    x = %s < %s # line %s\n' % (i, i + 1, i) for i in range(n_lines))
+    leaves = []
+    p = c.rootPosition()
+    i = 0
+    while len(leaves) < n_nodes:
+        p = p.insertAfter()
+        p.h = 'organizer %s' % i
+        for j in range(min(fanout, n_nodes - len(leaves))):
+            child = p.insertAsLastChild()
+            child.h = 'node %s.%s <&>' % (i, j)
+            child.b = body
+            leaves.append(child.v)
+        i += 1
+    return leaves
+#@+node:ekr.20180906051204.6: ** change_nodes
+def change_nodes(leaves, n, generation):
+    '''Change the body and headline of n leaves, spread evenly.'''
+    if n:
+        for v in leaves[::max(1, len(leaves) // n)][:n]:
+            v.setHeadString('%s gen %s' % (v.h.split(' gen ')[0], generation))
+            v.setBodyString(v.b + '# gen %s\n' % generation)
+#@+node:ekr.20180906051204.7: ** save
+def save(c, use_cache):
+    '''Save c's outline. Return (seconds, contents of the file).'''
+    fc = c.fileCommands
+    if not use_cache:
+        fc.vnodeCache.clear()
+        fc.tnodeCache.clear()
+    c.config.set(None, 'bool', 'cache-leo-file-fragments', use_cache, warn=False)
+    t1 = time.time()
+    ok = fc.write_Leo_file(c.mFileName, outlineOnlyFlag=True)
+    t2 = time.time()
+    assert ok, c.mFileName
+    with open(c.mFileName, 'rb') as f:
+        s = f.read()
+    return t2 - t1, s
+#@+node:ekr.20180906051204.8: ** main
+def main():
+    g.app.silentMode = True
+    tmp_dir = tempfile.mkdtemp()
+    c = bridge.openLeoFile(os.path.join(tmp_dir, 'bench.leo'))
+    leaves = make_outline(c)
+    print('%s nodes' % len(leaves))
+    print('%10s %10s %10s' % ('changed', 'no cache', 'cache'))
+    for generation, n in enumerate(n_dirty):
+        if n > len(leaves):
+            break
+        save(c, use_cache=True) # Fill the cache.
+        change_nodes(leaves, n, generation)
+        seconds2, s2 = save(c, use_cache=True)
+        seconds1, s1 = save(c, use_cache=False)
+        assert s1 == s2, n
+        print('%10s %10.2f %10.2f' % (n, seconds1, seconds2))
+    shutil.rmtree(tmp_dir)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
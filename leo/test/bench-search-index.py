@@ -0,0 +1,114 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907090145.19: * @file ../test/bench-search-index.py
+'''
+Benchmark find-all and clone-find-all with and without the search index
+of the LeoFind class, and check that both find the same nodes.
+
+Creates an outline of n_nodes nodes whose headlines and bodies contain
+random words, computes all signatures of the search index, then times
+each search in the table below.
+
+Usage: python bench-search-index.py [n_nodes]
+'''
+import os
+import random
+import sys
+import time
+
+# Switches...
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+fanout = 100            # Number of children of each organizer node.
+n_lines = 5             # Number of body lines per node.
+n_words = 5000          # Number of distinct words.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907090145.20: ** class FindTabManager
+class FindTabManager(object):
+    '''A find tab manager containing only the find pattern.'''
+
+    entry_focus = None
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def getFindText(self):
+        return self.pattern
+
+    def getReplaceText(self):
+        return ''
+#@+node:ekr.20180907090145.21: ** make_outline
+def make_outline(c):
+    '''Create about n_nodes nodes containing random words.'''
+    random.seed(42)
+    words = ['w%s' % i for i in range(n_words)]
+    p = c.rootPosition()
+    i = 0
+    while i < n_nodes:
+        p = p.insertAfter()
+        p.h = 'organizer %s' % i
+        for j in range(fanout):
+            child = p.insertAsLastChild()
+            # p.h and p.b are much slower.
+            child.v.setHeadString('node %s %s' % (i, random.choice(words)))
+            child.v.setBodyString(''.join('%s\n' % ' '.join(random.sample(words, 8))
+                for k in range(n_lines)))
+            i += 1
+#@+node:ekr.20180907090145.22: ** find_all
+def find_all(c, pattern, use_index, clone=False, regex=False):
+    '''Return (seconds, result) for a find-all or clone-find-all command.'''
+    fc = c.findCommands
+    c.config.set(None, 'bool', 'use-search-index', use_index, warn=False)
+    fc.ftm = FindTabManager(pattern)
+    fc.find_text = pattern
+    fc.pattern_match = regex
+    fc.ignore_case = fc.whole_word = fc.reverse = False
+    fc.suboutline_only = fc.node_only = False
+    fc.mark_changes = fc.mark_finds = False
+    fc.search_body = fc.search_headline = True
+    c.selectPosition(c.rootPosition())
+    c.clearAllVisited()
+    t1 = time.time()
+    n = fc.findAll(clone_find_all=clone)
+    t2 = time.time()
+    result = [n]
+    if n:
+        found = c.lastTopLevel()
+        result.extend([found.b, [v.gnx for v in found.v.children]])
+        found.doDelete()
+    return t2 - t1, result
+#@+node:ekr.20180907090145.23: ** main
+def main():
+    g.app.silentMode = True
+    c = bridge.openLeoFile('')
+    make_outline(c)
+    print('%s nodes' % len(list(c.all_unique_nodes())))
+    index = c.findCommands.searchIndex
+    index.budget = 1000000
+    t1 = time.time()
+    index.searchTree('w1 w2')
+    print('computed all signatures in %4.2f sec.' % (time.time() - t1))
+    table = (
+        ('w1234 w', False, False),
+        ('no such text', False, False),
+        (r'w12\d+ w3', False, True),
+        ('node 12 w', True, False),
+        ('w4 w5', True, False),
+    )
+    print('%20s %6s %10s %10s' % ('pattern', 'clone', 'no index', 'index'))
+    for pattern, clone, regex in table:
+        seconds1, result1 = find_all(c, pattern, False, clone, regex)
+        seconds2, result2 = find_all(c, pattern, True, clone, regex)
+        assert result1 == result2, pattern
+        print('%20s %6s %10.3f %10.3f' % (pattern, clone, seconds1, seconds2))
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,149 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907180000.3: * @file ../test/bench-unl.py
+'''
+Benchmark computing and resolving UNLs in an outline whose nodes have
+many children.
+
+Creates an outline with n_children top-level nodes, each of whose
+headlines appears n_same times, and gives the first few nodes n_children
+children each. Reports the time to compute the UNLs of n_unls nodes with
+p.get_UNL and with a copy of the old code, which counted previous
+siblings, and the time to resolve them with g.recursiveUNLFind and
+g.findUNLs. Checks that every UNL resolves to its node, also after
+changing headlines and inserting and deleting nodes, and that reading an
+@file node updates the headline index of the other parents of its clones.
+
+Usage: python bench-unl.py [n_children]
+'''
+import os
+import random
+import sys
+import time
+
+# Switches...
+n_children = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+n_parents = 5           # Number of top-level nodes with children.
+n_same = 5              # Number of siblings with the same headline.
+n_unls = 2000           # Number of UNLs to compute and resolve.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907180000.4: ** make_outline
+def make_outline():
+    '''Create the outline. Return (c, list of all positions).'''
+    c = bridge.openLeoFile('')
+    p = c.rootPosition()
+    for i in range(n_children):
+        p = p.insertAfter()
+        p.h = 'node %s' % (i % (n_children // n_same))
+    c.rootPosition().doDelete()
+    for p in list(c.rootPosition().self_and_siblings())[:n_parents]:
+        for i in range(n_children):
+            child = p.insertAsLastChild()
+            child.h = 'child %s' % (i % (n_children // n_same))
+    return c, list(c.all_positions())
+#@+node:ekr.20180907180000.5: ** old_get_UNL
+def old_get_UNL(p):
+    '''The old p.get_UNL(with_file=False, with_count=True).'''
+    aList = []
+    for i in p.self_and_parents(copy=False):
+        count = 0
+        ind = 0
+        p2 = i.copy()
+        while p2.hasBack():
+            ind = ind + 1
+            p2.moveToBack()
+            if i.h == p2.h:
+                count = count + 1
+        aList.append(i.h.replace('-->', '--%3E') + ":" + str(ind) + "," + str(count))
+    return '-->'.join(reversed(aList))
+#@+node:ekr.20180907180000.6: ** compute
+def compute(positions):
+    '''Compute the UNLs of positions. Return (UNLs, seconds, old seconds).'''
+    t1 = time.time()
+    unls = [p.get_UNL(with_file=False, with_count=True) for p in positions]
+    t2 = time.time()
+    old_unls = [old_get_UNL(p) for p in positions]
+    t3 = time.time()
+    assert unls == old_unls
+    return unls, t2 - t1, t3 - t2
+#@+node:ekr.20180907180000.7: ** resolve
+def resolve(c, positions, unls):
+    '''Resolve the UNLs one at a time, then all at once. Return seconds.'''
+    t1 = time.time()
+    results = [g.recursiveUNLFind(unl.split('-->'), c) for unl in unls]
+    t2 = time.time()
+    results2 = g.findUNLs(unls, c)
+    t3 = time.time()
+    for p, result, result2 in zip(positions, results, results2):
+        assert result[0] and result[2] == p, (p.h, result)
+        assert result2[0] and result2[2] == p, (p.h, result2)
+    return t2 - t1, t3 - t2
+#@+node:ekr.20180907180000.8: ** edit
+def edit(c, positions):
+    '''
+    Change headlines and insert and delete nodes. Return all positions.
+    positions must be in outline order. Edit them in reverse order, so
+    each edit leaves the positions still to be edited valid.
+    '''
+    for i, p in reversed(list(enumerate(positions))):
+        if i % 3 == 0:
+            p.h = p.h + ' changed'
+        elif i % 3 == 1:
+            p.insertAfter().h = p.h
+        elif not p.hasChildren():
+            p.doDelete()
+    return list(c.all_positions())
+#@+node:ekr.20180907220000.4: ** read_clone
+def read_clone(c):
+    '''
+    Check that reading an @file node that changes the headline of a clone
+    updates the headline index of the clone's other parent.
+    '''
+    import leo.core.leoAtFile as leoAtFile
+    parent = c.rootPosition()
+    h = parent.firstChild().h
+    child = parent.firstChild().next().next().next()
+    root = parent.insertAfter()
+    root.h = '@file unl.py'
+    child.clone().moveToLastChildOf(root)
+    indices = parent.v.childIndices(h)
+    assert child.childIndex() not in indices
+    s = ''.join([
+        '#@+leo-ver=5-thin\n',
+        '#@+node:%s: * @file unl.py\n' % root.gnx,
+        '#@+others\n',
+        '#@+node:%s: ** %s\n' % (child.gnx, h),
+        '#@-others\n',
+        '#@-leo\n',
+    ])
+    leoAtFile.FastAtRead(c, c.fileCommands.gnxDict).read_into_root(s, 'unl.py', root)
+    assert child.h == h
+    assert parent.v.childIndices(h) == sorted(indices + [child.childIndex()])
+#@+node:ekr.20180907180000.9: ** main
+def main():
+    random.seed(1)
+    c, positions = make_outline()
+    print('%s children, %s positions, %s UNLs' % (n_children, len(positions), n_unls))
+    print('%-12s %10s %10s %10s %10s' % (
+        '', 'get_UNL', 'old', 'find', 'findUNLs'))
+    for kind in ('first', 'second', 'after edits'):
+        if kind == 'after edits':
+            indices = sorted(random.sample(range(len(positions)), 30))
+            positions = edit(c, [positions[i] for i in indices])
+        sample = random.sample(positions, n_unls)
+        unls, t_new, t_old = compute(sample)
+        t_find, t_many = resolve(c, sample, unls)
+        print('%-12s %10.3f %10.3f %10.3f %10.3f' % (kind, t_new, t_old, t_find, t_many))
+    read_clone(c)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
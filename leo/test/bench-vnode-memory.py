@@ -0,0 +1,104 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180906062318.3: * @file ../test/bench-vnode-memory.py
+'''
+Compare the memory used by VNodes with and without slots.
+
+Creates synthetic outlines of n nodes, first using DictVNode, a copy of
+the VNode class as it was before VNodes had slots, then using the present
+VNode class. Reports bytes per node (as measured by tracemalloc),
+including headlines, gnx's and all links, but not body text.
+
+Usage: python bench-vnode-memory.py [n1 n2 ...]
+
+The default size is 1000000 nodes.
+'''
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Switches...
+fanout = 10             # Number of children of each organizer node.
+sizes = [int(z) for z in sys.argv[1:]] or [1000000]
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.core.leoNodes as leoNodes
+
+#@+others
+#@+node:ekr.20180906062318.4: ** class DictVNode
+class DictVNode(object):
+    '''The ivars of a VNode before VNodes had slots.'''
+
+    def __init__(self, context, gnx=None):
+        self._headString = g.u('newHeadline')
+        self._bodyString = g.u('')
+        self.children = []
+        self.parents = []
+        self.fileIndex = None
+        self.iconVal = 0
+        self.statusBits = 0
+        self.context = context
+        self.expandedPositions = []
+        self.insertSpot = None
+        self.scrollBarSpot = None
+        self.selectionLength = 0
+        self.selectionStart = 0
+        g.app.nodeIndices.new_vnode_helper(context, gnx, self)
+#@+node:ekr.20180906062318.5: ** make_outline
+def make_outline(c, cls, n):
+    '''Create an outline of n nodes of the given class. Return the root.'''
+    root = cls(context=c, gnx='bench.root')
+    parents, count = [root], 0
+    while count < n:
+        next_parents = []
+        for parent_v in parents:
+            for i in range(fanout):
+                if count >= n:
+                    break
+                v = cls(context=c, gnx='bench.%s' % count)
+                v._headString = 'node %s' % count
+                parent_v.children.append(v)
+                v.parents.append(parent_v)
+                next_parents.append(v)
+                count += 1
+        parents = next_parents
+    return root
+#@+node:ekr.20180906062318.6: ** measure
+def measure(c, cls, n):
+    '''Return (bytes per node, seconds) for an outline of n nodes.'''
+    c.fileCommands.gnxDict = {}
+    gc.collect()
+    tracemalloc.start()
+    t1 = time.time()
+    root = make_outline(c, cls, n)
+    t2 = time.time()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert root.children
+    root = None
+    c.fileCommands.gnxDict = {}
+    return size / float(n), t2 - t1
+#@+node:ekr.20180906062318.7: ** main
+def main():
+    c = bridge.openLeoFile('')
+    # Plugins may still add ivars to VNodes.
+    v = leoNodes.VNode(context=c)
+    v.pluginData = 'data'
+    assert v.pluginData == 'data'
+    assert v.expandedPositions == [] and v.insertSpot is None
+    print('%10s %10s %12s %10s' % ('nodes', 'class', 'bytes/node', 'seconds'))
+    for n in sizes:
+        for cls in (DictVNode, leoNodes.VNode):
+            per_node, seconds = measure(c, cls, n)
+            print('%10s %10s %12.1f %10.2f' % (n, cls.__name__, per_node, seconds))
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,109 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907190000.17: * @file ../test/bench-vr-render.py
+'''
+Benchmark the RenderQueue class used by the viewrendered plugin, without Qt.
+
+Creates an rST document with n_sections sections and reports the time
+docutils takes to render it, which is how long the viewrendered plugin
+used to block Leo. Then simulates typing: requests the html of n_edits
+versions of the document, one every edit_delay seconds, polling the queue
+as vr.on_render_timer does. Reports the longest time any call blocked the
+caller and the time from the last edit until its html was shown. Checks
+that a worker process shows only the html of the latest version, and
+that it matches the html rendered directly. Finally reports the time to
+show a version that is in the cache.
+
+Usage: python bench-vr-render.py [n_sections]
+'''
+import os
+import sys
+import time
+
+# Switches...
+n_sections = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+n_edits = 20
+edit_delay = 0.1        # Seconds between edits.
+poll_delay = 0.02       # Seconds between calls to poll, like vr.render_timer.
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+import leo.plugins.vr_render as vr_render
+
+#@+others
+#@+node:ekr.20180907190000.18: ** make_document
+def make_document():
+    '''Return an rST document with n_sections sections.'''
+    result = ['Title\n=====\n\n']
+    for i in range(n_sections):
+        title = 'Section %s' % i
+        result.append('%s\n%s\n\n' % (title, '-' * len(title)))
+        result.append('Some *emphasized* text and ``code`` in section %s.\n\n' % i)
+        result.append('- item one\n- item two\n\n')
+    return ''.join(result)
+#@+node:ekr.20180907190000.19: ** timed
+def timed(f, *args):
+    '''Call f(*args). Return (result, seconds).'''
+    t1 = time.time()
+    result = f(*args)
+    return result, time.time() - t1
+#@+node:ekr.20180907190000.20: ** type_edits
+def type_edits(rq, s):
+    '''
+    Request n_edits versions of s, polling rq between edits.
+    Return (the shown html, the longest call, seconds from the last edit
+    until the html was shown).
+    '''
+    shown, longest = [], 0.0
+    t_next = time.time()
+    for i in range(n_edits + 1):
+        if i < n_edits:
+            s += 'x'
+            html, t = timed(rq.request, 'rst', s, None)
+            longest = max(longest, t)
+            t_last = time.time()
+            if html is not None:
+                shown.append((html, t_last))
+            t_next = t_last + edit_delay
+        # Poll until the next edit or until all renderings are done.
+        while rq.busy() and (i == n_edits or time.time() < t_next):
+            time.sleep(poll_delay)
+            html, t = timed(rq.poll)
+            longest = max(longest, t)
+            if html is not None:
+                shown.append((html, time.time()))
+    # Leo's process renders (and shows) every version.
+    assert len(shown) == (1 if rq.workers else n_edits), len(shown)
+    html, t_shown = shown[-1]
+    assert html == vr_render.render_worker(('rst', s, None, ()))[0]
+    return html, longest, t_shown - t_last
+#@+node:ekr.20180907190000.21: ** main
+def main():
+    s = make_document()
+    (html, seconds), t_direct = timed(vr_render.render_worker, ('rst', s, None, ()))
+    print('%s sections, %s characters' % (n_sections, len(s)))
+    print('%-36s %8.3f sec' % ('render in Leo\'s process', t_direct))
+    for workers in (0, 1):
+        rq = vr_render.RenderQueue(workers=workers)
+        # Start the worker process.
+        rq.request('rst', 'x', None)
+        while rq.busy():
+            time.sleep(poll_delay)
+            rq.poll()
+        html, longest, latency = type_edits(rq, s)
+        print('workers: %s' % workers)
+        print('  %-34s %8.3f sec' % ('longest blocking call', longest))
+        print('  %-34s %8.3f sec' % ('last edit until shown', latency))
+        html, t = timed(rq.request, 'rst', s + 'x', None)
+        assert html is not None
+        print('  %-34s %8.3f sec' % ('show cached version', t))
+        print('  ' + rq.stats().replace('\n', '\n  '))
+        rq.close()
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,114 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907172000.7: * @file ../test/bench-write-behind.py
+'''
+Benchmark writing the @file nodes of a project with and without the
+write-behind threads of the AtFile class.
+
+Creates an outline containing n_files @file nodes in a temporary
+directory. For each number of threads, changes every node and writes all
+@file nodes, then writes them again without changes. Reports the time of
+both writes and checks that all files contain what Leo wrote. Finally
+checks that a file that can't be written leaves the same dirty and orphan
+bits with and without threads.
+
+Usage: python bench-write-behind.py [n_files]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+n_lines = 200           # Number of body lines per file.
+n_threads = [0, 1, 2, 4]
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907172000.8: ** make_outline
+def make_outline(c, directory):
+    '''
+    Create n_files @file nodes for files in directory.
+    Return the list of @file nodes.
+    '''
+    root = c.rootPosition()
+    root.h = '@path %s' % directory
+    result = []
+    for i in range(n_files):
+        p = root.insertAsLastChild()
+        p.h = '@file file%s.py' % i
+        result.append(p.copy())
+    return result
+#@+node:ekr.20180907172000.9: ** write_all
+def write_all(c, threads):
+    '''Write all @file nodes using the given number of threads. Return seconds.'''
+    at = c.atFileCommands
+    at.writeThreads = threads
+    c.selectPosition(c.rootPosition())
+    t1 = time.time()
+    at.writeAll(writeAtFileNodesFlag=True)
+    return time.time() - t1
+#@+node:ekr.20180907172000.10: ** check_files
+def check_files(c, directory, positions, marker):
+    '''Check that every file ends with the given marker.'''
+    for p in positions:
+        fn = os.path.join(directory, p.h[len('@file '):])
+        s, e = g.readFileIntoString(fn)
+        assert s and marker in s, (fn, marker)
+        assert not p.isDirty() and not p.isOrphan(), p.h
+#@+node:ekr.20180907172000.11: ** check_errors
+def check_errors(c, directory, positions):
+    '''
+    Make one file unwritable, then write it with and without threads.
+    Return the dirty and orphan bits of its node after each write.
+    '''
+    p = positions[0]
+    fn = os.path.join(directory, p.h[len('@file '):])
+    os.remove(fn)
+    os.mkdir(fn) # Neither os.rename nor open can replace a directory.
+    result = []
+    for threads in (0, 2):
+        p.b = p.b + '# error %s\n' % threads
+        p.setDirty()
+        write_all(c, threads)
+        result.append((threads, p.isDirty(), p.isOrphan()))
+        p.clearOrphan()
+    os.rmdir(fn)
+    return result
+#@+node:ekr.20180907172000.12: ** main
+def main():
+    g.app.silentMode = True
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        c = bridge.openLeoFile(os.path.join(tmp_dir, 'bench.leo'))
+        positions = make_outline(c, tmp_dir)
+        body = ''.join('x = %s < %s # line %s\n' % (i, i + 1, i) for i in range(n_lines))
+        print('%s files, %s lines each' % (n_files, n_lines))
+        print('%8s %10s %10s' % ('threads', 'changed', 'unchanged'))
+        for threads in n_threads:
+            marker = '# threads: %s\n' % threads
+            for p in positions:
+                p.b = body + marker
+            changed = write_all(c, threads)
+            unchanged = write_all(c, threads)
+            check_files(c, tmp_dir, positions, marker)
+            print('%8s %10.2f %10.2f' % (threads, changed, unchanged))
+        results = check_errors(c, tmp_dir, positions)
+        print('dirty and orphan bits after errors: %s' % results)
+        assert results[0][1:] == results[1][1:], results
+        leftovers = [z for z in os.listdir(tmp_dir) if z.endswith('.tmp')]
+        assert not leftovers, leftovers
+    finally:
+        shutil.rmtree(tmp_dir)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
@@ -0,0 +1,111 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20180907165220.4: * @file ../test/bench-write-digests.py
+'''
+Benchmark writing the @file nodes of a project, with and without the file
+digests of the AtFile class.
+
+Creates an outline containing n_files @file nodes in a temporary
+directory and writes all of them once. Then changes n of the nodes and
+writes all @file nodes again, first after forgetting all digests (so
+every external file is read back and compared) and then using the
+digests. Reports the time and the number of bytes read (on Linux) by
+each write, and checks that all files are up to date after each write.
+
+Usage: python bench-write-digests.py [n_files]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Switches...
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+n_lines = 200           # Number of body lines per file.
+n_changed = [0, 10, 100]
+
+dir_ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if dir_ not in sys.path:
+    sys.path.insert(0, dir_)
+import leo.core.leoBridge as leoBridge
+bridge = leoBridge.controller(gui='nullGui',
+    loadPlugins=False, readSettings=False, silent=True, verbose=False)
+g = bridge.globals()
+
+#@+others
+#@+node:ekr.20180907165220.5: ** bytes_read
+def bytes_read():
+    '''Return the number of bytes this process has read, or None.'''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+#@+node:ekr.20180907165220.6: ** make_outline
+def make_outline(c, directory):
+    '''
+    Create n_files @file nodes for files in directory.
+    Return the list of @file nodes.
+    '''
+    body = ''.join('x = %s < %s # line %s\n' % (i, i + 1, i) for i in range(n_lines))
+    root = c.rootPosition()
+    root.h = '@path %s' % directory
+    result = []
+    for i in range(n_files):
+        p = root.insertAsLastChild()
+        p.h = '@file file%s.py' % i
+        p.b = body
+        result.append(p.v)
+    return result
+#@+node:ekr.20180907165220.7: ** write_all
+def write_all(c, use_digests):
+    '''Write all @file nodes. Return (seconds, bytes read).'''
+    at = c.atFileCommands
+    if not use_digests:
+        at.fileDigests.clear()
+    c.selectPosition(c.rootPosition())
+    n1, t1 = bytes_read(), time.time()
+    at.writeAll(writeAtFileNodesFlag=True)
+    t2, n2 = time.time(), bytes_read()
+    return t2 - t1, n1 is not None and n2 - n1
+#@+node:ekr.20180907165220.8: ** stat_files
+def stat_files(directory):
+    '''Return a dict of the sizes and modification times of all files in directory.'''
+    d = {}
+    for fn in os.listdir(directory):
+        st = os.stat(os.path.join(directory, fn))
+        d[fn] = st.st_size, st.st_mtime
+    return d
+#@+node:ekr.20180907165220.9: ** main
+def main():
+    g.app.silentMode = True
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        c = bridge.openLeoFile(os.path.join(tmp_dir, 'bench.leo'))
+        at = c.atFileCommands
+        files = make_outline(c, tmp_dir)
+        write_all(c, use_digests=True)
+        print('%s files, %s lines each' % (n_files, n_lines))
+        print('%8s %10s %12s %10s %12s' % (
+            'changed', 'no digests', 'bytes read', 'digests', 'bytes read'))
+        for generation, n in enumerate(n_changed):
+            results = []
+            for use_digests in (False, True):
+                for v in files[:n]:
+                    v.b = v.b + '# generation %s %s\n' % (generation, use_digests)
+                results.extend(write_all(c, use_digests))
+                # Check that writing all files without digests changes no file.
+                stats = stat_files(tmp_dir)
+                write_all(c, use_digests=False)
+                assert stats == stat_files(tmp_dir), (n, use_digests)
+            print('%8s %10.2f %12s %10.2f %12s' % tuple([n] + results))
+        print('digest hits: %s, misses: %s' % (at.digestHits, at.digestMisses))
+    finally:
+        shutil.rmtree(tmp_dir)
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo